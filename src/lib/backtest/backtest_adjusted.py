@@ -1,17 +1,38 @@
 import numpy as np
-from tqdm.notebook import tqdm
 import pandas as pd
-import random
 import matplotlib.pyplot as plt
 import seaborn as sns
 from IPython.display import display
 
+from lib.backtest.grid_search import grid_search
+from lib.backtest.sweep import float_range, run_sweep
+
+# 以下四個函數保留原本的呼叫方式，實際的抽樣與回測都交給 lib.backtest.sweep.run_sweep。
+# 共同的選用參數：
+#   seed       : 亂數種子；None 則沿用全域 random 模組
+#   batch_func : 對應策略的 *_batch 函數，提供時以批次模式同時回測多組參數
+#   chunk_size : 批次模式下每次同時回測的參數組數
+#   n_jobs     : 平行行程數，-1 表示使用所有 CPU 核心；結果與 n_jobs 無關
+#   executor   : 自行提供的 executor，提供時忽略 n_jobs
+#   store      : lib.backtest.sweep_store.SweepStore，結果邊執行邊存入 SQLite，
+#                已回測過的參數組直接取用，中斷後重新執行即從斷點繼續
+# 參數組不會重複回測，因此 iterations 超過可行組合總數時，實際測試次數會較少。
+# 策略二、三的參數都是整數，另有 grid_analysis_two / three 回測所有可行組合，
+# 回傳 lib.backtest.grid_search.ParameterSurface（績效曲面與鄰域平均），可用 plot_parameter_surface 繪製。
+
+
 def sensitivity_analysis_one(
     df_original,
     backtest_func,
     performance_func,
     param_ranges=None,
-    iterations=100
+    iterations=100,
+    batch_func=None,
+    chunk_size=1024,
+    seed=None,
+    n_jobs=1,
+    executor=None,
+    store=None
 ):
     """
     通用敏感度分析函數 (適用於策略一)
@@ -32,6 +53,8 @@ def sensitivity_analysis_one(
             'bb_std': (1.0, 3.0),
             'drop_threshold': (0.1, 0.9)
         }
+        限制條件：ma_period < bb_period
+        bb_std 與 drop_threshold 以抽樣的原值回測，結果表中取到小數第二位
     iterations : int
         隨機測試次數
 
@@ -49,225 +72,163 @@ def sensitivity_analysis_one(
             'drop_threshold': (0.1, 0.9)
         }
 
-    results_list = []
-    print(f"準備進行 {iterations} 次隨機參數測試...")
-
-    for _ in tqdm(range(iterations), desc="執行進度"):
-        # 隨機生成參數
-        ma_p = random.randint(*param_ranges['ma_period'])
-        bb_p = random.randint(*param_ranges['bb_period'])
-        while bb_p <= ma_p:
-            bb_p = random.randint(*param_ranges['bb_period'])
-        bb_s = random.uniform(*param_ranges['bb_std'])
-        drop_t = random.uniform(*param_ranges['drop_threshold'])
-
-        # 回測
-        df_result = backtest_func(
-            df_original.copy(),
-            ma_period=ma_p,
-            bb_period=bb_p,
-            bb_std=bb_s,
-            drop_threshold=drop_t
-        )
-
-        # 計算績效
-        df_result['entry'] = (df_result['position'] == 1) & (df_result['position'].shift(1) == 0)
-        df_result['exit'] = (df_result['position'] == 0) & (df_result['position'].shift(1) == 1)
-        performance = performance_func(df_result)
-
-        # 儲存結果
-        run_results = {
-            'ma_period': ma_p,
-            'bb_period': bb_p,
-            'bb_std': round(bb_s, 2),
-            'drop_threshold': round(drop_t, 2)
-        }
-        run_results.update(performance)
-        results_list.append(run_results)
-
-    results_df = pd.DataFrame(results_list)
-
-    return results_df
+    param_space = {
+        'ma_period': param_ranges['ma_period'],
+        'bb_period': param_ranges['bb_period'],
+        'bb_std': float_range(*param_ranges['bb_std'], report_digits=2),
+        'drop_threshold': float_range(*param_ranges['drop_threshold'], report_digits=2),
+    }
+    return run_sweep(
+        df_original, backtest_func, performance_func, param_space,
+        constraints=['ma_period < bb_period'], iterations=iterations, seed=seed,
+        batch_func=batch_func, chunk_size=chunk_size, n_jobs=n_jobs, executor=executor,
+        store=store
+    )
 
-def sensitivity_analysis_three(
+def sensitivity_analysis_two(
     df_original,
     backtest_func,
     performance_func,
     param_ranges,
-    iterations=100
+    iterations=100,
+    batch_func=None,
+    chunk_size=1024,
+    seed=None,
+    n_jobs=1,
+    executor=None,
+    store=None
 ):
     """
     敏感度分析函數 (適用於策略二)
-    """
-    results_list = []
-    print(f"準備進行 {iterations} 次隨機參數測試...")
-
-    for _ in tqdm(range(iterations), desc="執行進度"):
-        # 隨機生成參數
-        short_ma = random.randint(*param_ranges['short_ma_period'])
-        long_ma = random.randint(*param_ranges['long_ma_period'])
-        while short_ma >= long_ma:
-            short_ma = random.randint(*param_ranges['short_ma_period'])
-            long_ma = random.randint(*param_ranges['long_ma_period'])
-
-        # 回測
-        df_result = backtest_func(
-            df_original.copy(),
-            short_ma_period=short_ma,
-            long_ma_period=long_ma
-        )
 
-        # 計算績效
-        df_result['entry'] = (df_result['position'] == 1) & (df_result['position'].shift(1) == 0)
-        df_result['exit'] = (df_result['position'] == 0) & (df_result['position'].shift(1) == 1)
-        performance = performance_func(df_result)
-
-        # 儲存結果
-        run_results = {
-            'short_ma_period': short_ma,
-            'long_ma_period': long_ma,
-        }
-        run_results.update(performance)
-        results_list.append(run_results)
-
-    results_df = pd.DataFrame(results_list)
-    return results_df
+    限制條件：short_ma_period < long_ma_period
+    """
+    param_space = {
+        'short_ma_period': param_ranges['short_ma_period'],
+        'long_ma_period': param_ranges['long_ma_period'],
+    }
+    return run_sweep(
+        df_original, backtest_func, performance_func, param_space,
+        constraints=['short_ma_period < long_ma_period'], iterations=iterations, seed=seed,
+        batch_func=batch_func, chunk_size=chunk_size, n_jobs=n_jobs, executor=executor,
+        store=store
+    )
 
-def sensitivity_analysis_two(
+def sensitivity_analysis_three(
     df_original,
     backtest_func,
     performance_func,
     param_ranges,
-    iterations=100
+    iterations=100,
+    batch_func=None,
+    chunk_size=1024,
+    seed=None,
+    n_jobs=1,
+    executor=None,
+    store=None
 ):
     """
-    敏感度分析函數 (適用於策略二)
-    """
-    results_list = []
-    print(f"準備進行 {iterations} 次隨機參數測試...")
-
-    for _ in tqdm(range(iterations), desc="執行進度"):
-        # 隨機生成參數
-        short_ma = random.randint(*param_ranges['short_ma_period'])
-        long_ma = random.randint(*param_ranges['long_ma_period'])
-        while short_ma >= long_ma:
-            short_ma = random.randint(*param_ranges['short_ma_period'])
-            long_ma = random.randint(*param_ranges['long_ma_period'])
-
-        # 回測
-        df_result = backtest_func(
-            df_original.copy(),
-            short_ma_period=short_ma,
-            long_ma_period=long_ma
-        )
-
-        # 計算績效
-        df_result['entry'] = (df_result['position'] == 1) & (df_result['position'].shift(1) == 0)
-        df_result['exit'] = (df_result['position'] == 0) & (df_result['position'].shift(1) == 1)
-        performance = performance_func(df_result)
-
-        # 儲存結果
-        run_results = {
-            'short_ma_period': short_ma,
-            'long_ma_period': long_ma,
-        }
-        run_results.update(performance)
-        results_list.append(run_results)
+    敏感度分析函數 (適用於策略三)
 
-    results_df = pd.DataFrame(results_list)
-    return results_df
+    限制條件：ma_short < ma_medium < ma_long
+    """
+    param_space = {
+        'ma_short': param_ranges['ma_short'],
+        'ma_medium': param_ranges['ma_medium'],
+        'ma_long': param_ranges['ma_long'],
+    }
+    return run_sweep(
+        df_original, backtest_func, performance_func, param_space,
+        constraints=['ma_short < ma_medium < ma_long'], iterations=iterations, seed=seed,
+        batch_func=batch_func, chunk_size=chunk_size, n_jobs=n_jobs, executor=executor,
+        store=store
+    )
 
-def sensitivity_analysis_three(
+def sensitivity_analysis_four(
     df_original,
     backtest_func,
     performance_func,
     param_ranges,
-    iterations=100
+    iterations=100,
+    batch_func=None,
+    chunk_size=1024,
+    seed=None,
+    n_jobs=1,
+    executor=None,
+    store=None
 ):
     """
-    敏感度分析函數 (適用於策略三)
-    """
-    results_list = []
-    print(f"準備進行 {iterations} 次隨機參數測試...")
-
-    for _ in tqdm(range(iterations), desc="執行進度"):
-        # 隨機生成參數
-        ma_s = random.randint(*param_ranges['ma_short'])
-        ma_m = random.randint(*param_ranges['ma_medium'])
-        ma_l = random.randint(*param_ranges['ma_long'])
-        while not (ma_s < ma_m < ma_l):
-            ma_s = random.randint(*param_ranges['ma_short'])
-            ma_m = random.randint(*param_ranges['ma_medium'])
-            ma_l = random.randint(*param_ranges['ma_long'])
-
-        # 回測
-        df_result = backtest_func(
-            df_original.copy(),
-            ma_short=ma_s,
-            ma_medium=ma_m,
-            ma_long=ma_l
-        )
-
-        # 計算績效
-        df_result['entry'] = (df_result['position'] == 1) & (df_result['position'].shift(1) == 0)
-        df_result['exit'] = (df_result['position'] == 0) & (df_result['position'].shift(1) == 1)
-        performance = performance_func(df_result)
+    三參數敏感度分析 (bb_period, bb_std, ma_long_period)
 
-        # 儲存結果
-        run_results = {
-            'ma_short': ma_s,
-            'ma_medium': ma_m,
-            'ma_long': ma_l,
-        }
-        run_results.update(performance)
-        results_list.append(run_results)
+    bb_std 取到小數第二位
+    """
+    param_space = {
+        'bb_period': param_ranges['bb_period'],
+        'bb_std': float_range(*param_ranges['bb_std'], digits=2),
+        'ma_long_period': param_ranges['ma_long_period'],
+    }
+    return run_sweep(
+        df_original, backtest_func, performance_func, param_space,
+        iterations=iterations, seed=seed,
+        batch_func=batch_func, chunk_size=chunk_size, n_jobs=n_jobs, executor=executor,
+        store=store
+    )
 
-    results_df = pd.DataFrame(results_list)
-    return results_df
 
-def sensitivity_analysis_four(
+def grid_analysis_two(
     df_original,
     backtest_func,
     performance_func,
     param_ranges,
-    iterations=100
+    batch_func=None,
+    chunk_size=1024,
+    n_jobs=1,
+    executor=None,
+    store=None
 ):
     """
-    三參數敏感度分析 (bb_period, bb_std, ma_long_period)
-    """
-    results_list = []
-    print(f"準備進行 {iterations} 次隨機參數測試...")
-
-    for _ in tqdm(range(iterations), desc="執行進度"):
-        # 隨機生成三個參數
-        bb_period = random.randint(*param_ranges['bb_period'])
-        bb_std = round(random.uniform(*param_ranges['bb_std']), 2)  # float
-        ma_long_period = random.randint(*param_ranges['ma_long_period'])
-
-        # 回測
-        df_result = backtest_func(
-            df_original.copy(),
-            bb_period=bb_period,
-            bb_std=bb_std,
-            ma_long_period=ma_long_period
-        )
+    網格搜尋 (適用於策略二)：回測 param_ranges 內所有可行的參數組合，回傳 ParameterSurface
 
-        # 計算績效
-        df_result['entry'] = (df_result['position'] == 1) & (df_result['position'].shift(1) == 0)
-        df_result['exit'] = (df_result['position'] == 0) & (df_result['position'].shift(1) == 1)
-        performance = performance_func(df_result)
+    限制條件：short_ma_period < long_ma_period
+    """
+    param_space = {
+        'short_ma_period': param_ranges['short_ma_period'],
+        'long_ma_period': param_ranges['long_ma_period'],
+    }
+    return grid_search(
+        df_original, backtest_func, performance_func, param_space,
+        constraints=['short_ma_period < long_ma_period'],
+        batch_func=batch_func, chunk_size=chunk_size, n_jobs=n_jobs, executor=executor,
+        store=store
+    )
 
-        # 儲存結果
-        run_results = {
-            'bb_period': bb_period,
-            'bb_std': bb_std,
-            'ma_long_period': ma_long_period
-        }
-        run_results.update(performance)
-        results_list.append(run_results)
+def grid_analysis_three(
+    df_original,
+    backtest_func,
+    performance_func,
+    param_ranges,
+    batch_func=None,
+    chunk_size=1024,
+    n_jobs=1,
+    executor=None,
+    store=None
+):
+    """
+    網格搜尋 (適用於策略三)：回測 param_ranges 內所有可行的參數組合，回傳 ParameterSurface
 
-    results_df = pd.DataFrame(results_list)
-    return results_df
+    限制條件：ma_short < ma_medium < ma_long
+    """
+    param_space = {
+        'ma_short': param_ranges['ma_short'],
+        'ma_medium': param_ranges['ma_medium'],
+        'ma_long': param_ranges['ma_long'],
+    }
+    return grid_search(
+        df_original, backtest_func, performance_func, param_space,
+        constraints=['ma_short < ma_medium < ma_long'],
+        batch_func=batch_func, chunk_size=chunk_size, n_jobs=n_jobs, executor=executor,
+        store=store
+    )
 
 
 def plot_strategy_sensitivity(
@@ -371,3 +332,41 @@ def plot_strategy_sensitivity(
 
     plt.tight_layout(rect=[0, 0.03, 1, 0.95])
     plt.show()
+
+
+def plot_parameter_surface(surface, radius=1, metric=None, cmap='RdYlGn'):
+    """
+    繪製二維績效曲面的熱圖：左為各參數組的績效，右為鄰域平均（穩健區域），
+    並標出鄰域平均最高的參數組。
+
+    params:
+        surface : ParameterSurface 二維的網格搜尋結果（例如 grid_analysis_two 的回傳值）
+        radius  : int 鄰域半徑
+        metric  : str 績效欄位名稱，預設為建立曲面時的指標
+        cmap    : str 色盤
+    """
+    metric = metric or surface.metric
+    raw = surface.pivot(metric=metric)
+    smoothed = surface.pivot(smoothed=True, radius=radius, metric=metric)
+    best = surface.best(radius=radius, metric=metric)
+
+    # 設定中文字型與負號
+    plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
+    plt.rcParams['axes.unicode_minus'] = False
+
+    fig, axes = plt.subplots(1, 2, figsize=(16, 7))
+    for ax, table, title in (
+        (axes[0], raw, metric),
+        (axes[1], smoothed, f'{metric}（鄰域半徑 {radius}）'),
+    ):
+        sns.heatmap(table, ax=ax, cmap=cmap, center=0)
+        ax.invert_yaxis()
+        # 標出鄰域平均最高的格子
+        row = table.index.get_loc(best[surface.names[0]])
+        col = table.columns.get_loc(best[surface.names[1]])
+        ax.add_patch(plt.Rectangle((col, row), 1, 1, fill=False, edgecolor='black', lw=2))
+        ax.set_title(title, fontsize=14)
+
+    plt.tight_layout()
+    plt.show()
+    return best
@@ -0,0 +1,125 @@
+# 交易成本模型：手續費、證券交易稅、滑價與融券（借券）費用
+# 回測的 ret 原本是未扣成本的點數差（出場價 - 進場價），高週轉的參數組因此看起來比實際交易好得多。
+#
+# 進出場條件只取決於價格與指標，不受損益影響，因此成本不會改變任何一筆交易的進出場時點；
+# 引擎照常跑完狀態機後，再依交易明細逐筆計算成本，從出場日的 ret 與之後的 cus 扣除。
+# 計算量與交易筆數成正比，批次參數掃描的速度幾乎不受影響。
+#
+# 點數模式下所有金額都以「每 1 單位」的點數表示，與 ret / cus 相同；
+# quantity 只用於把以「每筆委託」計的最低手續費攤到每單位。
+# 資金模式下（交易明細的 units 欄不是 NaN）改以該筆委託的單位數計算金額，
+# 最低手續費每筆委託只收一次，不再依 quantity 攤提。
+
+import numpy as np
+
+
+class CostModel:
+    """
+    每筆交易的成本設定。所有比率皆以成交價計，預設全部為 0（不扣成本）。
+
+    Args:
+        fee_rate (float): 每一邊（買進、賣出各一次）的手續費率，例如 0.001425。
+        min_fee (float): 每一邊的最低手續費（每筆委託的金額）。
+        tax_rate (float): 賣出時的證券交易稅率，例如 0.003；做空時於進場（賣出）時課徵。
+        slippage (float): 每一邊固定的滑價點數，買進時成交價較差、賣出時亦同。
+        slippage_rate (float): 每一邊以成交價比例計的滑價。
+        borrow_rate (float): 空單的年化借券（融券）費率，依持有 K 棒數按比例計算。
+        quantity (float): 每筆委託的單位數（例如一張 = 1000 股），用於攤提最低手續費。
+        periods_per_year (int): 年化借券費率時每年的 K 棒數。
+    """
+
+    __slots__ = (
+        "fee_rate", "min_fee", "tax_rate", "slippage", "slippage_rate",
+        "borrow_rate", "quantity", "periods_per_year",
+    )
+
+    def __init__(
+        self,
+        fee_rate=0.0,
+        min_fee=0.0,
+        tax_rate=0.0,
+        slippage=0.0,
+        slippage_rate=0.0,
+        borrow_rate=0.0,
+        quantity=1,
+        periods_per_year=252,
+    ):
+        if min(fee_rate, min_fee, tax_rate, slippage, slippage_rate, borrow_rate) < 0:
+            raise ValueError("成本參數不可為負數")
+        if quantity <= 0:
+            raise ValueError("quantity 必須為正數")
+        self.fee_rate = fee_rate
+        self.min_fee = min_fee
+        self.tax_rate = tax_rate
+        self.slippage = slippage
+        self.slippage_rate = slippage_rate
+        self.borrow_rate = borrow_rate
+        self.quantity = quantity
+        self.periods_per_year = periods_per_year
+
+    @classmethod
+    def taiwan_stock(cls, fee_discount=1.0, quantity=1000, **kwargs):
+        """
+        台股現股的成本：手續費 0.1425%（可乘上券商折扣）、最低 20 元，賣出證交稅 0.3%。
+
+        Args:
+            fee_discount (float): 手續費折扣，例如 0.6 表示六折。
+            quantity (float): 每筆委託股數，預設一張 1000 股。
+            **kwargs: 其他 CostModel 參數（例如 slippage、borrow_rate）。
+        """
+        return cls(
+            fee_rate=0.001425 * fee_discount,
+            min_fee=20,
+            tax_rate=0.003,
+            quantity=quantity,
+            **kwargs,
+        )
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"CostModel({fields})"
+
+    def _fee(self, price, units):
+        """單邊手續費：units 為 NaN 時為每單位點數，否則為 units 單位的一筆委託金額。"""
+        per_unit = np.maximum(price * self.fee_rate, self.min_fee / self.quantity)
+        per_order = np.where(
+            units > 0, np.maximum(units * price * self.fee_rate, self.min_fee), 0.0
+        )
+        return np.where(np.isnan(units), per_unit, per_order)
+
+    def _slip(self, price):
+        """單邊滑價（每單位）。"""
+        return self.slippage + price * self.slippage_rate
+
+    def trade_costs(self, trades):
+        """
+        逐筆計算成本明細。
+
+        Args:
+            trades (np.ndarray): engine.TRADE_DTYPE 結構陣列。
+
+        Returns:
+            dict[str, np.ndarray]: 手續費、交易稅、滑價、借券費，每筆交易一個值
+                （units 欄為 NaN 時為每單位點數，否則為該筆交易的金額）。
+        """
+        entry = trades["entry_price"]
+        exit_ = trades["exit_price"]
+        units = trades["units"]
+        scale = np.where(np.isnan(units), 1.0, units)
+        short = trades["side"] == -1
+        # 做多：出場為賣出；做空：進場為賣出
+        sell_price = np.where(short, entry, exit_)
+        return {
+            "手續費": self._fee(entry, units) + self._fee(exit_, units),
+            "交易稅": sell_price * self.tax_rate * scale,
+            "滑價": (self._slip(entry) + self._slip(exit_)) * scale,
+            "借券費": np.where(
+                short,
+                entry * self.borrow_rate * trades["bars_held"] / self.periods_per_year * scale,
+                0.0,
+            ),
+        }
+
+    def total(self, trades):
+        """逐筆的總成本（單位同 trade_costs）。"""
+        return sum(self.trade_costs(trades).values())
@@ -0,0 +1,855 @@
+# 回測核心引擎：以 NumPy 陣列驅動的持倉狀態機
+# 四個策略的差異只在「何時進出場、以什麼價格進出場」，這些條件都可以事先算成逐日陣列；
+# 真正必須逐日循序處理的只有 position / avg_cost / cum_ret 這組狀態。
+# 因此各策略先把指標與進出場條件整理成陣列，再交給本模組的狀態機一次跑完，
+# 最後把指標與 ret / cus / position 一次性寫進新的 DataFrame，避免在迴圈中使用 df.iloc / df.at。
+
+import pickle
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from lib import kernels
+from lib.backtest.sizing import size_positions
+
+# 交易明細（trade ledger）的欄位：每筆已平倉交易一列，比逐日的 ret 欄精簡得多，
+# 且保留損益為 0 的平手交易（以 ret != 0 篩選時會被漏掉）。
+TRADE_DTYPE = np.dtype(
+    [
+        ("lane", np.int64),          # 參數組 / 代號（單一回測時皆為 0）
+        ("entry_bar", np.int64),     # 進場 K 棒位置
+        ("exit_bar", np.int64),      # 出場 K 棒位置
+        ("side", np.int8),           # 1: 多單, -1: 空單
+        ("entry_price", np.float64),
+        ("exit_price", np.float64),
+        ("pnl", np.float64),         # 已實現損益（已扣除 cost），與出場日的 ret 相同
+        ("cost", np.float64),        # 交易成本（手續費、稅、滑價、借券費），未設定成本模型時為 0
+        ("bars_held", np.int64),     # 出場 K 棒 - 進場 K 棒（當日進出為 0）
+        ("units", np.float64),       # 資金模式下的單位數，pnl / cost 為金額；點數模式為 NaN（每單位點數）
+    ]
+)
+
+
+def _trade_ledger(lane, entry_bar, exit_bar, side, entry_price, exit_price, pnl):
+    """由各欄位的陣列（或 list）組成 TRADE_DTYPE 結構陣列。"""
+    trades = np.empty(len(pnl), dtype=TRADE_DTYPE)
+    trades["lane"] = lane
+    trades["entry_bar"] = entry_bar
+    trades["exit_bar"] = exit_bar
+    trades["side"] = side
+    trades["entry_price"] = entry_price
+    trades["exit_price"] = exit_price
+    trades["pnl"] = pnl
+    trades["cost"] = 0.0
+    trades["bars_held"] = trades["exit_bar"] - trades["entry_bar"]
+    trades["units"] = np.nan
+    return trades
+
+
+def apply_costs(ret, cus, trades, costs):
+    """
+    依成本模型從已平倉交易扣除交易成本（就地修改 ret / cus / trades）。
+
+    成本在出場日一次認列：出場日的 ret 與交易的 pnl 減去該筆成本，
+    cus 從出場日起減去累計成本。持倉期間的未實現損益不預扣成本。
+
+    Args:
+        ret, cus (np.ndarray): (交易日,) 或 (交易日 × N) 的引擎輸出。
+        trades (np.ndarray): 同一次執行的交易明細（K 棒位置以 ret 的列為準）。
+        costs (lib.backtest.costs.CostModel): 成本模型。
+    """
+    cost = costs.total(trades)
+    trades["cost"] = cost
+    trades["pnl"] -= cost
+    booked = np.zeros_like(ret)
+    where = trades["exit_bar"] if ret.ndim == 1 else (trades["exit_bar"], trades["lane"])
+    np.add.at(booked, where, cost)
+    ret -= booked
+    cus -= np.cumsum(booked, axis=0)
+
+
+def trades_frame(trades, dates=None):
+    """
+    將交易明細轉成 DataFrame 方便檢視。
+
+    Args:
+        trades (np.ndarray): TRADE_DTYPE 結構陣列。
+        dates (array-like, optional): 逐日的日期（例如 df["年月日"]），提供時加上進場日 / 出場日欄位。
+
+    Returns:
+        pd.DataFrame: 每筆交易一列。
+    """
+    frame = pd.DataFrame(trades)
+    if dates is not None:
+        dates = np.asarray(dates)
+        frame.insert(2, "entry_date", dates[trades["entry_bar"]])
+        frame.insert(4, "exit_date", dates[trades["exit_bar"]])
+    return frame
+
+
+def _kernel_engine(
+    close, l_in, l_in_px, l_out, l_out_px, s_in, s_in_px, s_out, s_out_px, exit_first
+):
+    """
+    以編譯核心（lib.kernels.position_loop）執行狀態機。
+    輸入為 _as_lanes 後的 (交易日 × 1) 或 (交易日 × N) 陣列，沒有空單時空單相關參數為 None。
+
+    Returns:
+        tuple: (ret, cus, position, trades)，形狀皆為 (交易日, N)；
+            trades 為未扣成本的交易明細，依出場 K 棒、再依 lane 排序（與批次引擎相同）。
+    """
+    inputs = [close, l_in, l_in_px, l_out, l_out_px]
+    if s_in is None:
+        s_in = s_out = np.zeros((1, 1), dtype=bool)
+        s_in_px = s_out_px = np.zeros((1, 1))
+    inputs += [s_in, s_in_px, s_out, s_out_px]
+    shape = np.broadcast_shapes(*(a.shape for a in inputs))
+    inputs = [np.broadcast_to(a, shape) for a in inputs]
+
+    ret = np.zeros(shape)
+    cus = np.zeros(shape)
+    positions = np.zeros(shape, dtype=np.int64)
+    # 出場記錄只在出場日寫入，np.zeros 延遲配置的分頁大多不會被實際使用
+    exit_side = np.zeros(shape, dtype=np.int8)
+    exit_entry_bar = np.zeros(shape, dtype=np.int64)
+    exit_entry_price = np.zeros(shape)
+    kernels.position_loop(
+        *inputs, bool(exit_first), ret, cus, positions, exit_side, exit_entry_bar, exit_entry_price
+    )
+
+    # np.nonzero 依 C 順序回傳：先依出場 K 棒、再依 lane
+    bars, lanes = np.nonzero(exit_side)
+    side = exit_side[bars, lanes]
+    l_out_px, s_out_px = inputs[4], inputs[8]
+    exit_px = np.where(side == 1, l_out_px[bars, lanes], s_out_px[bars, lanes])
+    trades = _trade_ledger(
+        lanes, exit_entry_bar[bars, lanes], bars, side,
+        exit_entry_price[bars, lanes], exit_px, ret[bars, lanes],
+    )
+    return ret, cus, positions, trades
+
+
+# === 事件驅動模式 ===
+# 狀態機只在少數 K 棒上真正改變狀態：空手時只有「有進場訊號」的 K 棒重要，持倉時只有「有出場訊號」的 K 棒重要。
+# 事件驅動模式先取出所有進場 / 出場訊號的 K 棒位置（已排序），
+# 空手時以二分搜尋跳到下一個進場 K 棒、持倉時跳到下一個同方向的出場 K 棒，
+# 兩個事件之間的 position / cus 以陣列切片一次填入。
+# Python 迴圈的次數等於交易筆數而不是交易日數；結果與逐日的狀態機逐位元相同
+# （每一日的 cus 仍是 cum_ret + (close - avg_cost)，只是以向量運算）。
+# 以 set_engine_mode("bar") 可改回逐日的狀態機；啟用編譯核心時一律使用編譯核心。
+
+_engine_state = {"mode": "event"}
+
+
+def set_engine_mode(name):
+    """
+    選擇狀態機的執行方式：「event」（事件驅動，預設）或「bar」（逐日）。
+
+    Args:
+        name (str): "event" 或 "bar"。
+    """
+    if name not in ("event", "bar"):
+        raise ValueError(f"未知的引擎模式：{name}")
+    _engine_state["mode"] = name
+
+
+def get_engine_mode():
+    """目前的狀態機執行方式。"""
+    return _engine_state["mode"]
+
+
+def _event_lane(
+    l_in, l_in_px, l_out_px, s_in_px, s_out_px, entries, long_exits, short_exits, exit_first
+):
+    """
+    以事件驅動找出單一 lane 的所有交易：空手時跳到下一個進場 K 棒、持倉時跳到下一個同方向的出場 K 棒。
+
+    Args:
+        entries (list[int]): 有進場訊號（做多或做空）的 K 棒，已排序。
+        long_exits, short_exits (list[int]): 有多單 / 空單出場訊號的 K 棒，已排序。
+
+    Returns:
+        tuple: (已平倉交易 [(進場 K 棒, 出場 K 棒, 方向, 進場價, 出場價, 損益), ...],
+            期末仍持有的部位 (進場 K 棒, 方向, 進場價) 或 None)。
+    """
+    closed = []
+    start = 0       # 下一次進場最早的 K 棒
+    k = 0
+    while True:
+        k = bisect_left(entries, start, k)
+        if k == len(entries):
+            return closed, None
+        entry = entries[k]
+        if l_in[entry]:
+            side, avg_cost, exits, exit_prices = 1, float(l_in_px[entry]), long_exits, l_out_px
+        else:
+            side, avg_cost, exits, exit_prices = -1, float(s_in_px[entry]), short_exits, s_out_px
+        # 進場優先時進場當日即可出場；出場優先時進場當日已檢查過出場
+        m = bisect_left(exits, entry + 1 if exit_first else entry)
+        if m == len(exits):
+            return closed, (entry, side, avg_cost)
+        exit_bar = exits[m]
+        exit_px = float(exit_prices[exit_bar])
+        r = exit_px - avg_cost if side == 1 else avg_cost - exit_px
+        closed.append((entry, exit_bar, side, avg_cost, exit_px, r))
+        # 出場優先時出場當日即可再進場；進場優先時出場當日的進場檢查已經過了
+        start = exit_bar if exit_first else exit_bar + 1
+
+
+def _event_engine(
+    close, l_in, l_in_px, l_out, l_out_px, s_in, s_in_px, s_out, s_out_px, exit_first
+):
+    """
+    以事件驅動模式執行狀態機。輸入為 _as_lanes 後的 (交易日 × 1) 或 (交易日 × N) 陣列，
+    沒有空單時空單相關參數為 None。
+
+    交易由 _event_lane 逐條 lane 找出，逐日的欄位再一次以陣列運算填入：
+        - ret：出場日寫入損益；cum_ret 為 ret 沿交易日的累加（與逐日累加的順序相同）。
+        - position：進場日 +方向、出場日 -方向，沿交易日累加。
+        - avg_cost：每一日取最近一次進場的進場價（只在持倉的日子使用）。
+
+    Returns:
+        tuple: (ret, cus, position, trades)，形狀皆為 (交易日, N)；
+            trades 為未扣成本的交易明細，依出場 K 棒、再依 lane 排序（與批次引擎相同）。
+    """
+    inputs = [close, l_in, l_in_px, l_out, l_out_px]
+    if s_in is not None:
+        inputs += [s_in, s_in_px, s_out, s_out_px]
+    L, N = np.broadcast_shapes(*(a.shape for a in inputs))
+
+    def events(signal):
+        # 每條 lane 有訊號的 K 棒（已排序）；共用的 1-D 訊號只計算一次
+        if signal is None:
+            return [[]] * N
+        if signal.shape[1] == 1:
+            return [np.flatnonzero(signal[:, 0]).tolist()] * N
+        lanes, bars = np.nonzero(signal.T)
+        bounds = np.searchsorted(lanes, np.arange(N + 1)).tolist()
+        bars = bars.tolist()
+        return [bars[a:b] for a, b in zip(bounds, bounds[1:])]
+
+    def column(a, j):
+        return None if a is None else a[:, j if a.shape[1] > 1 else 0]
+
+    entries = events(l_in if s_in is None else l_in | s_in)
+    long_exits = events(l_out)
+    short_exits = events(s_out)
+
+    trades = []
+    holding = []
+    for j in range(N):
+        closed, still_open = _event_lane(
+            column(l_in, j), column(l_in_px, j), column(l_out_px, j),
+            column(s_in_px, j), column(s_out_px, j),
+            entries[j], long_exits[j], short_exits[j], exit_first,
+        )
+        trades += [(j,) + t for t in closed]
+        if still_open is not None:
+            holding.append((j,) + still_open)
+
+    columns = zip(*trades) if trades else ((),) * 7
+    trades = _trade_ledger(*columns)
+    lane, entry_bar, exit_bar = trades["lane"], trades["entry_bar"], trades["exit_bar"]
+    side = trades["side"].astype(np.int64)
+    open_lane, open_entry, open_side, open_cost = (
+        (np.array(c) for c in zip(*holding)) if holding else (np.zeros(0, dtype=np.int64),) * 4
+    )
+
+    ret = np.zeros((L, N))
+    ret[exit_bar, lane] = trades["pnl"]
+    cum_ret = np.cumsum(ret, axis=0)
+
+    positions = np.zeros((L, N), dtype=np.int64)
+    np.add.at(positions, (entry_bar, lane), side)
+    np.add.at(positions, (exit_bar, lane), -side)
+    positions[open_entry, open_lane] += open_side
+    np.cumsum(positions, axis=0, out=positions)
+
+    # 每一日最近一次進場的 K 棒與進場價
+    entry_cost = np.zeros((L, N))
+    last_entry = np.full((L, N), -1, dtype=np.int64)
+    for bars, lanes, cost in (
+        (entry_bar, lane, trades["entry_price"]), (open_entry, open_lane, open_cost)
+    ):
+        entry_cost[bars, lanes] = cost
+        last_entry[bars, lanes] = bars
+    np.maximum.accumulate(last_entry, axis=0, out=last_entry)
+    avg_cost = np.take_along_axis(entry_cost, np.maximum(last_entry, 0), axis=0)
+
+    # 與逐日狀態機相同的結算公式：多單 cum_ret + (close - avg_cost)、空單 cum_ret + (avg_cost - close)
+    # （a + (c - b) 與 a - (b - c) 在 IEEE 浮點數下逐位元相同）
+    unrealized = close - avg_cost
+    cus = cum_ret.copy()
+    np.add(cum_ret, unrealized, out=cus, where=positions == 1)
+    np.subtract(cum_ret, unrealized, out=cus, where=positions == -1)
+
+    # 依出場 K 棒、再依 lane 排序（逐條 lane 產生的交易明細原本是依 lane 排序）
+    trades = trades[np.lexsort((lane, exit_bar))]
+    return ret, cus, positions, trades
+
+
+def run_position_engine(
+    close,
+    long_entry,
+    long_entry_price,
+    long_exit,
+    long_exit_price,
+    short_entry=None,
+    short_entry_price=None,
+    short_exit=None,
+    short_exit_price=None,
+    exit_first=False,
+    record_trades=False,
+    costs=None,
+):
+    """
+    執行共用的持倉狀態機。
+
+    每個交易日的處理順序：
+        - exit_first=False（策略一～三）：先檢查進場，再檢查出場（允許當日進出）。
+        - exit_first=True（策略四）：先檢查出場，空手後再檢查進場。
+    最後以收盤價計算當日的市值權益 (cus)。
+
+    Args:
+        close (array-like): 每日收盤價，用於計算未實現損益。
+        long_entry (array-like of bool): 空手時是否於當日做多進場。
+        long_entry_price (array-like): 做多進場價格。
+        long_exit (array-like of bool): 持有多單時是否於當日出場。
+        long_exit_price (array-like): 多單出場價格。
+        short_entry (array-like of bool, optional): 空手時是否於當日做空進場（僅在未觸發做多時檢查）。
+        short_entry_price (array-like, optional): 做空進場價格。
+        short_exit (array-like of bool, optional): 持有空單時是否於當日出場。
+        short_exit_price (array-like, optional): 空單出場價格。
+        exit_first (bool): 是否先處理出場再處理進場。
+        record_trades (bool): 是否另外回傳交易明細。
+        costs (CostModel, optional): 交易成本模型（見 lib.backtest.costs），於出場時扣除；
+            不影響任何進出場時點。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)
+            - ret: 每筆已實現交易的報酬（僅出場日非零）
+            - cus: 每日的市值權益（已實現 + 未實現）
+            - position: 每日收盤後的持倉狀態 (0: 空手, 1: 多單, -1: 空單)
+            record_trades=True 時再加上 trades：已平倉交易的 TRADE_DTYPE 結構陣列，
+            期末仍未平倉的部位不列入（其未實現損益已反映在 cus）。
+    """
+    if kernels.use_kernels() or _engine_state["mode"] == "event":
+        inputs = (
+            close, long_entry, long_entry_price, long_exit, long_exit_price,
+            short_entry, short_entry_price, short_exit, short_exit_price,
+        )
+        dtypes = (np.float64, bool, np.float64, bool, np.float64) + (bool, np.float64) * 2
+        arrays = [None if a is None else _as_lanes(a, dtype) for a, dtype in zip(inputs, dtypes)]
+        engine = _kernel_engine if kernels.use_kernels() else _event_engine
+        ret, cus, positions, trades = engine(*arrays, exit_first)
+        result = (ret[:, 0], cus[:, 0], positions[:, 0])
+        if costs is not None:
+            apply_costs(result[0], result[1], trades, costs)
+        return result + (trades,) if record_trades else result
+
+    L = len(close)
+
+    # 轉成 Python list 逐一取值，比在迴圈中索引 NumPy 陣列快得多，且數值運算結果相同
+    closes = np.asarray(close, dtype=np.float64).tolist()
+    l_in = np.asarray(long_entry, dtype=bool).tolist()
+    l_in_px = np.asarray(long_entry_price, dtype=np.float64).tolist()
+    l_out = np.asarray(long_exit, dtype=bool).tolist()
+    l_out_px = np.asarray(long_exit_price, dtype=np.float64).tolist()
+
+    if short_entry is None:
+        s_in = [False] * L
+        s_in_px = s_out_px = [0.0] * L
+        s_out = [False] * L
+    else:
+        s_in = np.asarray(short_entry, dtype=bool).tolist()
+        s_in_px = np.asarray(short_entry_price, dtype=np.float64).tolist()
+        s_out = np.asarray(short_exit, dtype=bool).tolist()
+        s_out_px = np.asarray(short_exit_price, dtype=np.float64).tolist()
+
+    ret = [0.0] * L
+    cus = [0.0] * L
+    positions = [0] * L
+
+    position = 0      # 當前的持倉狀態
+    avg_cost = 0.0    # 持倉的平均成本
+    cum_ret = 0.0     # 已實現的累計報酬
+    entry_bar = 0     # 目前持倉的進場 K 棒
+    closed = []       # 已平倉交易：(進場 K 棒, 出場 K 棒, 方向, 進場價, 出場價, 損益)
+
+    for i in range(L):
+        # --- 進場邏輯（進場優先的策略）---
+        if not exit_first and position == 0:
+            if l_in[i]:
+                avg_cost = l_in_px[i]
+                position = 1
+                entry_bar = i
+            elif s_in[i]:
+                avg_cost = s_in_px[i]
+                position = -1
+                entry_bar = i
+
+        # --- 出場邏輯 ---
+        if position == 1 and l_out[i]:
+            r = l_out_px[i] - avg_cost
+            ret[i] = r
+            cum_ret += r
+            closed.append((entry_bar, i, 1, avg_cost, l_out_px[i], r))
+            position = 0
+            avg_cost = 0.0
+        elif position == -1 and s_out[i]:
+            r = avg_cost - s_out_px[i]
+            ret[i] = r
+            cum_ret += r
+            closed.append((entry_bar, i, -1, avg_cost, s_out_px[i], r))
+            position = 0
+            avg_cost = 0.0
+
+        # --- 進場邏輯（出場優先的策略）---
+        if exit_first and position == 0:
+            if l_in[i]:
+                avg_cost = l_in_px[i]
+                position = 1
+                entry_bar = i
+            elif s_in[i]:
+                avg_cost = s_in_px[i]
+                position = -1
+                entry_bar = i
+
+        # --- 每日結算與記錄 ---
+        if position == 1:
+            cus[i] = cum_ret + (closes[i] - avg_cost)
+        elif position == -1:
+            cus[i] = cum_ret + (avg_cost - closes[i])
+        else:
+            cus[i] = cum_ret
+        positions[i] = position
+
+    result = (
+        np.array(ret, dtype=np.float64),
+        np.array(cus, dtype=np.float64),
+        np.array(positions, dtype=np.int64),
+    )
+    if not record_trades and costs is None:
+        return result
+    columns = zip(*closed) if closed else ((),) * 6
+    trades = _trade_ledger(0, *columns)
+    if costs is not None:
+        apply_costs(result[0], result[1], trades, costs)
+    return result + (trades,) if record_trades else result
+
+
+def slice_signals(close, signals, start=0, stop=None):
+    """
+    截取 [start, stop) 區間的收盤價與進出場條件陣列（沿交易日軸），其餘設定（如 exit_first）不變。
+    用於在完整資料上計算指標後，只在其中一段期間執行狀態機。
+    """
+    if start == 0 and stop is None:
+        return close, signals
+    period = slice(start, stop)
+    sliced = {
+        key: value[period] if isinstance(value, np.ndarray) and value.ndim > 0 else value
+        for key, value in signals.items()
+    }
+    return close[period], sliced
+
+
+def offset_trades(trades, start):
+    """將 slice_signals 區間內的交易明細 K 棒位置平移回完整資料的位置。"""
+    if start:
+        trades["entry_bar"] += start
+        trades["exit_bar"] += start
+    return trades
+
+
+class PositionState:
+    """
+    逐筆版持倉狀態機：每呼叫一次 step 推進一個交易日，規則與 run_position_engine 完全相同。
+    供各策略的 Streaming* 類別在正式環境中逐日產生訊號使用。
+
+    Args:
+        exit_first (bool): 是否先處理出場再處理進場。
+
+    Attributes:
+        position (int): 目前的持倉狀態 (0: 空手, 1: 多單, -1: 空單)。
+        avg_cost (float): 持倉的平均成本。
+        cum_ret (float): 已實現的累計報酬。
+    """
+
+    __slots__ = ("exit_first", "position", "avg_cost", "cum_ret")
+
+    def __init__(self, exit_first=False):
+        self.exit_first = exit_first
+        self.position = 0
+        self.avg_cost = 0.0
+        self.cum_ret = 0.0
+
+    def _enter(self, long_entry, long_entry_price, short_entry, short_entry_price):
+        if long_entry:
+            self.avg_cost = long_entry_price
+            self.position = 1
+        elif short_entry:
+            self.avg_cost = short_entry_price
+            self.position = -1
+
+    def step(
+        self,
+        close,
+        long_entry,
+        long_entry_price,
+        long_exit,
+        long_exit_price,
+        short_entry=False,
+        short_entry_price=0.0,
+        short_exit=False,
+        short_exit_price=0.0,
+    ):
+        """
+        推進一個交易日。參數意義與 run_position_engine 相同，但皆為當日的單一數值。
+
+        Returns:
+            tuple[float, float, int]: 當日的 (ret, cus, position)。
+        """
+        ret = 0.0
+
+        # --- 進場邏輯（進場優先的策略）---
+        if not self.exit_first and self.position == 0:
+            self._enter(long_entry, long_entry_price, short_entry, short_entry_price)
+
+        # --- 出場邏輯 ---
+        closed = True
+        if self.position == 1 and long_exit:
+            ret = long_exit_price - self.avg_cost
+        elif self.position == -1 and short_exit:
+            ret = self.avg_cost - short_exit_price
+        else:
+            closed = False
+        if closed:
+            self.cum_ret += ret
+            self.position = 0
+            self.avg_cost = 0.0
+
+        # --- 進場邏輯（出場優先的策略）---
+        if self.exit_first and self.position == 0:
+            self._enter(long_entry, long_entry_price, short_entry, short_entry_price)
+
+        # --- 每日結算 ---
+        if self.position == 1:
+            cus = self.cum_ret + (close - self.avg_cost)
+        elif self.position == -1:
+            cus = self.cum_ret + (self.avg_cost - close)
+        else:
+            cus = self.cum_ret
+        return ret, cus, self.position
+
+
+class StreamingStrategy:
+    """
+    逐筆策略的共用基底：子類別實作 update(open_, high, low, close)，回傳當日的 (ret, cus, position)。
+
+    狀態（指標視窗、前一日的訊號、持倉）全部保存在物件上，
+    可用 snapshot() 存成位元組，重新啟動時以 StreamingStrategy.restore() 接續，不必重播歷史資料。
+    注意：restore 以 pickle 還原，只能載入自己產生的快照。
+    """
+
+    __slots__ = ()
+
+    def update(self, open_, high, low, close):
+        raise NotImplementedError
+
+    def replay(self, df):
+        """
+        依序餵入 df 的每一根 K 棒（通常用於首次暖機）。
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，格式同 run_position_engine。
+        """
+        columns = [df[c].to_numpy(dtype=float).tolist() for c in ("開盤價", "最高價", "最低價", "收盤價")]
+        rows = [self.update(*bar) for bar in zip(*columns)]
+        ret, cus, position = zip(*rows) if rows else ((), (), ())
+        return (
+            np.array(ret, dtype=np.float64),
+            np.array(cus, dtype=np.float64),
+            np.array(position, dtype=np.int64),
+        )
+
+    def snapshot(self):
+        """將目前的完整狀態序列化成位元組。"""
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def restore(data):
+        """由 snapshot() 的結果還原策略物件。"""
+        return pickle.loads(data)
+
+
+def attach_results(
+    df, indicators, ret=None, cus=None, position=None, trades=None, units=None, capital=None
+):
+    """
+    建立回測結果的 DataFrame：原始欄位 + 指標欄位 + ret / cus / position / BH。
+
+    傳入的 df 不會被修改；所有新欄位在這裡一次配置，原始資料也只複製這一次。
+    未提供 ret / cus / position 時（資料不足以回測），只附加指標欄位。
+
+    Args:
+        df (pd.DataFrame): 原始價格資料。
+        indicators (dict[str, np.ndarray]): 依欄位順序排列的指標陣列。
+        ret, cus, position (np.ndarray, optional): run_position_engine 的輸出。
+        trades (np.ndarray, optional): 有扣除交易成本時傳入交易明細，
+            另加逐日的 cost 欄（成本於出場日認列，ret 已扣除）。
+        units, capital (optional): 資金模式下每日持有的單位數與初始資金（ret / cus 為金額），
+            另加 units / equity / pct_ret 欄，BH 改為以全部資金買入並持有的損益。
+
+    Returns:
+        pd.DataFrame: 新的回測結果 DataFrame。
+    """
+    columns = dict(indicators)
+    if ret is not None:
+        columns["ret"] = ret
+        columns["cus"] = cus
+        columns["position"] = position
+        if trades is not None:
+            columns["cost"] = np.bincount(trades["exit_bar"], trades["cost"], minlength=len(ret))
+        # 計算買入並持有策略的報酬作為比較基準
+        close = df["收盤價"]
+        if units is None:
+            columns["BH"] = close - close.iloc[0]
+        else:
+            equity = capital + cus
+            columns["units"] = units
+            columns["equity"] = equity
+            columns["pct_ret"] = equity / np.concatenate(([capital], equity[:-1])) - 1
+            columns["BH"] = capital * (close / close.iloc[0] - 1)
+    # 以 dict 一次建構（已存在的欄位保留原位置，與 df.assign 相同），
+    # 比 df.assign 逐欄插入快約一倍；單次回測中這一步原本比狀態機本身還慢
+    data = {name: df[name] for name in df.columns}
+    data.update(columns)
+    return pd.DataFrame(data, index=df.index, copy=True)
+
+
+def backtest_frame(
+    df, indicators, close, signals, return_trades=False, costs=None, sizing=None
+):
+    """
+    單次回測的共用收尾：執行狀態機、套用成本與部位規模，並建立結果 DataFrame。
+
+    Args:
+        df (pd.DataFrame): 原始價格資料。
+        indicators (dict[str, np.ndarray]): 依欄位順序排列的指標陣列。
+        close (np.ndarray): 收盤價。
+        signals (dict): 策略 _build_signals 的輸出。
+        return_trades (bool): 是否另外回傳交易明細。
+        costs (CostModel, optional): 交易成本模型（見 lib.backtest.costs）。
+        sizing (PositionSizer, optional): 部位規模規則（見 lib.backtest.sizing）；
+            提供時為資金模式，否則為每次 1 單位的點數模式。
+
+    Returns:
+        pd.DataFrame: 回測結果；return_trades=True 時回傳 (DataFrame, 交易明細)。
+    """
+    # 資金模式的成本依每筆委託的單位數計算（最低手續費每筆一次），由 size_positions 扣除
+    ret, cus, position, trades = run_position_engine(
+        close, **signals, record_trades=True, costs=costs if sizing is None else None
+    )
+    units = None
+    if sizing is not None:
+        ret, cus, units = size_positions(close, ret, cus, position, trades, sizing, costs)
+    result = attach_results(
+        df,
+        indicators,
+        ret,
+        cus,
+        position,
+        trades=None if costs is None else trades,
+        units=units,
+        capital=None if sizing is None else sizing.capital,
+    )
+    return (result, trades) if return_trades else result
+
+
+def backtest_lanes(
+    close,
+    signals,
+    start=0,
+    stop=None,
+    return_trades=False,
+    costs=None,
+    sizing=None,
+    return_costs=False,
+):
+    """
+    批次回測的共用收尾：截取 [start, stop) 區間、執行批次狀態機，並套用成本與部位規模。
+    參數意義同 backtest_frame 與 slice_signals。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，形狀皆為 (交易日, N)；
+            資金模式下 ret / cus 為金額。return_trades=True 時再加上交易明細
+            （K 棒位置以完整資料計）。return_costs=True 時最後再加上 (N,) 的交易成本總額
+            （與單次回測 cost 欄的加總相同）；未設定成本模型時為 None。
+    """
+    close, signals = slice_signals(close, signals, start, stop)
+    ret, cus, position, *ledger = run_position_engine_batch(
+        close,
+        **signals,
+        record_trades=return_trades or sizing is not None or (return_costs and costs is not None),
+        costs=costs if sizing is None else None,
+    )
+    trades = ledger[0] if ledger else None
+    if sizing is not None:
+        ret, cus, _ = size_positions(close, ret, cus, position, trades, sizing, costs)
+    outputs = (ret, cus, position)
+    if return_trades:
+        offset_trades(trades, start)
+        outputs += (trades,)
+    if return_costs:
+        cost = None
+        if costs is not None:
+            cost = np.bincount(trades["lane"], trades["cost"], minlength=ret.shape[1])
+        outputs += (cost,)
+    return outputs
+
+
+def _as_lanes(a, dtype):
+    """將 1-D 陣列轉成 (交易日 × 1) 的欄向量，2-D 陣列維持 (交易日 × 參數組)。"""
+    a = np.asarray(a, dtype=dtype)
+    return a[:, None] if a.ndim == 1 else a
+
+
+def run_position_engine_batch(
+    close,
+    long_entry,
+    long_entry_price,
+    long_exit,
+    long_exit_price,
+    short_entry=None,
+    short_entry_price=None,
+    short_exit=None,
+    short_exit_price=None,
+    exit_first=False,
+    record_trades=False,
+    costs=None,
+):
+    """
+    批次版持倉狀態機：一次推進 N 組參數（N 條 lane）的持倉狀態。
+
+    與 run_position_engine 的規則完全相同，差別在於每個輸入都可以是
+    (交易日 × N) 的矩陣，或是所有 lane 共用的 1-D 陣列（例如開盤價、收盤價）。
+    迴圈只沿著交易日進行，每一步以 NumPy 同時更新所有 lane，
+    因此各 lane 的結果與逐一呼叫 run_position_engine 逐位元相同。
+
+    Args:
+        與 run_position_engine 相同，但每個陣列可為 (交易日,) 或 (交易日, N)；
+        costs 為所有 lane 共用的成本模型。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，
+            形狀皆為 (交易日, N)。record_trades=True 時再加上所有 lane 的交易明細
+            （TRADE_DTYPE，lane 欄位為參數組編號，依出場 K 棒、再依 lane 排序）。
+    """
+    close = _as_lanes(close, np.float64)
+    l_in = _as_lanes(long_entry, bool)
+    l_in_px = _as_lanes(long_entry_price, np.float64)
+    l_out = _as_lanes(long_exit, bool)
+    l_out_px = _as_lanes(long_exit_price, np.float64)
+    lanes = [close, l_in, l_in_px, l_out, l_out_px]
+
+    has_short = short_entry is not None
+    if has_short:
+        s_in = _as_lanes(short_entry, bool)
+        s_in_px = _as_lanes(short_entry_price, np.float64)
+        s_out = _as_lanes(short_exit, bool)
+        s_out_px = _as_lanes(short_exit_price, np.float64)
+        lanes += [s_in, s_in_px, s_out, s_out_px]
+
+    if kernels.use_kernels() or _engine_state["mode"] == "event":
+        short = (s_in, s_in_px, s_out, s_out_px) if has_short else (None,) * 4
+        engine = _kernel_engine if kernels.use_kernels() else _event_engine
+        ret, cus, positions, trades = engine(*lanes[:5], *short, exit_first)
+        if costs is not None:
+            apply_costs(ret, cus, trades, costs)
+        return (ret, cus, positions, trades) if record_trades else (ret, cus, positions)
+
+    L, N = np.broadcast_shapes(*(a.shape for a in lanes))
+
+    ret = np.zeros((L, N), dtype=np.float64)
+    cus = np.zeros((L, N), dtype=np.float64)
+    positions = np.zeros((L, N), dtype=np.int64)
+
+    position = np.zeros(N, dtype=np.int64)
+    avg_cost = np.zeros(N, dtype=np.float64)
+    cum_ret = np.zeros(N, dtype=np.float64)
+    return_trades = record_trades
+    # 扣除成本需要交易明細
+    record_trades = record_trades or costs is not None
+    if record_trades:
+        entry_bar = np.zeros(N, dtype=np.int64)
+        closed_trades = []
+
+    def enter(i, position, avg_cost):
+        flat = position == 0
+        go_long = flat & l_in[i]
+        if has_short:
+            go_short = flat & ~l_in[i] & s_in[i]
+            avg_cost = np.where(go_long, l_in_px[i], np.where(go_short, s_in_px[i], avg_cost))
+            position = np.where(go_long, 1, np.where(go_short, -1, position))
+        else:
+            avg_cost = np.where(go_long, l_in_px[i], avg_cost)
+            position = np.where(go_long, 1, position)
+        return position, avg_cost
+
+    for i in range(L):
+        # --- 進場邏輯（進場優先的策略）---
+        if not exit_first:
+            flat = position == 0
+            position, avg_cost = enter(i, position, avg_cost)
+            if record_trades:
+                entry_bar = np.where(flat & (position != 0), i, entry_bar)
+
+        # --- 出場邏輯 ---
+        long_out = (position == 1) & l_out[i]
+        r = np.where(long_out, l_out_px[i] - avg_cost, 0.0)
+        closed = long_out
+        if has_short:
+            short_out = (position == -1) & s_out[i]
+            exit_px = np.where(short_out, s_out_px[i], l_out_px[i])
+            r = np.where(short_out, avg_cost - s_out_px[i], r)
+            closed = closed | short_out
+        else:
+            exit_px = l_out_px[i]
+        if record_trades and closed.any():
+            k = np.flatnonzero(closed)
+            exit_px = np.broadcast_to(exit_px, (N,))
+            closed_trades.append((k, entry_bar[k], i, position[k], avg_cost[k], exit_px[k], r[k]))
+        ret[i] = r
+        cum_ret += r
+        position = np.where(closed, 0, position)
+        avg_cost = np.where(closed, 0.0, avg_cost)
+
+        # --- 進場邏輯（出場優先的策略）---
+        if exit_first:
+            flat = position == 0
+            position, avg_cost = enter(i, position, avg_cost)
+            if record_trades:
+                entry_bar = np.where(flat & (position != 0), i, entry_bar)
+
+        # --- 每日結算與記錄 ---
+        unrealized = np.where(
+            position == 1,
+            close[i] - avg_cost,
+            np.where(position == -1, avg_cost - close[i], 0.0),
+        )
+        cus[i] = cum_ret + unrealized
+        positions[i] = position
+
+    if not record_trades:
+        return ret, cus, positions
+    if closed_trades:
+        lane, entries, exits, side, entry_px, exit_px, pnl = zip(*closed_trades)
+        exits = [np.full(len(k), i) for k, i in zip(lane, exits)]
+        columns = map(np.concatenate, (lane, entries, exits, side, entry_px, exit_px, pnl))
+    else:
+        columns = ((),) * 7
+    trades = _trade_ledger(*columns)
+    if costs is not None:
+        apply_costs(ret, cus, trades, costs)
+    return (ret, cus, positions, trades) if return_trades else (ret, cus, positions)
@@ -0,0 +1,187 @@
+# 網格搜尋與參數曲面
+# 隨機抽樣在小範圍的整數參數上會留下空洞，也無法看出績效在參數空間中的形狀。
+# grid_search 列舉所有滿足限制條件的參數組合（見 sweep.grid_sampler），
+# 以批次回測一次推進多組參數（同一週期的指標只計算一次，經由指標快取在各批之間共用），
+# 再把績效排成稠密的 N 維曲面：每個參數一個軸，不滿足限制條件的格子為 NaN。
+#
+# 單一格子的高績效可能只是運氣（前後的參數都很差）。ParameterSurface.smoothed 對每個格子
+# 取鄰近 (2r+1)^N 個可行格子的平均（忽略 NaN），best() 預設挑選鄰域平均最高的參數，
+# 也就是「附近的參數也都不錯」的穩健區域，而不是孤立的尖峰。
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from lib.backtest.optimizer import EQUITY
+from lib.backtest.sweep import evaluate_param_sets, grid_axes, grid_sampler
+
+SMOOTHED_SUFFIX = "（鄰域平均）"
+
+
+def _box_sum(values, radius):
+    """沿每個軸各取前後 radius[axis] 格的移動加總（超出邊界的部分視為 0）。"""
+    for axis, r in enumerate(radius):
+        if r == 0:
+            continue
+        pad = [(0, 0)] * values.ndim
+        pad[axis] = (r, r)
+        windows = sliding_window_view(np.pad(values, pad), 2 * r + 1, axis=axis)
+        values = windows.sum(axis=-1)
+    return values
+
+
+class ParameterSurface:
+    """
+    網格搜尋結果的 N 維績效曲面。
+
+    Args:
+        results (SweepResults): 網格搜尋的回測結果（見 lib.backtest.sweep_results）。
+        metric (str): 預設的績效指標。
+        axes (dict[str, array-like], optional): 每個參數的軸（完整的參數值，見 sweep.grid_axes）；
+            未提供時取結果中出現過的參數值（由小到大）。
+
+    Attributes:
+        names (list[str]): 參數名稱，依軸的順序。
+        axes (list[np.ndarray]): 每個軸的參數值。
+        results (SweepResults): 完整的回測結果（所有績效指標）。
+    """
+
+    __slots__ = ("names", "axes", "metric", "results", "_cells")
+
+    def __init__(self, results, metric=EQUITY, axes=None):
+        self.names = list(results.params)
+        self.metric = metric
+        self.results = results
+        self.axes, cells = [], []
+        for name in self.names:
+            column = results.params[name]
+            if axes is None:
+                axis, index = np.unique(column, return_inverse=True)
+            else:
+                axis = np.asarray(axes[name])
+                position = {value: k for k, value in enumerate(axis.tolist())}
+                index = np.array([position[value] for value in column.tolist()], dtype=np.int64)
+            self.axes.append(axis)
+            cells.append(index.reshape(-1))
+        self._cells = tuple(cells)
+
+    def __repr__(self):
+        shape = " × ".join(f"{name}[{len(axis)}]" for name, axis in zip(self.names, self.axes))
+        return f"ParameterSurface({shape}, {len(self.results)} 組參數)"
+
+    @property
+    def shape(self):
+        return tuple(len(axis) for axis in self.axes)
+
+    def values(self, metric=None):
+        """
+        稠密的績效曲面。
+
+        Returns:
+            np.ndarray: 形狀為 shape 的陣列，不滿足限制條件（未回測）的格子為 NaN。
+        """
+        surface = np.full(self.shape, np.nan)
+        surface[self._cells] = self.results.metrics[metric or self.metric]
+        return surface
+
+    def _radius(self, radius):
+        if isinstance(radius, dict):
+            return [int(radius.get(name, 0)) for name in self.names]
+        # 類別參數的相鄰值沒有意義，預設不跨類別平均
+        return [int(radius) if axis.dtype.kind in "iuf" else 0 for axis in self.axes]
+
+    def smoothed(self, radius=1, metric=None):
+        """
+        鄰域平均曲面：每個可行格子取前後 radius 格內所有可行格子的績效平均。
+
+        Args:
+            radius (int | dict[str, int]): 鄰域半徑；int 套用到所有數值軸，
+                dict 可逐軸指定（未列出的軸為 0）。
+            metric (str, optional): 績效指標，預設為建立時指定的指標。
+
+        Returns:
+            np.ndarray: 與 values() 形狀相同，不可行的格子為 NaN。
+        """
+        surface = self.values(metric)
+        feasible = ~np.isnan(surface)
+        radius = self._radius(radius)
+        total = _box_sum(np.where(feasible, surface, 0.0), radius)
+        count = _box_sum(feasible.astype(float), radius)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(feasible, total / count, np.nan)
+
+    def best(self, radius=1, metric=None):
+        """
+        鄰域平均最高的參數組（radius=0 時即為單格績效最高者）。
+
+        Returns:
+            dict: 參數值，另加該格的績效與鄰域平均。
+        """
+        metric = metric or self.metric
+        smoothed = self.smoothed(radius, metric)
+        cell = np.unravel_index(np.nanargmax(smoothed), smoothed.shape)
+        params = {name: axis[k].item() for name, axis, k in zip(self.names, self.axes, cell)}
+        params[metric] = self.values(metric)[cell].item()
+        params[metric + SMOOTHED_SUFFIX] = smoothed[cell].item()
+        return params
+
+    def to_frame(self, radius=1, metric=None):
+        """所有回測結果（參數欄位 + 績效指標），另加指定指標的鄰域平均欄。"""
+        metric = metric or self.metric
+        frame = self.results.to_frame()
+        frame[metric + SMOOTHED_SUFFIX] = self.smoothed(radius, metric)[self._cells]
+        return frame
+
+    def pivot(self, smoothed=False, radius=1, metric=None):
+        """
+        二維曲面的表格（列為第一個參數、欄為第二個參數），可直接畫成熱圖。
+        超過兩個參數時請先以 results 篩選出二維的切面再建立曲面。
+        """
+        if len(self.names) != 2:
+            raise ValueError(f"pivot 只適用於二維曲面，目前為 {len(self.names)} 維")
+        surface = self.smoothed(radius, metric) if smoothed else self.values(metric)
+        return pd.DataFrame(
+            surface,
+            index=pd.Index(self.axes[0], name=self.names[0]),
+            columns=pd.Index(self.axes[1], name=self.names[1]),
+        )
+
+
+def grid_search(
+    df_original,
+    backtest_func,
+    performance_func,
+    param_space,
+    constraints=(),
+    metric=EQUITY,
+    batch_func=None,
+    chunk_size=1024,
+    n_jobs=1,
+    executor=None,
+    store=None,
+):
+    """
+    網格搜尋：回測參數空間中所有滿足限制條件的組合，回傳績效曲面。
+
+    Args:
+        df_original (pd.DataFrame): 原始資料。
+        backtest_func (function): 回測函數，接受 df 與參數。
+        performance_func (function): 計算績效函數，接受回測結果 df，返回 dict。
+        param_space (dict): 參數空間（只支援整數與類別參數），例如
+            {'short_ma_period': (2, 60), 'long_ma_period': (2, 60)}
+        constraints (list[str]): 限制條件，例如 ['short_ma_period < long_ma_period']。
+        metric (str): 曲面的預設績效指標。
+        batch_func, chunk_size, n_jobs, executor, store: 同 sweep.evaluate_param_sets；
+            網格通常有上千組參數，建議提供 batch_func。
+
+    Returns:
+        ParameterSurface: 績效曲面（完整的回測結果在 surface.results）。
+    """
+    param_sets = grid_sampler(param_space, list(constraints))
+    print(f"準備進行 {len(param_sets)} 組網格參數測試...")
+    results = evaluate_param_sets(
+        df_original, backtest_func, performance_func, param_sets,
+        batch_func, chunk_size, n_jobs, executor, store, as_frame=False,
+    )
+    # 曲面的軸涵蓋完整的參數範圍（例如 short < long 時 short 的上界也在軸上，該列全為 NaN）
+    return ParameterSurface(results, metric, grid_axes(param_space))
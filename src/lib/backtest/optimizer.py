@@ -0,0 +1,258 @@
+# 以 Optuna 搜尋策略參數
+# 與 sweep.run_sweep 的隨機抽樣不同，這裡由 Optuna 的取樣器（TPE / CMA-ES）依照過去的結果
+# 決定下一組參數，通常只需少量回測就能找到相近的最佳解。
+# 剪枝：每組參數依序在資料的前 25%、50%、100% 上回測並回報中間成績，
+# 成績明顯落後的參數組提早放棄，不必跑完整段資料。
+# 限制條件（例如 ma_short < ma_long）不以每個 trial 不同的動態範圍取樣：
+# 受限制的參數改取固定範圍 [0, 1] 的相對位置，再對應到該 trial 的可行範圍，
+# 所有參數的取樣範圍固定不變，CMA-ES 等取樣器才能把它們放在同一個搜尋空間中一起建模。
+# 指定 storage_path 時研究會存成本機 SQLite 檔，中斷後以相同設定重新執行即可接續；
+# 未指定 study_name 時，研究名稱由策略、資料與參數空間決定。
+
+import functools
+import hashlib
+import json
+import math
+
+import numpy as np
+import optuna
+import pandas as pd
+
+from lib.backtest.sweep import normalize_space, parse_constraint
+from lib.backtest.sweep_store import callable_name, frame_fingerprint, strategy_key
+from lib.performance_analysis import calculate_strategy_performance
+
+EQUITY = "最終權益 (Mark-to-Market)"
+MDD = "最大回撤 (MDD)"
+# 受限制參數的相對位置在 trial.params 中的名稱後綴（實際回測的參數值在 trial.user_attrs["params"]）
+POSITION_SUFFIX = "_position"
+
+
+def _mdd_penalized(penalty, metrics):
+    return metrics[EQUITY] - penalty * metrics[MDD]
+
+
+def mdd_penalized(penalty=1.0):
+    """
+    建立「最終權益 - penalty × 最大回撤」的目標函數，偏好回撤較小的參數。
+    """
+    # 以 partial 建立，研究名稱（見 _default_study_name）才會包含 penalty
+    return functools.partial(_mdd_penalized, penalty)
+
+
+def _make_sampler(sampler, seed):
+    if not isinstance(sampler, str):
+        return sampler
+    if sampler == "tpe":
+        return optuna.samplers.TPESampler(seed=seed)
+    if sampler == "cmaes":
+        try:
+            import cmaes  # noqa: F401  Optuna 的 CMA-ES 取樣器依賴此套件
+        except ImportError as e:
+            raise ImportError("CMA-ES 取樣器需要另外安裝 cmaes 套件：pip install cmaes") from e
+        return optuna.samplers.CmaEsSampler(seed=seed)
+    if sampler == "random":
+        return optuna.samplers.RandomSampler(seed=seed)
+    raise ValueError(f"未知的取樣器：{sampler}")
+
+
+def _static_bounds(space, pairs):
+    """
+    依限制條件收緊整數參數的上下界，直到不再變動。
+    例如 'a < b' 時 a 的上界不超過 b 的上界 - 1、b 的下界不低於 a 的下界 + 1，
+    之後依序取樣時，每個參數在前面的參數決定後都至少有一個可行的值。
+
+    Returns:
+        dict[str, tuple[int, int]]: 整數參數 → (下界, 上界)。
+    """
+    bounds = {name: [spec["low"], spec["high"]] for name, spec in space.items()
+              if spec["kind"] == "int"}
+    changed = True
+    while changed:
+        changed = False
+        for a, op, b in pairs:
+            gap = 1 if op == "<" else 0
+            if bounds[b][1] - gap < bounds[a][1]:
+                bounds[a][1] = bounds[b][1] - gap
+                changed = True
+            if bounds[a][0] + gap > bounds[b][0]:
+                bounds[b][0] = bounds[a][0] + gap
+                changed = True
+            if bounds[a][0] > bounds[a][1] or bounds[b][0] > bounds[b][1]:
+                raise ValueError(f"參數範圍內沒有任何組合滿足限制條件：{a} {op} {b}")
+    return {name: tuple(bound) for name, bound in bounds.items()}
+
+
+def _suggest(trial, space, pairs, bounds):
+    """
+    依參數空間向 trial 取得一組參數。
+
+    整數參數的範圍先以 _static_bounds 收緊。與前面已取得的參數有限制條件的整數參數
+    （例如 'ma_short < ma_medium' 中的 ma_medium），可行範圍 [max(下界, ma_short + 1), 上界]
+    隨 trial 而不同，因此改取固定範圍 [0, 1] 的相對位置（名稱加上 POSITION_SUFFIX），
+    再對應到本次的可行範圍；其餘參數直接以固定範圍取樣。
+    """
+    params = {}
+    for name, spec in space.items():
+        if spec["kind"] == "categorical":
+            params[name] = trial.suggest_categorical(name, spec["choices"])
+            continue
+        if spec["kind"] == "float":
+            value = trial.suggest_float(name, spec["low"], spec["high"])
+            params[name] = value if spec["digits"] is None else round(value, spec["digits"])
+            continue
+
+        low, high = bounds[name]
+        linked = False
+        for a, op, b in pairs:
+            gap = 1 if op == "<" else 0
+            if b == name and a in params:
+                low = max(low, params[a] + gap)
+                linked = True
+            if a == name and b in params:
+                high = min(high, params[b] - gap)
+                linked = True
+        if not linked:
+            params[name] = trial.suggest_int(name, low, high)
+            continue
+        if low > high:
+            raise optuna.TrialPruned(f"{name} 沒有滿足限制條件的值")
+        position = trial.suggest_float(name + POSITION_SUFFIX, 0.0, 1.0)
+        params[name] = low + min(int(position * (high - low + 1)), high - low)
+    return params
+
+
+def _default_study_name(df_original, backtest_func, performance_func, space, constraints,
+                        objective, direction, prefixes):
+    """由策略、資料、參數空間與目標決定的研究名稱，相同設定每次都得到相同的名稱。"""
+    config = [
+        strategy_key(backtest_func, performance_func),
+        frame_fingerprint(df_original),
+        sorted(space.items()),
+        list(constraints),
+        callable_name(objective) if callable(objective) else objective,
+        direction,
+        list(prefixes),
+    ]
+    digest = hashlib.blake2b(
+        json.dumps(config, default=str, ensure_ascii=False).encode(), digest_size=8
+    )
+    return f"optimize-{digest.hexdigest()}"
+
+
+def _to_attr(value):
+    """將績效值轉成可存入 storage 的 JSON 型別。"""
+    if isinstance(value, (np.integer, np.floating)):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+
+def optimize_strategy(
+    df_original,
+    backtest_func,
+    param_space,
+    constraints=(),
+    performance_func=calculate_strategy_performance,
+    objective=EQUITY,
+    direction="maximize",
+    n_trials=100,
+    sampler="tpe",
+    pruner=None,
+    prefixes=(0.25, 0.5, 1.0),
+    seed=None,
+    study_name=None,
+    storage_path=None,
+    show_progress_bar=False,
+):
+    """
+    以 Optuna 搜尋策略參數。
+
+    Args:
+        df_original (pd.DataFrame): 原始資料。
+        backtest_func (function): 任一 backtest_strategy* 函數。
+        param_space (dict): 參數空間，寫法同 sweep.run_sweep。
+        constraints (list[str]): 整數參數之間的限制條件，例如 ['ma_short < ma_medium < ma_long']。
+        performance_func (function): 計算績效函數，接受回測結果 df，返回 dict。
+        objective (str | function): 績效字典中的指標名稱，或接受績效字典並回傳數值的函數
+            （例如 mdd_penalized(0.5)）。
+        direction (str): "maximize" 或 "minimize"。
+        n_trials (int): 本次執行的 trial 數（接續既有研究時為額外的次數）。
+        sampler (str | optuna.samplers.BaseSampler): "tpe"、"cmaes"、"random" 或自訂取樣器。
+        pruner (optuna.pruners.BasePruner, optional): 預設為 MedianPruner。
+        prefixes (tuple[float]): 依序回測的資料比例，最後一個必須為 1.0；
+            設為 (1.0,) 即不剪枝。
+        seed (int, optional): 取樣器的亂數種子。
+        study_name (str, optional): 研究名稱，接續既有研究時需相同。
+            指定 storage_path 而未指定時，依策略、資料、參數空間與目標產生固定的名稱。
+        storage_path (str, optional): SQLite 檔案路徑，例如 "optuna_strategy_one.db"。
+        show_progress_bar (bool): 是否顯示 Optuna 進度條。
+
+    Returns:
+        optuna.Study: 研究物件；完整結果可用 study_results(study) 轉成 DataFrame。
+    """
+    if prefixes[-1] != 1.0:
+        raise ValueError("prefixes 的最後一個比例必須為 1.0")
+
+    space = normalize_space(param_space)
+    pairs = [pair for expr in constraints for pair in parse_constraint(expr)]
+    for a, _, b in pairs:
+        for name in (a, b):
+            if space.get(name, {}).get("kind") != "int":
+                raise ValueError(f"限制條件只支援整數參數：{name}")
+
+    bounds = _static_bounds(space, pairs)
+    score = objective if callable(objective) else (lambda metrics: metrics[objective])
+    L = len(df_original)
+
+    def run_trial(trial):
+        params = _suggest(trial, space, pairs, bounds)
+        for step, fraction in enumerate(prefixes):
+            n = L if fraction == 1.0 else max(2, int(L * fraction))
+            metrics = performance_func(backtest_func(df_original.iloc[:n], **params))
+            value = float(score(metrics))
+            if fraction < 1.0:
+                trial.report(value, step)
+                if trial.should_prune():
+                    raise optuna.TrialPruned()
+
+        # 記錄實際回測的參數（浮點數參數已四捨五入）與完整績效，供 study_results 使用
+        trial.set_user_attr("params", params)
+        trial.set_user_attr("metrics", {k: _to_attr(v) for k, v in metrics.items()})
+        return value
+
+    storage = None
+    if storage_path is not None:
+        storage = f"sqlite:///{storage_path}"
+        if study_name is None:
+            study_name = _default_study_name(
+                df_original, backtest_func, performance_func, space, constraints,
+                objective, direction, prefixes,
+            )
+            print(f"研究名稱：{study_name}")
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=storage,
+        sampler=_make_sampler(sampler, seed),
+        pruner=pruner if pruner is not None else optuna.pruners.MedianPruner(n_startup_trials=10),
+        direction=direction,
+        load_if_exists=storage is not None,
+    )
+    study.optimize(run_trial, n_trials=n_trials, show_progress_bar=show_progress_bar)
+    return study
+
+
+def study_results(study):
+    """
+    將已完成的 trial 整理成與 run_sweep 相同格式的結果表（參數欄位 + 績效指標），
+    可直接交給 plot_strategy_sensitivity 繪圖。
+    """
+    rows = []
+    for trial in study.trials:
+        if trial.state != optuna.trial.TrialState.COMPLETE:
+            continue
+        row = dict(trial.user_attrs["params"])
+        row.update(trial.user_attrs["metrics"])
+        rows.append(row)
+    return pd.DataFrame(rows)
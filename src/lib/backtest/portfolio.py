@@ -0,0 +1,180 @@
+# 多檔股票的投資組合回測
+# 把代號當成第二個陣列軸：所有股票的價格排成 (交易日 × 代號) 矩陣，
+# 以各策略的 *_panel 函數一次算完指標並交給批次狀態機，不必逐檔呼叫 backtest_strategy*。
+# 每檔股票的 ret / cus 以「點數」計（與單檔回測相同），再依資金配置換算成股數加總成投資組合權益。
+#
+# 停牌造成的中間缺值以前一日收盤價補上（當日沒有價格變動），
+# 因此沒有停牌的股票，其結果與單獨回測逐位元相同。
+
+import numpy as np
+import pandas as pd
+
+from lib.backtest.strategy_four import backtest_strategy_four, backtest_strategy_four_panel
+from lib.backtest.strategy_one import backtest_strategy, backtest_strategy_panel
+from lib.backtest.strategy_three import backtest_strategy_three, backtest_strategy_three_panel
+from lib.backtest.strategy_two import backtest_strategy_two, backtest_strategy_two_panel
+from lib.data_loader import DATE_COLUMN, PRICE_COLUMNS
+from lib.performance_analysis import BATCH_PERFORMANCE, calculate_strategy_performance
+
+# 單檔回測函數 → 多檔版本
+PANEL_BACKTESTS = {
+    backtest_strategy: backtest_strategy_panel,
+    backtest_strategy_two: backtest_strategy_two_panel,
+    backtest_strategy_three: backtest_strategy_three_panel,
+    backtest_strategy_four: backtest_strategy_four_panel,
+}
+
+
+def align_frames(frames):
+    """
+    將 {代號: DataFrame} 依「年月日」對齊成 (交易日 × 代號 × 欄位) 陣列。
+
+    Returns:
+        tuple[pd.DatetimeIndex, list[str], np.ndarray]: (交易日, 代號, 價格陣列)，缺值為 NaN。
+    """
+    symbols = list(frames)
+    stamps = [df[DATE_COLUMN].to_numpy(dtype="datetime64[ns]") for df in frames.values()]
+    dates = np.unique(np.concatenate(stamps))
+    values = np.full((len(dates), len(symbols), len(PRICE_COLUMNS)), np.nan)
+    for j, (df, stamp) in enumerate(zip(frames.values(), stamps)):
+        values[np.searchsorted(dates, stamp), j, :] = df[PRICE_COLUMNS].to_numpy(dtype=float)
+    dates = pd.DatetimeIndex(dates)
+    return dates, symbols, values
+
+
+def _fill_gaps(values):
+    """以前一日收盤價補上停牌日（開高低收皆設為前收），上市前的缺值維持 NaN。"""
+    close = pd.DataFrame(values[:, :, PRICE_COLUMNS.index("收盤價")]).ffill().to_numpy()
+    missing = np.isnan(values[:, :, 0]) & ~np.isnan(close)
+    if not missing.any():
+        return values
+    values = values.copy()
+    for k in range(4):
+        values[:, :, k] = np.where(missing, close, values[:, :, k])
+    return values
+
+
+def _allocation_shares(allocation, capital, first_close, symbols, live):
+    """
+    依資金配置方式計算每檔股票持有的股數（單位數）。
+    live 為 False 的代號（區間內沒有任何價格）股數為 0，權重重新正規化到其餘代號。
+    """
+    n = len(symbols)
+    if isinstance(allocation, str):
+        if allocation == "points":
+            return live.astype(float)
+        if allocation == "equal":
+            weights = live.astype(float)
+        else:
+            raise ValueError(f"未知的資金配置方式：{allocation}")
+    else:
+        if isinstance(allocation, dict):
+            allocation = [allocation.get(s, 0.0) for s in symbols]
+        weights = np.asarray(allocation, dtype=float)
+        if weights.shape != (n,) or weights.sum() <= 0:
+            raise ValueError("allocation 權重的數量需與代號相同且總和為正")
+        weights = np.where(live, weights, 0.0)
+        if weights.sum() <= 0:
+            raise ValueError("區間內有價格資料的代號，其 allocation 權重總和需為正")
+    weights = weights / weights.sum()
+    shares = np.zeros(n)
+    shares[live] = capital * weights[live] / first_close[live]
+    return shares
+
+
+def run_portfolio(
+    prices,
+    backtest_func,
+    params=None,
+    symbols=None,
+    start=None,
+    end=None,
+    allocation="equal",
+    capital=1_000_000,
+    performance_func=calculate_strategy_performance,
+):
+    """
+    以同一組策略參數回測多檔股票，並彙總成投資組合。
+
+    Args:
+        prices (PriceStore | dict[str, pd.DataFrame]): 價格庫，或 {代號: load_price_csv 格式的 DataFrame}。
+        backtest_func (function): 任一 backtest_strategy* 函數（需在 PANEL_BACKTESTS 中）。
+        params (dict, optional): 策略參數，預設使用策略函數的預設值。
+        symbols (list[str], optional): 只回測這些代號（僅適用於價格庫）。
+        start, end (str | datetime, optional): 日期區間（僅適用於價格庫）。
+        allocation (str | dict | array-like): 資金配置方式：
+            - "equal"：每檔分配相同資金，以第一個交易日的收盤價換算股數。
+            區間內沒有任何價格的代號股數為 0，其餘代號的權重重新正規化。
+            - "points"：每檔 1 單位，投資組合權益即各檔點數加總。
+            - {代號: 權重} 或權重陣列：依權重比例分配資金。
+        capital (float): 初始資金（"points" 模式不使用）。
+        performance_func (function): 計算績效函數，接受含 ret / cus 的 DataFrame，返回 dict。
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame, dict]:
+            - 投資組合逐日資料：ret（當日已實現損益）、cus（累計損益）、equity（資金 + cus）、
+              position（持倉中的檔數）、BH（買入並持有的累計損益），index 為交易日。
+            - 各檔股票的績效（以點數計，只使用該股上市期間），index 為代號。
+            - 投資組合整體的績效。注意其中的交易次數與勝率以「有已實現損益的交易日」計。
+    """
+    panel_func = PANEL_BACKTESTS.get(backtest_func)
+    if panel_func is None:
+        raise ValueError(f"{getattr(backtest_func, '__name__', backtest_func)} 沒有對應的多檔版本")
+
+    if isinstance(prices, dict):
+        dates, symbols, values = align_frames(prices)
+    else:
+        dates, values = prices.array(symbols=symbols, start=start, end=end)
+        symbols = list(prices.symbols) if symbols is None else list(symbols)
+        values = np.asarray(values, dtype=float)
+
+    values = _fill_gaps(values)
+    open_, high, low, close = (values[:, :, k] for k in range(4))
+
+    # 上市期間：從第一個有收盤價的交易日開始
+    listed = ~np.isnan(close)
+    # 區間內完全沒有價格的代號（例如以日期區間切出的價格庫中尚未上市的股票）不列入投資組合，
+    # 否則其 NaN 的第一個收盤價會讓整個投資組合的權益都變成 NaN
+    live = listed.any(axis=0)
+    if not live.any():
+        raise ValueError("選取的區間內沒有任何代號有價格資料")
+    if not live.all():
+        print(f"區間內沒有價格資料，不列入投資組合：{', '.join(np.asarray(symbols)[~live])}")
+
+    ret, cus, position = panel_func(open_, high, low, close, **(params or {}))
+    first_row = listed.argmax(axis=0)
+    first_close = close[first_row, np.arange(len(symbols))]
+    bh = np.where(listed, close - first_close, 0.0)
+
+    shares = _allocation_shares(allocation, capital, first_close, symbols, live)
+    portfolio = pd.DataFrame(
+        {
+            "ret": ret[:, live] @ shares[live],
+            "cus": cus[:, live] @ shares[live],
+            "position": (position != 0).sum(axis=1),
+            "BH": bh[:, live] @ shares[live],
+        },
+        index=dates,
+    )
+    initial = 0.0 if isinstance(allocation, str) and allocation == "points" else capital
+    portfolio.insert(2, "equity", initial + portfolio["cus"])
+
+    batch_performance = BATCH_PERFORMANCE.get(performance_func)
+    if batch_performance is not None and listed.all():
+        # 所有股票在整段期間都有價格時，一次算完全部代號的績效
+        symbol_metrics = batch_performance(ret, cus, position)
+        symbol_metrics.insert(0, "股數", shares)
+        symbol_metrics.index = pd.Index(symbols, name="代號")
+    else:
+        rows = []
+        for j, symbol in enumerate(symbols):
+            mask = listed[:, j]
+            if not mask.any():
+                continue
+            df_j = pd.DataFrame(
+                {"ret": ret[mask, j], "cus": cus[mask, j], "position": position[mask, j]}
+            )
+            rows.append({"代號": symbol, "股數": shares[j], **performance_func(df_j)})
+        symbol_metrics = pd.DataFrame(rows).set_index("代號")
+
+    return portfolio, symbol_metrics, performance_func(portfolio)
@@ -0,0 +1,228 @@
+# 部位規模與資金模式
+# 點數模式（預設）每次只交易 1 單位，ret / cus 為點數，不同價位的標的（加權指數、2330、2412）無法互相比較。
+# 資金模式以初始資金與部位規模規則決定每筆交易的單位數，ret / cus 改以金額表示，並可計算百分比報酬。
+#
+# 部位規模不影響任何進出場時點，因此與成本模型相同，不必改動狀態機：
+# 先以點數模式跑完引擎，再依交易明細逐筆決定單位數（複利時依進場前的權益），
+# 最後把「每單位」的已實現 / 未實現損益乘上持有的單位數，得到金額權益曲線。
+# 交易成本則不能按單位數放大：最低手續費以「每筆委託」計，因此資金模式的引擎不扣成本，
+# 改在決定單位數的同時依該筆委託的單位數計算成本金額（見 CostModel.trade_costs）。
+# 逐筆決定單位數的迴圈只沿著交易序號進行，同一序號的所有參數組（lane）一起以 NumPy 計算。
+
+import numpy as np
+import pandas as pd
+
+
+class PositionSizer:
+    """
+    部位規模規則的共用基底：子類別實作 units(base, price, volatility)，回傳每筆交易的單位數。
+
+    Args:
+        capital (float): 初始資金。
+        compounding (bool): True 時以進場前的權益（資金 + 已實現損益）計算部位，否則一律以初始資金計算。
+        lot_size (float | None): 單位數取整的最小單位（例如 1 股、1000 股）；None 表示允許小數單位。
+    """
+
+    needs_volatility = False
+
+    def __init__(self, capital=1_000_000, compounding=True, lot_size=None):
+        if capital <= 0:
+            raise ValueError("capital 必須為正數")
+        self.capital = capital
+        self.compounding = compounding
+        self.lot_size = lot_size
+
+    def __repr__(self):
+        # 參數掃描的結果以 repr 作為策略鍵的一部分（見 sweep_store.strategy_key），需與設定一一對應
+        fields = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"{type(self).__name__}({fields})"
+
+    def units(self, base, price, volatility):
+        raise NotImplementedError
+
+    def _round(self, units):
+        if self.lot_size:
+            units = np.floor(units / self.lot_size) * self.lot_size
+        return units
+
+
+class FixedShares(PositionSizer):
+    """每筆交易固定單位數（不隨權益變動）。"""
+
+    def __init__(self, shares=1000, capital=1_000_000):
+        super().__init__(capital, compounding=False)
+        self.shares = shares
+
+    def units(self, base, price, volatility):
+        return np.full(np.shape(price), float(self.shares))
+
+
+class FixedFraction(PositionSizer):
+    """
+    每筆交易投入權益的固定比例：單位數 = fraction × 權益 / 進場價。
+
+    Args:
+        fraction (float): 投入比例，1.0 為全額投入。
+        其餘參數見 PositionSizer。
+    """
+
+    def __init__(self, fraction=1.0, capital=1_000_000, compounding=True, lot_size=None):
+        super().__init__(capital, compounding, lot_size)
+        if fraction <= 0:
+            raise ValueError("fraction 必須為正數")
+        self.fraction = fraction
+
+    def units(self, base, price, volatility):
+        return self._round(self.fraction * base / price)
+
+
+class VolatilityTarget(PositionSizer):
+    """
+    波動度目標：投入比例 = min(target_vol / 年化波動度, max_leverage)。
+    波動度為進場前一日為止 window 根 K 棒收盤報酬的年化標準差（不使用進場當日的資訊）。
+
+    Args:
+        target_vol (float): 目標年化波動度，例如 0.15。
+        window (int): 估計波動度的 K 棒數。
+        max_leverage (float): 投入比例的上限。
+        periods_per_year (int): 年化時每年的 K 棒數。
+        其餘參數見 PositionSizer。
+    """
+
+    needs_volatility = True
+
+    def __init__(
+        self,
+        target_vol=0.15,
+        window=20,
+        max_leverage=1.0,
+        capital=1_000_000,
+        compounding=True,
+        lot_size=None,
+        periods_per_year=252,
+    ):
+        super().__init__(capital, compounding, lot_size)
+        if target_vol <= 0 or window < 2:
+            raise ValueError("target_vol 必須為正數，window 至少為 2")
+        self.target_vol = target_vol
+        self.window = window
+        self.max_leverage = max_leverage
+        self.periods_per_year = periods_per_year
+
+    def volatility(self, close):
+        """(交易日,) 或 (交易日 × N) 收盤價 → 截至前一日的年化波動度（暖機期間為 NaN）。"""
+        returns = pd.DataFrame(close).pct_change()
+        vol = returns.rolling(self.window).std().shift(1).to_numpy()
+        return vol * np.sqrt(self.periods_per_year)
+
+    def units(self, base, price, volatility):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weight = np.minimum(self.target_vol / volatility, self.max_leverage)
+        # 波動度尚未暖機（NaN）或為 0 時以上限投入
+        weight = np.where(np.isfinite(weight), weight, self.max_leverage)
+        return self._round(weight * base / price)
+
+
+def size_positions(close, ret, cus, position, trades, sizer, costs=None):
+    """
+    把點數模式的引擎輸出換算成資金模式。
+
+    交易明細會被就地改寫成資金模式：units 為該筆交易的單位數，pnl / cost 為金額。
+
+    Args:
+        close (np.ndarray): (交易日,) 或 (交易日 × N) 的收盤價（與引擎輸入相同）。
+        ret, cus, position (np.ndarray): 點數模式的引擎輸出（每單位，未扣除成本）。
+        trades (np.ndarray): 同一次執行的交易明細（engine.TRADE_DTYPE）。
+        sizer (PositionSizer): 部位規模規則。
+        costs (CostModel, optional): 交易成本模型；依每筆交易的單位數計算成本金額，於出場日扣除。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: 與 ret 同形狀的 (ret, cus, units)：
+            - ret: 每筆交易的已實現損益（金額，僅出場日非零）
+            - cus: 累計損益（金額，已實現 + 未實現）；權益 = sizer.capital + cus
+            - units: 每日收盤後持有的單位數
+    """
+    single = np.ndim(ret) == 1
+    ret, cus, position = (np.asarray(a).reshape(len(a), -1) for a in (ret, cus, position))
+    L, N = ret.shape
+    raw_close = np.asarray(close, dtype=float).reshape(L, -1)
+    close = np.broadcast_to(raw_close, (L, N))
+    lanes = np.arange(N)
+
+    # 每單位的未實現損益（出場日之後已歸零）
+    unrealized = cus - np.cumsum(ret, axis=0)
+
+    # 收盤時持有的每一段部位從哪一根 K 棒開始：持倉改變，或當日出場後又重新進場
+    exited = np.zeros((L, N), dtype=bool)
+    exited[trades["exit_bar"], trades["lane"]] = True
+    previous = np.vstack([np.zeros((1, N), dtype=position.dtype), position[:-1]])
+    opened = (position != 0) & ((position != previous) | exited)
+    bars = np.arange(L)[:, None]
+    start = np.maximum.accumulate(np.where(opened, bars, 0), axis=0)
+
+    # 期末仍未平倉的部位不在交易明細中，由收盤價與未實現損益還原進場價
+    still_open = np.flatnonzero(position[-1] != 0)
+    open_bar = start[-1, still_open]
+    side = position[-1, still_open]
+    open_price = close[open_bar, still_open] - side * unrealized[open_bar, still_open]
+
+    lane = np.concatenate([trades["lane"], still_open])
+    entry_bar = np.concatenate([trades["entry_bar"], open_bar])
+    entry_price = np.concatenate([trades["entry_price"], open_price])
+    pnl = np.concatenate([trades["pnl"], np.zeros(len(still_open))])
+
+    # 依 lane、進場順序排列，算出每筆交易在該 lane 中的序號
+    order = np.lexsort((entry_bar, lane))
+    lane, entry_bar, entry_price, pnl = lane[order], entry_bar[order], entry_price[order], pnl[order]
+    first = np.searchsorted(lane, lane)
+    seq = np.arange(len(lane)) - first
+    K = int(seq.max()) + 1 if len(lane) else 0
+
+    volatility = None
+    if sizer.needs_volatility:
+        volatility = np.broadcast_to(sizer.volatility(raw_close), (L, N))[entry_bar, lane]
+
+    # 逐一序號決定單位數：所有 lane 的第 k 筆交易一起計算
+    closed = order < len(trades)
+    units = np.zeros(len(lane))
+    cost = np.zeros(len(lane))
+    equity = np.full(N, float(sizer.capital))
+    by_seq = np.argsort(seq, kind="stable")
+    bounds = np.searchsorted(seq[by_seq], np.arange(K + 1))
+    for k in range(K):
+        at = by_seq[bounds[k]:bounds[k + 1]]
+        j = lane[at]
+        base = equity[j] if sizer.compounding else np.full(len(at), float(sizer.capital))
+        vol = None if volatility is None else volatility[at]
+        u = np.where(base > 0, sizer.units(base, entry_price[at], vol), 0.0)
+        units[at] = u
+        if costs is not None:
+            # 已平倉的交易依單位數計算成本（期末未平倉的部位不扣成本，與點數模式相同）
+            done = at[closed[at]]
+            ledger = trades[order[done]]
+            ledger["units"] = units[done]
+            cost[done] = costs.total(ledger)
+        equity[j] += u * pnl[at] - cost[at]
+
+    # 交易明細改以金額表示
+    ledger_rows = order[closed]
+    trades["units"][ledger_rows] = units[closed]
+    trades["cost"][ledger_rows] = cost[closed]
+    trades["pnl"][ledger_rows] = units[closed] * pnl[closed] - cost[closed]
+
+    # 已實現損益：出場日認列；未實現損益：收盤持有的單位數 × 每單位未實現損益
+    cash_ret = np.zeros((L, N))
+    exit_bar = trades["exit_bar"][ledger_rows]
+    np.add.at(cash_ret, (exit_bar, lane[closed]), trades["pnl"][ledger_rows])
+
+    held = np.zeros((L, N))
+    carried = closed.copy()
+    carried[closed] = exit_bar > entry_bar[closed]
+    carried |= ~closed
+    held[entry_bar[carried], lane[carried]] = units[carried]
+    held = held[start, lanes] * (position != 0)
+
+    cash_cus = np.cumsum(cash_ret, axis=0) + held * unrealized
+    if single:
+        return cash_ret[:, 0], cash_cus[:, 0], held[:, 0]
+    return cash_ret, cash_cus, held
@@ -9,9 +9,68 @@
 #   - 停損: 持有多單時，K線開收盤價皆破下軌；持有空單時，K線開收盤價皆破上軌。
 #   - 停利: 持有多單時觸及上軌；持有空單時觸及下軌。
 
-from lib.technical_indicators import calc_Bollinger
+import numpy as np
+
+from lib.backtest.engine import (
+    TRADE_DTYPE,
+    PositionState,
+    StreamingStrategy,
+    attach_results,
+    backtest_frame,
+    backtest_lanes,
+    run_position_engine_batch,
+)
+from lib.streaming_indicators import StreamingBollinger, StreamingSMA
+from lib.technical_indicators import (
+    bollinger_bands,
+    calc_ma_matrix,
+    calc_std_matrix,
+    price_fingerprint,
+    rolling_mean,
+    rolling_mean_panel,
+    rolling_std_panel,
+)
+
+
+def _build_signals(open_, high, low, close, bb_upper, bb_lower, ma_long):
+    """
+    將策略四的進出場規則整理成狀態機所需的陣列（狀態機需以 exit_first=True 執行）。
 
-def backtest_strategy_four(df, bb_period=5, bb_std=2, ma_long_period=10):
+    價格可為 (交易日,) 陣列；批次模式下價格為 (交易日, 1)，
+    布林通道與均線為 (交易日, N)，結果自動展開成 N 組參數。
+    """
+    # 多單出場：停損（開盤與收盤價皆低於下軌）於收盤價出場，否則停利（觸及上軌）於上軌出場
+    long_stop = (open_ < bb_lower) & (close < bb_lower)
+    long_take = high >= bb_upper
+    long_exit_price = np.where(long_stop, close, np.where(long_take, bb_upper, 0.0))
+    # 空單出場：停損（開盤與收盤價皆高於上軌）於收盤價出場，否則停利（觸及下軌）於下軌出場
+    short_stop = (open_ > bb_upper) & (close > bb_upper)
+    short_take = low <= bb_lower
+    short_exit_price = np.where(short_stop, close, np.where(short_take, bb_lower, 0.0))
+
+    # 趨勢過濾條件
+    is_uptrend = close > ma_long
+    is_downtrend = close < ma_long
+    # 做多信號: 上升趨勢中的回檔；做空信號: 下降趨勢中的反彈
+    long_entry = is_uptrend & (low <= bb_lower)
+    short_entry = is_downtrend & (high >= bb_upper)
+
+    return {
+        "long_entry": long_entry,
+        "long_entry_price": bb_lower,
+        "long_exit": long_exit_price > 0,
+        "long_exit_price": long_exit_price,
+        "short_entry": short_entry,
+        "short_entry_price": bb_upper,
+        "short_exit": short_exit_price > 0,
+        "short_exit_price": short_exit_price,
+        "exit_first": True,
+    }
+
+
+def backtest_strategy_four(
+    df, bb_period=5, bb_std=2, ma_long_period=10, return_trades=False, costs=None, sizing=None
+):
     """
     執行策略四（含趨勢過濾）的回測。
 
@@ -20,102 +79,176 @@ def backtest_strategy_four(df, bb_period=5, bb_std=2, ma_long_period=10):
         bb_period (int): 計算布林通道的週期。
         bb_std (int): 計算布林通道時使用的標準差倍數。
         ma_long_period (int): 用於判斷長期趨勢的移動平均線週期。
+        return_trades (bool): 是否另外回傳交易明細（engine.TRADE_DTYPE 結構陣列）。
+        costs (CostModel, optional): 交易成本模型（見 lib.backtest.costs），提供時 ret / cus 為扣除成本後的結果，
+            並另加逐日的 cost 欄。
+        sizing (PositionSizer, optional): 部位規模規則（見 lib.backtest.sizing）；提供時為資金模式，
+            ret / cus 以金額計，另加 units / equity / pct_ret 欄。預設為每次 1 單位的點數模式。
 
     Returns:
         pd.DataFrame: 附帶回測結果的 DataFrame。
+            return_trades=True 時回傳 (DataFrame, 交易明細)。
     """
-    # 複製一份 DataFrame 以免修改到原始傳入的資料
-    df = df.copy()
-
-    # --- 步驟一：計算所需技術指標 ---
-    df = calc_Bollinger(df, n=bb_period, k=bb_std).copy()
-
-    # 加入 BB_MA 欄位（布林中線 = MA(bb_period)）
-    bb_ma_col = f"BB_MA{bb_period}"
-    df[bb_ma_col] = df["收盤價"].rolling(bb_period).mean()
-
+    # --- 步驟一：計算所需技術指標（回傳獨立陣列，不修改傳入的 df）---
+    close_s = df["收盤價"]
+    fingerprint = price_fingerprint(close_s)
+    bb_ma, bb_sd, bb_upper, bb_lower = bollinger_bands(
+        close_s, n=bb_period, k=bb_std, fingerprint=fingerprint
+    )
     # 計算長期趨勢線
-    ma_long_col = f'MA{ma_long_period}'
-    df[ma_long_col] = df['收盤價'].rolling(ma_long_period).mean()
+    ma_long = rolling_mean(close_s, ma_long_period, fingerprint)
+    indicators = {
+        "BB_MA": bb_ma,
+        "BB_STD": bb_sd,
+        "BB_Upper": bb_upper,
+        "BB_Lower": bb_lower,
+        # 加入 BB_MA 欄位（布林中線 = MA(bb_period)）
+        f"BB_MA{bb_period}": bb_ma,
+        f'MA{ma_long_period}': ma_long,
+    }
 
     L = len(df)
     if L < ma_long_period: # 確保有足夠資料計算長期均線
-        return df
-
-    # --- 步驟二：初始化回測所需的欄位與變數 ---
-    df["ret"] = 0.0
-    df["cus"] = 0.0
-    df["position"] = 0  # 記錄每日的持倉狀態 (0: 空手, 1: 持有多單, -1: 持有空單)
-
-    position = 0
-    avg_cost = 0.0
-    cum_ret = 0.0
-
-    # --- 步驟三：遍歷所有交易日，執行回測邏輯 ---
-    for i in range(L):
-        idx = df.index[i]
-        row = df.iloc[i]
-
-        # --- 出場邏輯 (優先處理) ---
-        if position != 0:
-            exit_price = 0
-            ret = 0
-
-            # 持有多單時的出場條件
-            if position == 1:
-                # 停損: 開盤與收盤價皆低於下軌
-                if row["開盤價"] < row["BB_Lower"] and row["收盤價"] < row["BB_Lower"]:
-                    exit_price = row["收盤價"]
-                    ret = exit_price - avg_cost
-                # 停利: 價格觸及上軌
-                elif row["最高價"] >= row["BB_Upper"]:
-                    exit_price = row["BB_Upper"]
-                    ret = exit_price - avg_cost
-
-            # 持有空單時的出場條件
-            elif position == -1:
-                # 停損: 開盤與收盤價皆高於上軌
-                if row["開盤價"] > row["BB_Upper"] and row["收盤價"] > row["BB_Upper"]:
-                    exit_price = row["收盤價"]
-                    ret = avg_cost - exit_price
-                # 停利: 價格觸及下軌
-                elif row["最低價"] <= row["BB_Lower"]:
-                    exit_price = row["BB_Lower"]
-                    ret = avg_cost - exit_price
-
-            # 如果觸發了出場條件
-            if exit_price > 0:
-                df.at[idx, "ret"] = ret
-                cum_ret += ret
-                position = 0
-                avg_cost = 0.0
-
-        # --- 進場邏輯 (當日無持倉且未觸發出場時才檢查) ---
-        if position == 0:
-            # 趨勢過濾條件
-            is_uptrend = row['收盤價'] > row[ma_long_col]
-            is_downtrend = row['收盤價'] < row[ma_long_col]
-
-            # 做多信號: 上升趨勢中的回檔
-            if is_uptrend and row["最低價"] <= row["BB_Lower"]:
-                avg_cost = row["BB_Lower"]
-                position = 1
-            # 做空信號: 下降趨勢中的反彈
-            elif is_downtrend and row["最高價"] >= row["BB_Upper"]:
-                avg_cost = row["BB_Upper"]
-                position = -1
-
-        # --- 每日結算與記錄 ---
-        if position == 1:
-            df.at[idx, "cus"] = cum_ret + (row["收盤價"] - avg_cost)
-        elif position == -1:
-            df.at[idx, "cus"] = cum_ret + (avg_cost - row["收盤價"])
-        else:
-            df.at[idx, "cus"] = cum_ret
+        result = attach_results(df, indicators)
+        return (result, np.empty(0, dtype=TRADE_DTYPE)) if return_trades else result
+
+    # --- 步驟二：取出回測所需的價格陣列 ---
+    open_ = df["開盤價"].to_numpy(dtype=float)
+    high = df["最高價"].to_numpy(dtype=float)
+    low = df["最低價"].to_numpy(dtype=float)
+    close = close_s.to_numpy(dtype=float)
+
+    # --- 步驟三：整理進出場條件 ---
+    signals = _build_signals(open_, high, low, close, bb_upper, bb_lower, ma_long)
+
+    # --- 步驟四：執行持倉狀態機（出場優先），並一次建立結果 DataFrame ---
+    return backtest_frame(df, indicators, close, signals, return_trades, costs, sizing)
+
+
+def backtest_strategy_four_batch(
+    df,
+    bb_period,
+    bb_std,
+    ma_long_period,
+    start=0,
+    stop=None,
+    return_trades=False,
+    costs=None,
+    sizing=None,
+    return_costs=False,
+):
+    """
+    以批次模式同時回測 N 組策略四參數。
+
+    Args:
+        df (pd.DataFrame): 包含開、高、低、收價格的時間序列資料（不會被修改）。
+        bb_period (array-like): N 組布林通道週期。
+        bb_std (array-like): N 組布林通道標準差倍數。
+        ma_long_period (array-like): N 組長期趨勢均線週期。
+        start, stop (int): 只在第 start ~ stop-1 根 K 棒之間交易（狀態機由空手開始）。
+            指標仍以完整的 df 計算，start 之前的資料作為暖機，並可在多個區間之間共用快取。
+        return_trades (bool): 是否另外回傳所有參數組的交易明細（K 棒位置以完整 df 計）。
+        costs (CostModel, optional): 所有參數組共用的交易成本模型。
+        sizing (PositionSizer, optional): 所有參數組共用的部位規模規則；提供時 ret / cus 以金額計。
+        return_costs (bool): 是否在最後另外回傳每個參數組的交易成本總額（參數掃描使用）。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，形狀皆為 (交易日, N)，
+            第 j 欄與 backtest_strategy_four 使用第 j 組參數的結果逐位元相同。
+            return_trades=True 時再加上交易明細，lane 欄位即參數組編號 j；
+            return_costs=True 時最後再加上 (N,) 的交易成本總額（未設定成本模型時為 None）。
+    """
+    bb_period = np.asarray(bb_period, dtype=int)
+    bb_std = np.asarray(bb_std, dtype=float)
+
+    # --- 步驟一：計算 (交易日 × N) 的指標矩陣 ---
+    fingerprint = price_fingerprint(df["收盤價"])
+    bb_ma = calc_ma_matrix(df, bb_period, fingerprint)
+    bb_sd = calc_std_matrix(df, bb_period, fingerprint)
+    bb_upper = bb_ma + bb_std * bb_sd
+    bb_lower = bb_ma - bb_std * bb_sd
+    ma_long = calc_ma_matrix(df, ma_long_period, fingerprint)
+
+    # --- 步驟二：取出共用的價格陣列（欄向量，讓所有參數組共用）---
+    open_ = df["開盤價"].to_numpy(dtype=float)[:, None]
+    high = df["最高價"].to_numpy(dtype=float)[:, None]
+    low = df["最低價"].to_numpy(dtype=float)[:, None]
+    close = df["收盤價"].to_numpy(dtype=float)[:, None]
+
+    # --- 步驟三：整理進出場條件並執行批次狀態機（出場優先）---
+    signals = _build_signals(open_, high, low, close, bb_upper, bb_lower, ma_long)
+    return backtest_lanes(
+        close, signals, start, stop, return_trades, costs, sizing, return_costs
+    )
+
+
+def backtest_strategy_four_panel(
+    open_, high, low, close, bb_period=5, bb_std=2, ma_long_period=10, costs=None
+):
+    """
+    以同一組參數同時回測多檔股票（投資組合回測使用）。
+
+    Args:
+        open_, high, low, close (np.ndarray): (交易日 × 代號) 的價格矩陣，未上市的日子為 NaN。
+        其餘參數同 backtest_strategy_four。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，形狀皆為 (交易日, 代號)。
+    """
+    bb_ma = rolling_mean_panel(close, bb_period)
+    bb_sd = rolling_std_panel(close, bb_period)
+    ma_long = rolling_mean_panel(close, ma_long_period)
+    signals = _build_signals(
+        open_, high, low, close, bb_ma + bb_std * bb_sd, bb_ma - bb_std * bb_sd, ma_long
+    )
+    return run_position_engine_batch(close, **signals, costs=costs)
+
+
+class StreamingStrategyFour(StreamingStrategy):
+    """
+    策略四的逐筆版本：每呼叫一次 update 處理一根 K 棒，進出場規則與 backtest_strategy_four 相同
+    （出場優先）。
 
-        df.at[idx, "position"] = position
+    Args:
+        bb_period, bb_std, ma_long_period: 同 backtest_strategy_four。
+    """
+
+    __slots__ = ("bb", "ma_long", "state")
+
+    def __init__(self, bb_period=5, bb_std=2, ma_long_period=10):
+        self.bb = StreamingBollinger(bb_period, bb_std)
+        self.ma_long = StreamingSMA(ma_long_period)
+        self.state = PositionState(exit_first=True)
 
-    # --- 步驟四：計算買入並持有策略的報酬作為比較基準 ---
-    df["BH"] = df["收盤價"] - df["收盤價"].iloc[0]
+    def update(self, open_, high, low, close):
+        """
+        處理一根 K 棒。
 
-    return df
+        Returns:
+            tuple[float, float, int]: 當日的 (ret, cus, position)。
+        """
+        _, _, bb_upper, bb_lower = self.bb.update(close)
+        ma_long = self.ma_long.update(close)
+
+        # 多單出場：停損於收盤價出場，否則停利（觸及上軌）於上軌出場
+        if open_ < bb_lower and close < bb_lower:
+            long_exit_price = close
+        elif high >= bb_upper:
+            long_exit_price = bb_upper
+        else:
+            long_exit_price = 0.0
+        # 空單出場：停損於收盤價出場，否則停利（觸及下軌）於下軌出場
+        if open_ > bb_upper and close > bb_upper:
+            short_exit_price = close
+        elif low <= bb_lower:
+            short_exit_price = bb_lower
+        else:
+            short_exit_price = 0.0
+
+        return self.state.step(
+            close,
+            close > ma_long and low <= bb_lower, bb_lower,
+            long_exit_price > 0, long_exit_price,
+            close < ma_long and high >= bb_upper, bb_upper,
+            short_exit_price > 0, short_exit_price,
+        )
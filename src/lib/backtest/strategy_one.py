@@ -4,9 +4,64 @@
 # 2. 第二階段（T+1日開盤）：隔天開盤時，若股價沒有大幅低開（由 drop_threshold 控制），則以開盤價進場。
 # 出場條件：當持倉時，若收盤價回落到布林通道上軌以下，則於收盤價出場。
 
-from lib.technical_indicators import calc_Bollinger, calc_MA5, calc_prev_gain
+import numpy as np
+
+from lib.backtest.engine import (
+    TRADE_DTYPE,
+    PositionState,
+    StreamingStrategy,
+    attach_results,
+    backtest_frame,
+    backtest_lanes,
+    run_position_engine_batch,
+)
+from lib.streaming_indicators import StreamingBollinger, StreamingPrevGain
+from lib.technical_indicators import (
+    bollinger_bands,
+    calc_ma_matrix,
+    calc_std_matrix,
+    previous_gain,
+    price_fingerprint,
+    rolling_mean,
+    rolling_mean_panel,
+    rolling_std_panel,
+)
+
+
+def _build_signals(open_, close, bb_upper, prev_gain, drop_threshold):
+    """
+    將策略一的進出場規則整理成狀態機所需的陣列。
 
-def backtest_strategy(df, ma_period=5, bb_period=20, bb_std=2, drop_threshold=0.5):
+    價格可為 (交易日,) 陣列；批次模式下價格為 (交易日, 1)，
+    bb_upper 為 (交易日, N)、drop_threshold 為 (N,)，結果自動展開成 N 組參數。
+    """
+    # T日收盤觸發第一階段信號：收盤價突破布林通道上軌（僅空手時有效，由狀態機保證）
+    triggered = close > bb_upper
+    # T+1日開盤進場：前一日已觸發，且今天開盤沒有大幅低開
+    entry = np.zeros(triggered.shape, dtype=bool)
+    entry[1:] = triggered[:-1] & (
+        open_[1:] >= close[:-1] - prev_gain[:-1] * drop_threshold
+    )
+    # 當日收盤出場：持倉時收盤價回落至布林通道上軌之下
+    exit_ = close < bb_upper
+    return {
+        "long_entry": entry,
+        "long_entry_price": open_,
+        "long_exit": exit_,
+        "long_exit_price": close,
+    }
+
+
+def backtest_strategy(
+    df,
+    ma_period=5,
+    bb_period=20,
+    bb_std=2,
+    drop_threshold=0.5,
+    return_trades=False,
+    costs=None,
+    sizing=None,
+):
     """
     執行策略一的回測。
 
@@ -18,91 +73,162 @@ def backtest_strategy(df, ma_period=5, bb_period=20, bb_std=2, drop_threshold=0.
         drop_threshold (float): 隔日開盤價的跌幅容忍閾值。
                                 用於判斷前一日觸發信號後，隔天開盤是否因跌幅過大而放棄進場。
                                 例如 0.5 表示開盤價 > (前日收盤價 - 前日漲幅 * 0.5)。
+        return_trades (bool): 是否另外回傳交易明細（engine.TRADE_DTYPE 結構陣列）。
+        costs (CostModel, optional): 交易成本模型（見 lib.backtest.costs），提供時 ret / cus 為扣除成本後的結果，
+            並另加逐日的 cost 欄。
+        sizing (PositionSizer, optional): 部位規模規則（見 lib.backtest.sizing）；提供時為資金模式，
+            ret / cus 以金額計，另加 units / equity / pct_ret 欄。預設為每次 1 單位的點數模式。
 
     Returns:
         pd.DataFrame: 附帶回測結果（如每日報酬、持倉狀態、累計報酬等）的 DataFrame。
+            return_trades=True 時回傳 (DataFrame, 交易明細)。
     """
-    # 複製一份 DataFrame 以免修改到原始傳入的資料
-    df = df.copy()
-
-    # --- 步驟一：計算所需技術指標 ---
-    # 雖然 MA5 在此策略邏輯中未使用，但保留以便未來擴展或分析
-    df = calc_MA5(df, period=ma_period).copy()
+    # --- 步驟一：計算所需技術指標（回傳獨立陣列，不修改傳入的 df）---
+    close_s = df["收盤價"]
+    # 價格指紋只計算一次，所有指標共用（作為指標快取的鍵）
+    fingerprint = price_fingerprint(close_s)
     # 計算布林通道，這是策略的核心指標
-    df = calc_Bollinger(df, n=bb_period, k=bb_std).copy()
-    # 計算前一日的絕對漲跌幅，用於隔日開盤的濾網
-    df = calc_prev_gain(df).copy()
+    bb_ma, bb_sd, bb_upper, bb_lower = bollinger_bands(
+        close_s, n=bb_period, k=bb_std, fingerprint=fingerprint
+    )
+    indicators = {
+        # 雖然 MA5 在此策略邏輯中未使用，但保留以便未來擴展或分析
+        "MA5": rolling_mean(close_s, ma_period, fingerprint),
+        "BB_MA": bb_ma,
+        "BB_STD": bb_sd,
+        "BB_Upper": bb_upper,
+        "BB_Lower": bb_lower,
+        # 計算前一日的絕對漲跌幅，用於隔日開盤的濾網
+        "prev_gain": previous_gain(close_s),
+    }
 
     L = len(df)
     if L < 2:  # 至少需要兩天資料才能執行進出場邏輯
-        return df
-
-    # --- 步驟二：初始化回測所需的欄位與變數 ---
-    df["ret"] = 0.0       # 記錄每筆已實現交易的報酬
-    df["cus"] = 0.0       # 記錄每日的累計報酬（包含未實現的浮動盈虧）
-    df["position"] = 0    # 記錄每日的持倉狀態 (0: 空手, 1: 持有多單)
-
-    position = 0          # 當前的持倉狀態
-    avg_cost = 0.0        # 持倉的平均成本
-    cum_ret = 0.0         # 已實現的累計報酬
-
-    # 策略狀態變數
-    yesterday_triggered_bb = False  # 標記前一天收盤是否已觸發布林通道突破信號
-    prev_close = 0.0                # 觸發信號當天的收盤價
-    prev_gain = 0.0                 # 觸發信號當天的漲跌幅
-
-    # --- 步驟三：遍歷所有交易日，執行回測邏輯 ---
-    for i in range(L):
-        idx = df.index[i]
-        row = df.iloc[i]
-
-        # --- T+1日開盤進場邏輯 ---
-        # 如果前一天觸發了BB突破信號，並且當前是空手狀態
-        if yesterday_triggered_bb and position == 0:
-            # 檢查今天的開盤價是否滿足第二階段的濾網條件（沒有大幅低開）
-            if row["開盤價"] >= prev_close - prev_gain * drop_threshold:
-                # 條件滿足，使用今天的開盤價進場
-                avg_cost = row["開盤價"]
-                position = 1
-
-            # 無論是否進場，這個信號在今天處理完畢後都應重置
-            yesterday_triggered_bb = False
-
-        # --- 當日收盤出場邏輯 ---
-        # 如果當前持有多單，並且當日收盤價已回落至布林通道上軌之下
-        if position == 1 and row["收盤價"] < row["BB_Upper"]:
-            exit_price = row["收盤價"]
-            ret = exit_price - avg_cost  # 計算這筆交易的報酬
-            df.at[idx, "ret"] = ret      # 記錄報酬
-            cum_ret += ret               # 累加到已實現報酬中
-
-            # 平倉，重置持倉狀態
-            position = 0
-            avg_cost = 0.0
-
-        # --- 每日結算與記錄 ---
-        # 計算每日的浮動盈虧
-        if position == 1:
-            # 若仍持倉，總權益 = 已實現報酬 + (當前價格 - 持倉成本)
-            df.at[idx, "cus"] = cum_ret + (row["收盤價"] - avg_cost)
-        else:
-            # 若空手，總權益 = 已實現報酬
-            df.at[idx, "cus"] = cum_ret
-
-        # 記錄當日結束時的持倉狀態
-        df.at[idx, "position"] = position
-
-        # --- T日收盤進場信號觸發 ---
-        # 判斷今天收盤是否觸發第一階段的進場信號 (供明天使用)
-        if position == 0:  # 只有在目前沒有持倉時才考慮新的進場信號
-            if row["收盤價"] > row["BB_Upper"]:
-                # 觸發信號，設置標記為 True
-                yesterday_triggered_bb = True
-                # 記錄下今天的收盤價和漲跌幅，供明天開盤時判斷
-                prev_close = row["收盤價"]
-                prev_gain = row.get("prev_gain", 0.0)
-
-    # --- 步驟四：計算買入並持有策略的報酬作為比較基準 ---
-    df["BH"] = df["收盤價"] - df["收盤價"].iloc[0]
-
-    return df
+        result = attach_results(df, indicators)
+        return (result, np.empty(0, dtype=TRADE_DTYPE)) if return_trades else result
+
+    # --- 步驟二：取出回測所需的價格陣列 ---
+    open_ = df["開盤價"].to_numpy(dtype=float)
+    close = close_s.to_numpy(dtype=float)
+    prev_gain = indicators["prev_gain"]
+
+    # --- 步驟三：整理進出場條件 ---
+    signals = _build_signals(open_, close, bb_upper, prev_gain, drop_threshold)
+
+    # --- 步驟四：執行持倉狀態機，並一次建立結果 DataFrame ---
+    return backtest_frame(df, indicators, close, signals, return_trades, costs, sizing)
+
+
+def backtest_strategy_batch(
+    df,
+    ma_period,
+    bb_period,
+    bb_std,
+    drop_threshold,
+    start=0,
+    stop=None,
+    return_trades=False,
+    costs=None,
+    sizing=None,
+    return_costs=False,
+):
+    """
+    以批次模式同時回測 N 組策略一參數。
+
+    Args:
+        df (pd.DataFrame): 包含開、高、低、收價格的時間序列資料（不會被修改）。
+        ma_period (array-like): N 組移動平均週期（策略邏輯未使用，僅為與單次回測介面一致）。
+        bb_period (array-like): N 組布林通道週期。
+        bb_std (array-like): N 組布林通道標準差倍數。
+        drop_threshold (array-like): N 組隔日開盤跌幅容忍閾值。
+        start, stop (int): 只在第 start ~ stop-1 根 K 棒之間交易（狀態機由空手開始）。
+            指標仍以完整的 df 計算，start 之前的資料作為暖機，並可在多個區間之間共用快取。
+        return_trades (bool): 是否另外回傳所有參數組的交易明細（K 棒位置以完整 df 計）。
+        costs (CostModel, optional): 所有參數組共用的交易成本模型。
+        sizing (PositionSizer, optional): 所有參數組共用的部位規模規則；提供時 ret / cus 以金額計。
+        return_costs (bool): 是否在最後另外回傳每個參數組的交易成本總額（參數掃描使用）。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，形狀皆為 (交易日, N)，
+            第 j 欄與 backtest_strategy 使用第 j 組參數的結果逐位元相同。
+            return_trades=True 時再加上交易明細，lane 欄位即參數組編號 j；
+            return_costs=True 時最後再加上 (N,) 的交易成本總額（未設定成本模型時為 None）。
+    """
+    bb_period = np.asarray(bb_period, dtype=int)
+    bb_std = np.asarray(bb_std, dtype=float)
+    drop_threshold = np.asarray(drop_threshold, dtype=float)
+
+    # --- 步驟一：計算 (交易日 × N) 的指標矩陣 ---
+    fingerprint = price_fingerprint(df["收盤價"])
+    bb_upper = (
+        calc_ma_matrix(df, bb_period, fingerprint)
+        + bb_std * calc_std_matrix(df, bb_period, fingerprint)
+    )
+
+    # --- 步驟二：取出共用的價格陣列（欄向量，讓所有參數組共用）---
+    open_ = df["開盤價"].to_numpy(dtype=float)[:, None]
+    close = df["收盤價"].to_numpy(dtype=float)[:, None]
+    prev_gain = previous_gain(df["收盤價"])[:, None]
+
+    # --- 步驟三：整理進出場條件並執行批次狀態機 ---
+    signals = _build_signals(open_, close, bb_upper, prev_gain, drop_threshold)
+    return backtest_lanes(
+        close, signals, start, stop, return_trades, costs, sizing, return_costs
+    )
+
+
+def backtest_strategy_panel(
+    open_, high, low, close, ma_period=5, bb_period=20, bb_std=2, drop_threshold=0.5, costs=None
+):
+    """
+    以同一組參數同時回測多檔股票（投資組合回測使用）。
+
+    Args:
+        open_, high, low, close (np.ndarray): (交易日 × 代號) 的價格矩陣，未上市的日子為 NaN。
+        其餘參數同 backtest_strategy（ma_period 不影響訊號）。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，形狀皆為 (交易日, 代號)，
+            每一欄與該檔股票單獨執行 backtest_strategy 的結果逐位元相同。
+    """
+    bb_upper = rolling_mean_panel(close, bb_period) + bb_std * rolling_std_panel(close, bb_period)
+    signals = _build_signals(open_, close, bb_upper, previous_gain(close), drop_threshold)
+    return run_position_engine_batch(close, **signals, costs=costs)
+
+
+class StreamingStrategyOne(StreamingStrategy):
+    """
+    策略一的逐筆版本：每呼叫一次 update 處理一根 K 棒，進出場規則與 backtest_strategy 相同。
+    （MA5 只是附帶輸出的指標，不影響訊號，這裡不計算。）
+
+    Args:
+        bb_period, bb_std, drop_threshold: 同 backtest_strategy。
+    """
+
+    __slots__ = ("drop_threshold", "bb", "prev_gain", "triggered", "prev_close", "last_gain", "state")
+
+    def __init__(self, bb_period=20, bb_std=2, drop_threshold=0.5):
+        self.drop_threshold = drop_threshold
+        self.bb = StreamingBollinger(bb_period, bb_std)
+        self.prev_gain = StreamingPrevGain()
+        self.triggered = False       # 前一日收盤是否突破上軌
+        self.prev_close = float("nan")
+        self.last_gain = float("nan")
+        self.state = PositionState()
+
+    def update(self, open_, high, low, close):
+        """
+        處理一根 K 棒。
+
+        Returns:
+            tuple[float, float, int]: 當日的 (ret, cus, position)。
+        """
+        _, _, bb_upper, _ = self.bb.update(close)
+        gain = self.prev_gain.update(close)
+        # T+1日開盤進場：前一日已觸發，且今天開盤沒有大幅低開
+        entry = self.triggered and open_ >= self.prev_close - self.last_gain * self.drop_threshold
+        result = self.state.step(close, entry, open_, close < bb_upper, close)
+        # 記錄今日收盤的觸發狀態，供明日開盤判斷
+        self.triggered = close > bb_upper
+        self.prev_close, self.last_gain = close, gain
+        return result
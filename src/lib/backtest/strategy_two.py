@@ -5,9 +5,51 @@
 # 出場條件：
 #   - 當日持倉時，若當日的（開盤價+收盤價）/ 2 < 當日的短期均線，則於當日收盤價出場。
 
-from lib.technical_indicators import calc_ma
+import numpy as np
 
-def backtest_strategy_two(df, short_ma_period=5, long_ma_period=20):
+from lib.backtest.engine import (
+    TRADE_DTYPE,
+    PositionState,
+    StreamingStrategy,
+    attach_results,
+    backtest_frame,
+    backtest_lanes,
+    run_position_engine_batch,
+)
+from lib.streaming_indicators import StreamingSMA
+from lib.technical_indicators import (
+    calc_ma_matrix,
+    price_fingerprint,
+    rolling_mean,
+    rolling_mean_panel,
+)
+
+
+def _build_signals(open_, close, short_ma, long_ma):
+    """
+    將策略二的進出場規則整理成狀態機所需的陣列。
+
+    價格可為 (交易日,) 陣列；批次模式下價格為 (交易日, 1)，
+    均線為 (交易日, N)，結果自動展開成 N 組參數。
+    """
+    # 進場 (使用 T-1 日的信號，在 T 日開盤進場)：
+    # T-2日短期均線仍在長期均線之下，T-1日短期均線已穿越到長期均線之上
+    entry = np.zeros(np.broadcast_shapes(short_ma.shape, long_ma.shape), dtype=bool)
+    entry[2:] = (short_ma[:-2] < long_ma[:-2]) & (short_ma[1:-1] > long_ma[1:-1])
+    # 出場 (T日收盤)：當日中間價跌破短期均線，視為趨勢轉弱信號
+    mid_price = (open_ + close) / 2
+    exit_ = mid_price < short_ma
+    return {
+        "long_entry": entry,
+        "long_entry_price": open_,
+        "long_exit": exit_,
+        "long_exit_price": close,
+    }
+
+
+def backtest_strategy_two(
+    df, short_ma_period=5, long_ma_period=20, return_trades=False, costs=None, sizing=None
+):
     """
     執行策略二（雙移動平均線黃金交叉）的回測。
 
@@ -15,85 +57,136 @@ def backtest_strategy_two(df, short_ma_period=5, long_ma_period=20):
         df (pd.DataFrame): 包含開、高、低、收價格的時間序列資料。
         short_ma_period (int): 短期移動平均線的週期。
         long_ma_period (int): 長期移動平均線的週期。
+        return_trades (bool): 是否另外回傳交易明細（engine.TRADE_DTYPE 結構陣列）。
+        costs (CostModel, optional): 交易成本模型（見 lib.backtest.costs），提供時 ret / cus 為扣除成本後的結果，
+            並另加逐日的 cost 欄。
+        sizing (PositionSizer, optional): 部位規模規則（見 lib.backtest.sizing）；提供時為資金模式，
+            ret / cus 以金額計，另加 units / equity / pct_ret 欄。預設為每次 1 單位的點數模式。
 
     Returns:
         pd.DataFrame: 附帶回測結果（如每日報酬、持倉狀態、累計報酬等）的 DataFrame。
+            return_trades=True 時回傳 (DataFrame, 交易明細)。
     """
-    # 複製一份 DataFrame 以免修改到原始傳入的資料
-    df = df.copy()
-
-    # --- 步驟一：計算所需技術指標 ---
+    # --- 步驟一：計算所需技術指標（回傳獨立陣列，不修改傳入的 df）---
     # 計算短期和長期移動平均線
-    df = calc_ma(df, period=short_ma_period)
-    df = calc_ma(df, period=long_ma_period)
-
-    # 為了方便引用，將指標欄位名稱存成變數
-    short_ma_col = f'MA{short_ma_period}'
-    long_ma_col = f'MA{long_ma_period}'
+    close_s = df["收盤價"]
+    fingerprint = price_fingerprint(close_s)
+    short_ma = rolling_mean(close_s, short_ma_period, fingerprint)
+    long_ma = rolling_mean(close_s, long_ma_period, fingerprint)
+    indicators = {f'MA{short_ma_period}': short_ma, f'MA{long_ma_period}': long_ma}
 
     L = len(df)
     if L < 2: # 至少需要兩天資料
-        return df
-
-    # --- 步驟二：初始化回測所需的欄位與變數 ---
-    df["ret"] = 0.0       # 記錄每筆已實現交易的報酬
-    df["cus"] = 0.0       # 記錄每日的累計報酬（包含未實現的浮動盈虧）
-    df["position"] = 0    # 記錄每日的持倉狀態 (0: 空手, 1: 持有多單)
-
-    position = 0          # 當前的持倉狀態
-    avg_cost = 0.0        # 持倉的平均成本
-    cum_ret = 0.0         # 已實現的累計報酬
-
-    # --- 步驟三：遍歷所有交易日，執行回測邏輯 ---
-    # 從索引 1 開始循環，因為需要前一天(i-1)的數據來判斷交叉
-    for i in range(1, L):
-        idx = df.index[i]
-        prev_row = df.iloc[i-1] # 前一日(T-1)的數據
-        row = df.iloc[i]        # 當日(T)的數據
-
-        # --- 進場邏輯 (使用 T-1 日的信號，在 T 日開盤進場) ---
-        # 條件：當前空手，且有足夠歷史數據來判斷交叉 (i > 1 是為了能取得 i-2 的數據)
-        if position == 0 and i > 1:
-            prev_prev_row = df.iloc[i-2] # 前二日(T-2)的數據
-            
-            # 判斷 T-1 日是否發生黃金交叉
-            # 條件1: T-2日時，短期均線仍在長期均線之下
-            # 條件2: T-1日時，短期均線已穿越到長期均線之上
-            is_golden_cross = (prev_prev_row[short_ma_col] < prev_prev_row[long_ma_col] and 
-                               prev_row[short_ma_col] > prev_row[long_ma_col])
-            
-            if is_golden_cross:
-                # 信號成立，於今天(T日)開盤價進場
-                avg_cost = row["開盤價"]
-                position = 1
-        
-        # --- 出場邏輯 (T日盤中判斷，T日收盤出場) ---
-        if position == 1:
-            # 計算當日的中間價
-            mid_price = (row["開盤價"] + row["收盤價"]) / 2
-            # 如果中間價跌破了短期均線，視為趨勢轉弱信號
-            if mid_price < row[short_ma_col]:
-                exit_price = row["收盤價"]   # 於當日收盤價出場
-                ret = exit_price - avg_cost  # 計算報酬
-                df.at[idx, "ret"] = ret      # 記錄報酬
-                cum_ret += ret               # 累加到已實現報酬
-                
-                # 平倉，重置持倉狀態
-                position = 0
-                avg_cost = 0.0
-
-        # --- 每日結算與記錄 ---
-        if position == 1:
-            # 若仍持倉，總權益 = 已實現報酬 + (當前價格 - 持倉成本)
-            df.at[idx, "cus"] = cum_ret + (row["收盤價"] - avg_cost)
-        else:
-            # 若空手，總權益 = 已實現報酬
-            df.at[idx, "cus"] = cum_ret
-
-        # 記錄當日結束時的持倉狀態
-        df.at[idx, "position"] = position
-
-    # --- 步驟四：計算買入並持有策略的報酬作為比較基準 ---
-    df["BH"] = df["收盤價"] - df["收盤價"].iloc[0]
-
-    return df
+        result = attach_results(df, indicators)
+        return (result, np.empty(0, dtype=TRADE_DTYPE)) if return_trades else result
+
+    # --- 步驟二：取出回測所需的價格陣列 ---
+    open_ = df["開盤價"].to_numpy(dtype=float)
+    close = close_s.to_numpy(dtype=float)
+
+    # --- 步驟三：整理進出場條件 ---
+    signals = _build_signals(open_, close, short_ma, long_ma)
+
+    # --- 步驟四：執行持倉狀態機，並一次建立結果 DataFrame ---
+    return backtest_frame(df, indicators, close, signals, return_trades, costs, sizing)
+
+
+def backtest_strategy_two_batch(
+    df,
+    short_ma_period,
+    long_ma_period,
+    start=0,
+    stop=None,
+    return_trades=False,
+    costs=None,
+    sizing=None,
+    return_costs=False,
+):
+    """
+    以批次模式同時回測 N 組策略二參數。
+
+    Args:
+        df (pd.DataFrame): 包含開、高、低、收價格的時間序列資料（不會被修改）。
+        short_ma_period (array-like): N 組短期移動平均線週期。
+        long_ma_period (array-like): N 組長期移動平均線週期。
+        start, stop (int): 只在第 start ~ stop-1 根 K 棒之間交易（狀態機由空手開始）。
+            指標仍以完整的 df 計算，start 之前的資料作為暖機，並可在多個區間之間共用快取。
+        return_trades (bool): 是否另外回傳所有參數組的交易明細（K 棒位置以完整 df 計）。
+        costs (CostModel, optional): 所有參數組共用的交易成本模型。
+        sizing (PositionSizer, optional): 所有參數組共用的部位規模規則；提供時 ret / cus 以金額計。
+        return_costs (bool): 是否在最後另外回傳每個參數組的交易成本總額（參數掃描使用）。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，形狀皆為 (交易日, N)，
+            第 j 欄與 backtest_strategy_two 使用第 j 組參數的結果逐位元相同。
+            return_trades=True 時再加上交易明細，lane 欄位即參數組編號 j；
+            return_costs=True 時最後再加上 (N,) 的交易成本總額（未設定成本模型時為 None）。
+    """
+    # --- 步驟一：計算 (交易日 × N) 的均線矩陣 ---
+    fingerprint = price_fingerprint(df["收盤價"])
+    short_ma = calc_ma_matrix(df, short_ma_period, fingerprint)
+    long_ma = calc_ma_matrix(df, long_ma_period, fingerprint)
+
+    # --- 步驟二：取出共用的價格陣列（欄向量，讓所有參數組共用）---
+    open_ = df["開盤價"].to_numpy(dtype=float)[:, None]
+    close = df["收盤價"].to_numpy(dtype=float)[:, None]
+
+    # --- 步驟三：整理進出場條件並執行批次狀態機 ---
+    signals = _build_signals(open_, close, short_ma, long_ma)
+    return backtest_lanes(
+        close, signals, start, stop, return_trades, costs, sizing, return_costs
+    )
+
+
+def backtest_strategy_two_panel(
+    open_, high, low, close, short_ma_period=5, long_ma_period=20, costs=None
+):
+    """
+    以同一組參數同時回測多檔股票（投資組合回測使用）。
+
+    Args:
+        open_, high, low, close (np.ndarray): (交易日 × 代號) 的價格矩陣，未上市的日子為 NaN。
+        其餘參數同 backtest_strategy_two。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (ret, cus, position)，形狀皆為 (交易日, 代號)。
+    """
+    short_ma = rolling_mean_panel(close, short_ma_period)
+    long_ma = rolling_mean_panel(close, long_ma_period)
+    signals = _build_signals(open_, close, short_ma, long_ma)
+    return run_position_engine_batch(close, **signals, costs=costs)
+
+
+class StreamingStrategyTwo(StreamingStrategy):
+    """
+    策略二的逐筆版本：每呼叫一次 update 處理一根 K 棒，進出場規則與 backtest_strategy_two 相同。
+
+    Args:
+        short_ma_period, long_ma_period: 同 backtest_strategy_two。
+    """
+
+    __slots__ = ("short_ma", "long_ma", "prev", "prev2", "state")
+
+    def __init__(self, short_ma_period=5, long_ma_period=20):
+        self.short_ma = StreamingSMA(short_ma_period)
+        self.long_ma = StreamingSMA(long_ma_period)
+        nan = float("nan")
+        self.prev = (nan, nan)    # T-1 日的 (短期均線, 長期均線)
+        self.prev2 = (nan, nan)   # T-2 日的 (短期均線, 長期均線)
+        self.state = PositionState()
+
+    def update(self, open_, high, low, close):
+        """
+        處理一根 K 棒。
+
+        Returns:
+            tuple[float, float, int]: 當日的 (ret, cus, position)。
+        """
+        short_ma = self.short_ma.update(close)
+        long_ma = self.long_ma.update(close)
+        # T-2日短期均線在長期均線之下，T-1日已穿越到長期均線之上
+        entry = self.prev2[0] < self.prev2[1] and self.prev[0] > self.prev[1]
+        exit_ = (open_ + close) / 2 < short_ma
+        result = self.state.step(close, entry, open_, exit_, close)
+        self.prev2, self.prev = self.prev, (short_ma, long_ma)
+        return result
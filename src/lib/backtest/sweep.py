@@ -0,0 +1,660 @@
+# 參數掃描的執行核心
+# run_sweep 是所有敏感度分析共用的入口：給定回測函數、宣告式的參數空間與限制條件、抽樣器，
+# 先在主行程中抽出不重複的參數組，再交給回測函數執行並彙整績效，支援三種執行方式：
+#   1. 逐次回測（單一行程）
+#   2. 批次回測（batch_func，一次推進多組參數）
+#   3. 多行程平行（ProcessPoolExecutor），原始資料只透過共享記憶體傳給子行程一次，
+#      每個任務只需傳送參數組本身。
+# 參數組在主行程中先抽好，因此不論使用幾個子行程，結果都與單一行程完全相同。
+# 傳入 SweepStore（見 lib.backtest.sweep_store）時，結果邊執行邊寫入 SQLite，
+# 已回測過的參數組直接取用，中斷後重新執行即從斷點繼續。
+# 結果寫入預先配置的欄式緩衝區（見 lib.backtest.sweep_results），最後才轉成 DataFrame。
+
+import inspect
+import itertools
+import math
+import os
+import pickle
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+
+from lib.backtest.sweep_results import SweepResults
+from lib.backtest.sweep_store import frame_fingerprint, params_key, strategy_key
+from lib.performance_analysis import BATCH_PERFORMANCE
+from lib.technical_indicators import get_indicator_method, set_indicator_method
+
+
+def make_rng(seed, *key):
+    """
+    取得可重現的亂數產生器。
+
+    seed 為 None 時回傳全域的 random 模組（沿用 random.seed 的行為）；
+    否則以 SeedSequence(seed, spawn_key=key) 產生獨立的亂數流，
+    例如 make_rng(seed, i) 為第 i 次抽樣專用，結果與執行順序及子行程數量無關。
+    """
+    if seed is None:
+        return random
+    state = np.random.SeedSequence(seed, spawn_key=key).generate_state(2)
+    return random.Random(int(state[0]) << 32 | int(state[1]))
+
+
+# === 參數空間 ===
+
+def int_range(low, high):
+    """整數參數，範圍為 [low, high]（含兩端，同 random.randint）。"""
+    return {"kind": "int", "low": int(low), "high": int(high)}
+
+
+def float_range(low, high, digits=None, report_digits=None):
+    """
+    浮點數參數，於 [low, high] 均勻抽樣。
+    指定 digits 時先四捨五入再回測；指定 report_digits 時以原值回測，只在結果表中四捨五入。
+    """
+    return {
+        "kind": "float", "low": float(low), "high": float(high),
+        "digits": digits, "report_digits": report_digits,
+    }
+
+
+def categorical(*choices):
+    """類別參數，從 choices 中等機率抽樣。"""
+    return {"kind": "categorical", "choices": list(choices)}
+
+
+def normalize_space(param_space):
+    """
+    將參數空間的簡寫轉成完整定義。
+
+    簡寫規則（與原本 param_ranges 的寫法相容）：
+        - (int, int)：整數範圍，等同 int_range
+        - 含浮點數的 (low, high)：浮點數範圍，等同 float_range
+        - list：類別參數，等同 categorical
+    """
+    space = {}
+    for name, spec in param_space.items():
+        if isinstance(spec, dict):
+            space[name] = spec
+        elif isinstance(spec, list):
+            space[name] = categorical(*spec)
+        elif all(isinstance(v, (int, np.integer)) for v in spec):
+            space[name] = int_range(*spec)
+        else:
+            space[name] = float_range(*spec)
+    return space
+
+
+_COMPARATOR = re.compile(r"\s*(<=|<)\s*")
+
+
+def parse_constraint(expr):
+    """
+    解析形如 "ma_short < ma_medium < ma_long" 的限制條件。
+
+    Returns:
+        list[tuple[str, str, str]]: 兩兩比較的 (左參數, 運算子, 右參數)。
+    """
+    tokens = _COMPARATOR.split(expr.strip())
+    if len(tokens) < 3 or len(tokens) % 2 == 0:
+        raise ValueError(f"無法解析限制條件：{expr!r}")
+    return [(tokens[i], tokens[i + 1], tokens[i + 2]) for i in range(0, len(tokens) - 2, 2)]
+
+
+def _discrete_values(name, spec):
+    if spec["kind"] == "int":
+        return np.arange(spec["low"], spec["high"] + 1)
+    if spec["kind"] == "categorical":
+        return np.asarray(spec["choices"])
+    raise ValueError(f"限制條件只支援整數或類別參數：{name}")
+
+
+def _enumerate_group(names, space, pairs):
+    """列舉一組互相有限制條件的參數中所有可行組合，回傳 (參數名稱, 可行組合表)。"""
+    table = _discrete_values(names[0], space[names[0]])[:, None]
+    joined = [names[0]]
+    for name in names[1:]:
+        values = _discrete_values(name, space[name])
+        table = np.hstack(
+            [np.repeat(table, len(values), axis=0), np.tile(values, len(table))[:, None]]
+        )
+        joined.append(name)
+
+        # 每加入一個參數就先過濾，讓表格大小維持在可行組合的數量級
+        mask = np.ones(len(table), dtype=bool)
+        for a, op, b in pairs:
+            if name in (a, b) and a in joined and b in joined:
+                left, right = table[:, joined.index(a)], table[:, joined.index(b)]
+                mask &= (left < right) if op == "<" else (left <= right)
+        table = table[mask]
+
+    if len(table) == 0:
+        raise ValueError(f"參數範圍內沒有任何組合滿足限制條件：{', '.join(names)}")
+    return joined, table.tolist()
+
+
+def _discrete_factors(space, constraints):
+    """
+    將所有離散參數拆成互相獨立的因子：
+    有限制條件相連的參數合併成一個因子並列舉可行組合，其餘參數各自成為一個因子。
+
+    Returns:
+        list[tuple[list[str], int, function]]: (參數名稱, 組合數, 由索引取得組合的函數)。
+    """
+    pairs = [pair for expr in constraints for pair in parse_constraint(expr)]
+    for a, _, b in pairs:
+        for name in (a, b):
+            if name not in space:
+                raise ValueError(f"限制條件中的參數不存在：{name}")
+
+    # 以 union-find 將有限制條件相連的參數分成同一組
+    parent = {name: name for name in space}
+
+    def find(name):
+        while parent[name] != name:
+            name = parent[name]
+        return name
+
+    for a, _, b in pairs:
+        parent[find(a)] = find(b)
+
+    factors = []
+    grouped = set()
+    for name, spec in space.items():
+        if spec["kind"] == "float" or name in grouped:
+            continue
+        members = [n for n in space if find(n) == find(name)]
+        if len(members) > 1:
+            group_pairs = [p for p in pairs if p[0] in members]
+            names, rows = _enumerate_group(members, space, group_pairs)
+            factors.append((names, len(rows), rows.__getitem__))
+            grouped.update(members)
+        elif spec["kind"] == "int":
+            low = spec["low"]
+            factors.append(([name], spec["high"] - low + 1, lambda k, low=low: (low + k,)))
+        else:
+            choices = spec["choices"]
+            factors.append(([name], len(choices), lambda k, c=choices: (c[k],)))
+    return factors
+
+
+def random_sampler(param_space, constraints, iterations, seed=None):
+    """
+    隨機抽樣器：抽出最多 iterations 組互不重複且滿足限制條件的參數。
+
+    有限制條件的參數先列舉出所有可行組合再等機率抽樣，不使用反覆重抽的迴圈；
+    若參數全部為離散型，直接在所有組合的索引上做不放回抽樣，
+    因此不會重複回測同一組參數，且次數上限為組合總數。
+
+    Args:
+        param_space (dict): 參數空間，見 normalize_space。
+        constraints (list[str]): 限制條件，見 parse_constraint。
+        iterations (int): 抽樣次數。
+        seed (int, optional): 亂數種子，見 make_rng。
+
+    Returns:
+        list[dict]: 參數組，鍵的順序與 param_space 相同。
+    """
+    space = normalize_space(param_space)
+    factors = _discrete_factors(space, constraints)
+    floats = [name for name, spec in space.items() if spec["kind"] == "float"]
+
+    def assemble(indices, rng=None):
+        params = {}
+        for (names, _, get), k in zip(factors, indices):
+            params.update(zip(names, get(k)))
+        for name in floats:
+            spec = space[name]
+            value = rng.uniform(spec["low"], spec["high"])
+            params[name] = value if spec["digits"] is None else round(value, spec["digits"])
+        return {name: params[name] for name in space}
+
+    if not floats:
+        # 全部為離散參數：將組合編成混合進位的索引後做不放回抽樣
+        sizes = [size for _, size, _ in factors]
+        total = math.prod(sizes)
+        picks = make_rng(seed).sample(range(total), min(iterations, total))
+        samples = []
+        for flat in picks:
+            indices = []
+            for size in reversed(sizes):
+                flat, k = divmod(flat, size)
+                indices.append(k)
+            samples.append(assemble(reversed(indices)))
+        return samples
+
+    # 含浮點數參數：每次抽樣使用獨立亂數流，並略過（四捨五入後）重複的組合
+    samples = []
+    seen = set()
+    i = 0
+    while len(samples) < iterations and i < 10 * iterations:
+        rng = make_rng(seed, i)
+        i += 1
+        params = assemble([rng.randrange(size) for _, size, _ in factors], rng)
+        key = tuple(params.values())
+        if key not in seen:
+            seen.add(key)
+            samples.append(params)
+    return samples
+
+
+def grid_axes(param_space):
+    """網格的各個軸：整數參數為範圍內的所有整數、類別參數為 choices，鍵的順序與 param_space 相同。"""
+    space = normalize_space(param_space)
+    return {name: _discrete_values(name, spec) for name, spec in space.items()}
+
+
+def grid_sampler(param_space, constraints, iterations=None, seed=None):
+    """
+    網格抽樣器：列舉所有滿足限制條件的參數組合，不重複也不遺漏。
+    組合依參數空間的順序由小到大排列（類別參數依 choices 的順序）。
+
+    Args:
+        param_space (dict): 參數空間，見 normalize_space；只支援整數與類別參數。
+        constraints (list[str]): 限制條件，見 parse_constraint。
+        iterations, seed: 不使用，僅為了與 random_sampler 的簽名相同。
+
+    Returns:
+        list[dict]: 參數組，鍵的順序與 param_space 相同。
+    """
+    space = normalize_space(param_space)
+    floats = [name for name, spec in space.items() if spec["kind"] == "float"]
+    if floats:
+        raise ValueError(f"網格搜尋只支援整數或類別參數：{', '.join(floats)}")
+    factors = _discrete_factors(space, constraints)
+    samples = []
+    for indices in itertools.product(*(range(size) for _, size, _ in factors)):
+        params = {}
+        for (names, _, get), k in zip(factors, indices):
+            params.update(zip(names, get(k)))
+        samples.append({name: params[name] for name in space})
+    return samples
+
+
+# run_sweep 開始前列印的說明（依抽樣器而定；其他抽樣器只說明參數組數）
+_SAMPLER_LABELS = {random_sampler: "次隨機參數測試", grid_sampler: "組網格參數測試"}
+
+
+def run_sweep(
+    df_original,
+    backtest_func,
+    performance_func,
+    param_space,
+    constraints=(),
+    iterations=100,
+    sampler=random_sampler,
+    seed=None,
+    batch_func=None,
+    chunk_size=1024,
+    n_jobs=1,
+    executor=None,
+    store=None,
+    as_frame=True,
+):
+    """
+    通用的參數掃描（敏感度分析）。
+
+    Args:
+        df_original (pd.DataFrame): 原始資料。
+        backtest_func (function): 回測函數，接受 df 與參數。
+        performance_func (function): 計算績效函數，接受回測結果 df，返回 dict。
+        param_space (dict): 參數空間，例如
+            {'ma_short': (2, 10), 'bb_std': float_range(0.5, 3.0, digits=2), 'mode': ['a', 'b']}
+        constraints (list[str]): 限制條件，例如 ['ma_short < ma_medium < ma_long']。
+        iterations (int): 測試次數（去除重複後可能較少）。
+        sampler (function): 抽樣器，簽名同 random_sampler。
+        seed (int, optional): 亂數種子。
+        batch_func, chunk_size, n_jobs, executor, store, as_frame: 同 evaluate_param_sets。
+
+    Returns:
+        pd.DataFrame | SweepResults: 所有回測結果（參數欄位 + 績效指標）。
+    """
+    param_sets = sampler(param_space, list(constraints), iterations, seed)
+    label = _SAMPLER_LABELS.get(sampler, "組參數測試")
+    print(f"準備進行 {len(param_sets)} {label}...")
+    results = evaluate_param_sets(
+        df_original, backtest_func, performance_func, param_sets,
+        batch_func, chunk_size, n_jobs, executor, store, as_frame,
+    )
+    return _round_reported(results, normalize_space(param_space))
+
+
+def _round_reported(results, space):
+    """將指定 report_digits 的參數欄位四捨五入（只影響結果表，回測使用的是原值）。"""
+    for name, spec in space.items():
+        digits = spec.get("report_digits")
+        if digits is None:
+            continue
+        columns = results.params if isinstance(results, SweepResults) else results
+        columns[name] = np.array([round(value, digits) for value in columns[name].tolist()])
+    return results
+
+
+def _accepts(func, name):
+    """func（可為 functools.partial）是否接受名為 name 的參數。"""
+    try:
+        return name in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def run_param_sets(
+    df_original,
+    backtest_func,
+    performance_func,
+    param_sets,
+    batch_func=None,
+    chunk_size=1024,
+    progress=False,
+    out=None,
+    offset=0,
+):
+    """
+    在目前的行程中回測一批參數組，結果寫入欄式緩衝區（見 lib.backtest.sweep_results）。
+
+    Args:
+        df_original (pd.DataFrame): 原始資料。
+        backtest_func (function): 單次回測函數，接受 df 與參數。
+        performance_func (function): 計算績效函數，接受回測結果 df，返回 dict。
+        param_sets (list[dict]): 參數組。
+        batch_func (function, optional): 批次回測函數，接受 df 與每個參數的 N 組陣列，
+            回傳 (交易日 × N) 的 ret / cus / position。提供時改以批次模式執行；
+            接受 return_costs 時（例如 backtest_strategy*_batch）另外回報「交易成本」。
+        chunk_size (int): 批次模式下每次同時回測的參數組數。
+        progress (bool): 是否顯示進度條。
+        out (SweepResults, optional): 寫入的緩衝區；未提供時依 param_sets 另外配置。
+        offset (int): param_sets 的第一組在 out 中的列位置。
+
+    Returns:
+        SweepResults: 寫入結果的緩衝區（out 或新配置者），
+            param_sets 的結果依序位於第 offset 列起；需要 DataFrame 時呼叫 to_frame()。
+    """
+    if out is None:
+        out = SweepResults(param_sets)
+        offset = 0
+
+    if batch_func is None:
+        for i, params in enumerate(tqdm(param_sets, desc="執行進度", disable=not progress)):
+            # 回測並計算績效
+            df_result = backtest_func(df_original.copy(), **params)
+            out.write_row(offset + i, performance_func(df_result))
+        return out
+
+    # 有批次版績效函數時一次算完整批的績效並整欄寫入，否則每條 lane 各自計算一列
+    batch_performance = BATCH_PERFORMANCE.get(performance_func)
+    # 批次函數只回傳 ret / cus / position，沒有單次回測的 cost 欄；支援 return_costs 時另外取回
+    # 每個參數組的交易成本總額，補上與單次模式相同的「交易成本」
+    with_costs = batch_performance is not None and _accepts(batch_func, "return_costs")
+    starts = range(0, len(param_sets), chunk_size)
+    for start in tqdm(starts, desc="執行進度", disable=not progress):
+        chunk = param_sets[start:start + chunk_size]
+        rows = slice(offset + start, offset + start + len(chunk))
+
+        # 將這一批參數組整理成「參數名稱 → N 組數值」的陣列後一次回測
+        batch_params = {name: np.array([p[name] for p in chunk]) for name in chunk[0]}
+        cost = None
+        if with_costs:
+            ret, cus, position, cost = batch_func(df_original, **batch_params, return_costs=True)
+        else:
+            ret, cus, position = batch_func(df_original, **batch_params)
+
+        if batch_performance is not None:
+            out.write(rows, batch_performance(ret, cus, position))
+            if cost is not None:
+                out.write(rows, {"交易成本": cost})
+        else:
+            out.write_rows(rows, [
+                performance_func(pd.DataFrame(
+                    {"ret": ret[:, j], "cus": cus[:, j], "position": position[:, j]}
+                ))
+                for j in range(len(chunk))
+            ])
+
+    return out
+
+
+# === 共享記憶體：讓子行程零複製地讀取原始資料 ===
+
+def share_frame(df):
+    """
+    將 DataFrame 放進一塊共享記憶體。
+
+    數值欄位以原始 dtype 逐欄排列；其餘欄位（例如「年月日」字串）與 index
+    則序列化後放在同一塊記憶體的尾端。回傳的 spec 只有名稱與位移等中繼資料，
+    可以很便宜地隨每個任務傳給子行程。spec 另外記下目前的滾動指標計算方式，
+    子行程以 spawn 啟動時不會繼承主行程的 set_indicator_method，由 attach_frame 套用。
+
+    Returns:
+        tuple[SharedMemory, dict]: 共享記憶體物件（由呼叫端負責 close / unlink）與 spec。
+    """
+    numeric_cols = [c for c in df.columns if df[c].dtype.kind in "biuf"]
+    other = pickle.dumps(
+        {
+            "index": df.index,
+            "columns": list(df.columns),
+            "other": {c: df[c] for c in df.columns if c not in numeric_cols},
+        }
+    )
+
+    layout = []
+    offset = 0
+    for col in numeric_cols:
+        arr = df[col].to_numpy()
+        offset = -(-offset // arr.itemsize) * arr.itemsize  # 對齊
+        layout.append((col, arr.dtype.str, offset))
+        offset += arr.nbytes
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset + len(other), 1))
+    for (col, dtype, start) in layout:
+        view = np.ndarray(len(df), dtype=dtype, buffer=shm.buf, offset=start)
+        view[:] = df[col].to_numpy()
+    shm.buf[offset:offset + len(other)] = other
+
+    spec = {
+        "name": shm.name,
+        "length": len(df),
+        "layout": layout,
+        "other_offset": offset,
+        "other_size": len(other),
+        "indicator_method": get_indicator_method(),
+    }
+    return shm, spec
+
+
+# 子行程中目前掛載的共享資料（只保留最近一份，避免長壽的 executor 累積記憶體）
+_attached = {"name": None, "shm": None, "df": None}
+
+
+def _open_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    # 由主行程負責 unlink；子行程掛載時暫停 resource_tracker 註冊，
+    # 避免子行程結束時把仍在使用中的共享記憶體當成洩漏而刪除
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def attach_frame(spec):
+    """
+    在子行程中依 spec 取得共享記憶體上的唯讀 DataFrame（同一份資料只掛載一次），
+    並套用主行程的滾動指標計算方式，結果才與主行程（及 SweepStore 的策略鍵）一致。
+    """
+    if get_indicator_method() != spec["indicator_method"]:
+        set_indicator_method(spec["indicator_method"])
+    if _attached["name"] == spec["name"]:
+        return _attached["df"]
+
+    if _attached["shm"] is not None:
+        _attached["df"] = None
+        try:
+            _attached["shm"].close()
+        except BufferError:
+            pass
+
+    shm = _open_shared_memory(spec["name"])
+    start = spec["other_offset"]
+    meta = pickle.loads(bytes(shm.buf[start:start + spec["other_size"]]))
+
+    data = dict(meta["other"])
+    for (col, dtype, offset) in spec["layout"]:
+        view = np.ndarray(spec["length"], dtype=dtype, buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        data[col] = pd.Series(view, index=meta["index"], copy=False)
+    df = pd.DataFrame(data, columns=meta["columns"], copy=False)
+
+    _attached.update(name=spec["name"], shm=shm, df=df)
+    return df
+
+
+def _run_shared(spec, backtest_func, performance_func, param_sets, batch_func, chunk_size):
+    """子行程的任務入口：掛載共享資料（並套用指標計算方式）後回測一批參數組。"""
+    df_original = attach_frame(spec)
+    return run_param_sets(
+        df_original, backtest_func, performance_func, param_sets, batch_func, chunk_size
+    )
+
+
+def evaluate_param_sets(
+    df_original,
+    backtest_func,
+    performance_func,
+    param_sets,
+    batch_func=None,
+    chunk_size=1024,
+    n_jobs=1,
+    executor=None,
+    store=None,
+    as_frame=True,
+):
+    """
+    回測所有參數組並彙整成結果表，可選擇在多個行程中平行執行。
+
+    Args:
+        df_original, backtest_func, performance_func, param_sets, batch_func, chunk_size:
+            同 run_param_sets。
+        n_jobs (int): 平行行程數；1 表示在目前行程執行，-1 表示使用所有 CPU 核心。
+        executor (concurrent.futures.Executor, optional): 自行提供的 executor
+            （例如長期共用的 ProcessPoolExecutor）。提供時忽略 n_jobs。
+        store (SweepStore, optional): 結果儲存。提供時略過 store 中已有結果的參數組，
+            其餘每完成 store.checkpoint 組（平行時每個任務）寫入一次。
+        as_frame (bool): 是否轉成 DataFrame；False 時回傳 SweepResults 欄式緩衝區，
+            大量參數組時可省下 DataFrame 的建立，需要時再呼叫 to_frame()。
+
+    Returns:
+        pd.DataFrame | SweepResults: 所有回測結果（參數欄位 + 績效指標），
+            列順序與 param_sets 相同，與 n_jobs 及 store 無關。
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if store is None:
+        results = _evaluate(
+            df_original, backtest_func, performance_func, param_sets,
+            batch_func, chunk_size, n_jobs, executor,
+        )
+        return results.to_frame() if as_frame else results
+
+    strategy = strategy_key(backtest_func, performance_func, batch_func)
+    dataset = frame_fingerprint(df_original)
+    stored = store.fetch(strategy, dataset, param_sets)
+    keys = [params_key(p) for p in param_sets]
+    pending_rows = [i for i, key in enumerate(keys) if key not in stored]
+    if stored:
+        print(f"已有 {len(param_sets) - len(pending_rows)} 組參數的結果，只回測其餘 {len(pending_rows)} 組")
+
+    def save(part, records):
+        store.save(strategy, dataset, part, records)
+
+    results = _evaluate(
+        df_original, backtest_func, performance_func, [param_sets[i] for i in pending_rows],
+        batch_func, chunk_size, n_jobs, executor, save, store.checkpoint,
+    )
+
+    # 依 param_sets 的順序合併既有結果與新結果
+    if stored:
+        computed = results
+        results = SweepResults(param_sets)
+        stored_rows = [i for i, key in enumerate(keys) if key in stored]
+        results.write_rows(stored_rows, [stored[keys[i]] for i in stored_rows])
+        results.assign(pending_rows, computed)
+    return results.to_frame() if as_frame else results
+
+
+def _evaluate(
+    df_original,
+    backtest_func,
+    performance_func,
+    param_sets,
+    batch_func,
+    chunk_size,
+    n_jobs,
+    executor,
+    save=None,
+    checkpoint=None,
+):
+    """
+    evaluate_param_sets 的執行部分，回傳與 param_sets 同順序的 SweepResults。
+    提供 save 時，每完成 checkpoint 組（批次模式至少 chunk_size 組；平行時每個任務）
+    即以 save(參數組, 績效指標的 list[dict]) 寫出。
+    """
+    if not param_sets or (executor is None and n_jobs == 1 and save is None):
+        return run_param_sets(
+            df_original, backtest_func, performance_func, param_sets,
+            batch_func, chunk_size, progress=True,
+        )
+
+    out = SweepResults(param_sets)
+    if executor is None and n_jobs == 1:
+        block = max(checkpoint, chunk_size) if batch_func is not None else checkpoint
+        for start in tqdm(range(0, len(param_sets), block), desc="執行進度"):
+            part = param_sets[start:start + block]
+            run_param_sets(
+                df_original, backtest_func, performance_func, part, batch_func, chunk_size,
+                out=out, offset=start,
+            )
+            save(part, out.metric_records(start, start + len(part)))
+        return out
+
+    # 每個子行程分到數個任務以平衡負載，但單一任務不超過 chunk_size 組參數
+    workers = n_jobs if executor is None else (os.cpu_count() or 1)
+    task_size = max(1, min(chunk_size, math.ceil(len(param_sets) / (workers * 4))))
+    starts = range(0, len(param_sets), task_size)
+    tasks = [param_sets[i:i + task_size] for i in starts]
+
+    shm, spec = share_frame(df_original)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        futures = [
+            executor.submit(
+                _run_shared, spec, backtest_func, performance_func,
+                task, batch_func, chunk_size,
+            )
+            for task in tasks
+        ]
+        # 子行程回傳的是欄式緩衝區（幾個 NumPy 陣列），傳回主行程的序列化成本遠低於 list-of-dicts
+        for start, task, future in tqdm(
+            zip(starts, tasks, futures), desc="執行進度", total=len(tasks)
+        ):
+            block = future.result()
+            out.assign(slice(start, start + len(task)), block)
+            if save is not None:
+                save(task, block.metric_records())
+    finally:
+        if own_executor:
+            executor.shutdown()
+        shm.close()
+        shm.unlink()
+
+    return out
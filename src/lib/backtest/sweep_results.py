@@ -0,0 +1,120 @@
+# 參數掃描結果的欄式緩衝區
+# 原本每組參數都建立一個「參數 + 績效指標」的 dict 附加到 list，最後才轉成 DataFrame；
+# 百萬組參數的掃描會產生上百萬個小 dict 與 Python 物件，記憶體用量與 GC 負擔都很重。
+#
+# SweepResults 事先依參數組配置每一欄的 NumPy 陣列，回測結果直接寫進對應的列：
+#   - 參數欄位：依參數值推導型別，整數為 int32（超出範圍時 int64）、浮點數為 float64，
+#     其他（例如類別字串）為 object。
+#   - 績效指標：第一次寫入時依指標名稱配置，數值指標一律為 float64（勝率為 0–1 的數值），
+#     非數值的指標為 object；尚未寫入的列為 NaN。
+# 批次模式下每一批的績效矩陣整欄寫入，不經過逐列的 dict；需要時才以 to_frame() 轉成 DataFrame。
+
+import numpy as np
+import pandas as pd
+
+_INT32 = np.iinfo(np.int32)
+
+
+def _param_column(values):
+    """依參數值推導欄位型別並建立陣列。"""
+    column = np.asarray(values)
+    kind = column.dtype.kind
+    if kind in "iu":
+        if len(column) == 0 or (_INT32.min <= column.min() and column.max() <= _INT32.max):
+            return column.astype(np.int32)
+        return column.astype(np.int64)
+    if kind == "f":
+        return column.astype(np.float64)
+    if kind == "b":
+        return column
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _is_numeric(values):
+    return np.asarray(values).dtype.kind in "biuf"
+
+
+class SweepResults:
+    """
+    參數掃描結果的欄式緩衝區，列順序與建立時的 param_sets 相同。
+
+    Args:
+        param_sets (list[dict]): 參數組（每組的參數名稱相同）。
+    """
+
+    __slots__ = ("params", "metrics", "size")
+
+    def __init__(self, param_sets):
+        self.size = len(param_sets)
+        names = list(param_sets[0]) if param_sets else []
+        self.params = {name: _param_column([p[name] for p in param_sets]) for name in names}
+        self.metrics = {}
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"SweepResults({self.size} 組參數, {len(self.params)} 個參數, {len(self.metrics)} 個指標)"
+
+    def _metric_column(self, name, values):
+        column = self.metrics.get(name)
+        if column is None:
+            if _is_numeric(values):
+                column = np.full(self.size, np.nan)
+            else:
+                column = np.full(self.size, None, dtype=object)
+            self.metrics[name] = column
+        elif column.dtype != object and not _is_numeric(values):
+            # 原本是數值的指標出現非數值：改成 object 欄
+            column = self.metrics[name] = column.astype(object)
+        return column
+
+    def write(self, rows, metrics):
+        """
+        整欄寫入績效指標。
+
+        Args:
+            rows (slice | array-like of int): 要寫入的列。
+            metrics (dict[str, array-like] | pd.DataFrame): 指標名稱 → 與 rows 等長的數值。
+        """
+        for name in metrics:
+            values = np.asarray(metrics[name])
+            self._metric_column(name, values)[rows] = values
+
+    def write_row(self, row, metrics):
+        """寫入單一列的績效指標（metrics 為績效函數回傳的 dict）。"""
+        for name, value in metrics.items():
+            self._metric_column(name, [value])[row] = value
+
+    def write_rows(self, rows, records):
+        """寫入多列的績效指標（records 為每列一個 dict，指標名稱相同）。"""
+        if records:
+            self.write(rows, {name: [r[name] for r in records] for name in records[0]})
+
+    def assign(self, rows, other):
+        """把另一個 SweepResults（例如子行程的結果）的績效指標寫入 rows 列。"""
+        self.write(rows, other.metrics)
+
+    def metric_records(self, start=0, stop=None):
+        """[start, stop) 列的績效指標，每列一個 dict（不含參數）。"""
+        stop = self.size if stop is None else stop
+        names = list(self.metrics)
+        columns = [self.metrics[name][start:stop].tolist() for name in names]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    def records(self):
+        """逐列產生「參數 + 績效指標」的 dict（與舊版 list-of-dicts 的格式相同）。"""
+        names = list(self.params) + list(self.metrics)
+        columns = [c.tolist() for c in self.params.values()] + [
+            c.tolist() for c in self.metrics.values()
+        ]
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+    def to_frame(self):
+        """轉成 DataFrame：參數欄位在前、績效指標在後，不複製欄位資料。"""
+        columns = dict(self.params)
+        columns.update(self.metrics)
+        return pd.DataFrame(columns, copy=False)
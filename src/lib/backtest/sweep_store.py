@@ -0,0 +1,225 @@
+# 參數掃描結果的持久化儲存（SQLite）
+# 原本的掃描把結果累積在記憶體中的 list，中途中斷（notebook 當掉、按下停止）就全部遺失，
+# 下一次執行也無法重用已經回測過的參數組。
+#
+# SweepStore 以 (策略, 資料指紋, 參數組) 為鍵保存每一組參數的績效：
+#   - 策略：回測函數、績效函數與批次回測函數（批次模式）的完整名稱
+#     （含 functools.partial 綁定的參數，例如成本模型），
+#     以及滾動指標的計算方式（指標庫的前綴和與 pandas rolling 的結果在最後幾位有效數字上不同）。
+#   - 資料指紋：所有數值欄位內容的雜湊，資料一改動就視為不同的資料集。
+#   - 參數組：依參數名稱排序後的 JSON。
+# evaluate_param_sets / run_sweep 傳入 store 時，先略過已有結果的參數組，
+# 其餘每完成 checkpoint 組就寫入並 commit 一次；中斷後以相同設定重新執行即從斷點繼續，
+# 擴大 iterations 或換一組 seed 時也只會回測新出現的參數組。
+# 寫入只發生在主行程，平行執行時由主行程在每個任務完成後寫入。
+
+import functools
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from lib.technical_indicators import get_indicator_method
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    strategy TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    params TEXT NOT NULL,
+    metrics TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (strategy, dataset, params)
+) WITHOUT ROWID
+"""
+
+
+def _to_python(value):
+    """把 NumPy 純量轉成 JSON 可序列化的 Python 值。"""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"無法序列化 {type(value).__name__}")
+
+
+def params_key(params):
+    """參數組的鍵：依參數名稱排序的 JSON（NumPy 純量轉成 Python 值，與 Python 數值的鍵相同）。"""
+    return json.dumps(sorted(params.items()), default=_to_python, ensure_ascii=False)
+
+
+def frame_fingerprint(df):
+    """資料集的指紋：欄名、dtype、長度與所有數值欄位內容的雜湊。"""
+    h = hashlib.blake2b(digest_size=16)
+    for column in df.columns:
+        values = df[column].to_numpy()
+        h.update(f"{column}:{values.dtype.str}:{len(values)};".encode())
+        if values.dtype.kind in "biufM":
+            h.update(np.ascontiguousarray(values).view(np.uint8).data)
+    return h.hexdigest()
+
+
+def _describe(value):
+    """
+    綁定參數的穩定描述，相同設定在不同行程中得到相同的字串。
+    預設的 object.__repr__ 含記憶體位址，改以類別名稱與屬性描述；
+    陣列的 repr 會省略中間的元素，改以內容的雜湊描述；函數以完整名稱描述。
+    """
+    if isinstance(value, np.ndarray):
+        h = hashlib.blake2b(np.ascontiguousarray(value).view(np.uint8).data, digest_size=16)
+        return f"ndarray({value.dtype.str}, {value.shape}, {h.hexdigest()})"
+    if isinstance(value, (list, tuple)):
+        items = ", ".join(_describe(v) for v in value)
+        return f"[{items}]" if isinstance(value, list) else f"({items})"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k!r}: {_describe(v)}" for k, v in value.items()) + "}"
+    if callable(value) and not isinstance(value, type):
+        if isinstance(value, functools.partial) or hasattr(value, "__qualname__"):
+            return callable_name(value)
+    if type(value).__repr__ is object.__repr__:
+        fields = getattr(value, "__dict__", None)
+        if fields is None:
+            fields = {name: getattr(value, name) for name in getattr(value, "__slots__", ())}
+        items = ", ".join(f"{k}={_describe(v)}" for k, v in fields.items())
+        return f"{type(value).__module__}.{type(value).__qualname__}({items})"
+    return repr(value)
+
+
+def callable_name(func):
+    """函數的完整名稱；functools.partial 另外附上綁定的參數（見 _describe）。"""
+    if isinstance(func, functools.partial):
+        bound = [_describe(a) for a in func.args]
+        bound += [f"{k}={_describe(v)}" for k, v in sorted(func.keywords.items())]
+        return f"{callable_name(func.func)}({', '.join(bound)})"
+    module = getattr(func, "__module__", None) or ""
+    name = getattr(func, "__qualname__", None) or repr(func)
+    return f"{module}.{name}" if module else name
+
+
+def strategy_key(backtest_func, performance_func, batch_func=None):
+    """
+    策略的鍵：回測函數 + 績效函數的完整名稱 + 滾動指標的計算方式（set_indicator_method）；
+    批次模式下另加批次回測函數的完整名稱。批次函數可用 partial 綁定與單次回測不同的
+    成本模型或部位規模，實際執行的是批次函數，因此必須列入鍵。
+    回測引擎的模式與編譯核心都不影響結果（逐位元相同），因此不列入鍵。
+    partial 綁定的參數以 _describe 描述（CostModel、PositionSizer 有各自的 repr），不含記憶體位址。
+    """
+    key = f"{callable_name(backtest_func)} | {callable_name(performance_func)}"
+    if batch_func is not None:
+        key += f" | batch={callable_name(batch_func)}"
+    return f"{key} | indicators={get_indicator_method()}"
+
+
+class SweepStore:
+    """
+    SQLite 參數掃描結果儲存。
+
+    Args:
+        path (str | Path): 資料庫檔案路徑（不存在時自動建立）。
+        checkpoint (int): 每完成幾組參數寫入並 commit 一次；批次模式下至少為 chunk_size。
+
+    Example:
+        >>> store = SweepStore("output/sweeps.sqlite")
+        >>> results = sensitivity_analysis_four(df, backtest_strategy_four,
+        ...     calculate_strategy_performance, ranges, iterations=500, seed=0, store=store)
+    """
+
+    __slots__ = ("path", "checkpoint", "_conn")
+
+    def __init__(self, path, checkpoint=50):
+        if checkpoint < 1:
+            raise ValueError("checkpoint 至少為 1")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.checkpoint = checkpoint
+        self._conn = sqlite3.connect(self.path)
+        # WAL 模式下寫入中斷也不會損毀既有的資料，讀取不會被寫入阻擋
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def __repr__(self):
+        return f"SweepStore({str(self.path)!r})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def fetch(self, strategy, dataset, param_sets):
+        """
+        取得已保存的結果。
+
+        Returns:
+            dict[str, dict]: params_key → 績效指標，只包含 param_sets 中已有結果者。
+        """
+        wanted = {params_key(p) for p in param_sets}
+        rows = self._conn.execute(
+            "SELECT params, metrics FROM results WHERE strategy = ? AND dataset = ?",
+            (strategy, dataset),
+        )
+        return {key: json.loads(metrics) for key, metrics in rows if key in wanted}
+
+    def save(self, strategy, dataset, param_sets, metrics):
+        """
+        寫入一批結果並 commit（已存在的鍵會被覆寫）。
+
+        Args:
+            param_sets (list[dict]): 參數組。
+            metrics (list[dict]): 對應的績效指標（不含參數，即 SweepResults.metric_records()）。
+        """
+        now = time.time()
+        records = [
+            (strategy, dataset, params_key(params),
+             json.dumps(values, default=_to_python, ensure_ascii=False), now)
+            for params, values in zip(param_sets, metrics)
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", records
+            )
+
+    def results(self, strategy=None, dataset=None):
+        """
+        以 DataFrame 取出保存的結果：strategy、dataset 欄 + 參數欄位 + 績效指標，依寫入時間排序。
+        指定 strategy / dataset 時只取出符合者。
+        """
+        query, args = self._where(strategy, dataset)
+        rows = self._conn.execute(
+            f"SELECT strategy, dataset, params, metrics FROM results{query} ORDER BY created", args
+        ).fetchall()
+        records = []
+        for strategy_, dataset_, params, metrics in rows:
+            record = {"strategy": strategy_, "dataset": dataset_}
+            record.update(json.loads(params))
+            record.update(json.loads(metrics))
+            records.append(record)
+        return pd.DataFrame(records)
+
+    def summary(self):
+        """每個 (策略, 資料集) 已保存的參數組數。"""
+        return pd.read_sql_query(
+            "SELECT strategy, dataset, COUNT(*) AS n, MAX(created) AS last_updated "
+            "FROM results GROUP BY strategy, dataset",
+            self._conn,
+        ).assign(last_updated=lambda t: pd.to_datetime(t["last_updated"], unit="s"))
+
+    def clear(self, strategy=None, dataset=None):
+        """刪除保存的結果（未指定時全部刪除）。"""
+        query, args = self._where(strategy, dataset)
+        with self._conn:
+            self._conn.execute(f"DELETE FROM results{query}", args)
+
+    @staticmethod
+    def _where(strategy, dataset):
+        conditions = [(column, value) for column, value in
+                      (("strategy", strategy), ("dataset", dataset)) if value is not None]
+        if not conditions:
+            return "", ()
+        query = " WHERE " + " AND ".join(f"{column} = ?" for column, _ in conditions)
+        return query, tuple(value for _, value in conditions)
@@ -0,0 +1,203 @@
+# 滾動視窗（walk-forward）最佳化
+# 取代「在 sample1 挑參數、再手動到 sample2 / sample3 驗證」的流程：
+# 在同一條價格序列上切出連續的 訓練 → 測試 視窗，每個視窗在訓練期挑出最佳參數，
+# 再以該參數在緊接著的測試期（樣本外）回測，最後把所有測試期的權益曲線接成一條。
+#
+# 所有視窗使用同一批候選參數組，並以批次回測函數的 start / stop 只在視窗期間交易；
+# 指標一律在完整序列上計算（經由指標快取），重疊的 K 棒在各視窗與各參數組之間只算一次，
+# 視窗起點之前的資料則自然成為指標的暖機期。各視窗彼此獨立，可在多個行程中平行執行。
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+
+from lib.backtest.optimizer import EQUITY
+from lib.backtest.sweep import attach_frame, random_sampler, run_param_sets, share_frame
+from lib.performance_analysis import calculate_strategy_performance
+
+
+def walk_forward_windows(length, train_size, test_size, step=None, anchored=False):
+    """
+    產生滾動視窗的 K 棒區間。
+
+    Args:
+        length (int): 資料總長度。
+        train_size (int): 訓練期長度（K 棒數）。
+        test_size (int): 測試期長度（K 棒數）；最後一個測試期可能較短。
+        step (int, optional): 視窗每次前進的 K 棒數，預設等於 test_size（測試期首尾相接）。
+        anchored (bool): True 時訓練期起點固定在 0（擴張視窗）。
+
+    Returns:
+        list[tuple[int, int, int, int]]: 每個視窗的 (訓練起點, 訓練終點, 測試起點, 測試終點)，
+            皆為左閉右開區間的 K 棒位置。
+    """
+    step = test_size if step is None else step
+    if min(train_size, test_size, step) < 1:
+        raise ValueError("train_size、test_size 與 step 必須為正整數")
+
+    windows = []
+    train_start = 0
+    while train_start + train_size < length:
+        train_stop = train_start + train_size
+        test_stop = min(train_stop + test_size, length)
+        windows.append((0 if anchored else train_start, train_stop, train_stop, test_stop))
+        train_start += step
+    return windows
+
+
+def _run_window(
+    df_original, batch_func, performance_func, param_sets, window, objective, direction, chunk_size
+):
+    """在單一視窗上挑選最佳參數並回測樣本外期間。"""
+    train_start, train_stop, test_start, test_stop = window
+
+    # 訓練期：所有候選參數組一起以批次模式回測
+    train_func = partial(batch_func, start=train_start, stop=train_stop)
+    results = run_param_sets(df_original, None, performance_func, param_sets, train_func, chunk_size)
+    if callable(objective):
+        scores = np.array([float(objective(r)) for r in results.records()])
+    else:
+        scores = results.metrics[objective].astype(float)
+    scores = np.where(np.isnan(scores), -np.inf if direction == "maximize" else np.inf, scores)
+    best = int(np.argmax(scores) if direction == "maximize" else np.argmin(scores))
+    params = param_sets[best]
+
+    # 測試期：以最佳參數回測樣本外資料
+    ret, cus, position = batch_func(
+        df_original,
+        **{name: np.array([value]) for name, value in params.items()},
+        start=test_start,
+        stop=test_stop,
+    )
+    return {
+        "window": window,
+        "params": params,
+        "train_score": scores[best],
+        "ret": ret[:, 0],
+        "cus": cus[:, 0],
+        "position": position[:, 0],
+    }
+
+
+def _run_window_shared(spec, *args):
+    """子行程的任務入口：掛載共享資料（並套用指標計算方式，見 attach_frame）後處理一個視窗。"""
+    return _run_window(attach_frame(spec), *args)
+
+
+def walk_forward(
+    df_original,
+    batch_func,
+    param_space,
+    train_size,
+    test_size,
+    step=None,
+    anchored=False,
+    constraints=(),
+    iterations=200,
+    sampler=random_sampler,
+    seed=None,
+    objective=EQUITY,
+    direction="maximize",
+    performance_func=calculate_strategy_performance,
+    chunk_size=1024,
+    n_jobs=1,
+    executor=None,
+):
+    """
+    執行滾動視窗最佳化，並接合所有樣本外測試期的權益曲線。
+
+    Args:
+        df_original (pd.DataFrame): 完整的價格資料，例如 TPE-5year。
+        batch_func (function): 支援 start / stop 的批次回測函數，例如 backtest_strategy_two_batch。
+        param_space (dict): 參數空間，寫法同 sweep.run_sweep。
+        train_size, test_size, step, anchored: 見 walk_forward_windows。
+        constraints (list[str]): 參數限制條件，例如 ['short_ma_period < long_ma_period']。
+        iterations (int): 候選參數組數（所有視窗共用同一批）。
+        sampler (function): 參數抽樣器，預設為 random_sampler。
+        seed (int, optional): 抽樣的亂數種子。
+        objective (str | function): 用來挑選參數的績效指標名稱，或接受績效字典並回傳數值的函數。
+        direction (str): "maximize" 或 "minimize"。
+        performance_func (function): 計算績效函數，接受回測結果 df，返回 dict。
+        chunk_size (int): 批次模式下每次同時回測的參數組數。
+        n_jobs (int): 平行行程數；1 表示在目前行程執行，-1 表示使用所有 CPU 核心。
+        executor (concurrent.futures.Executor, optional): 自行提供的 executor，提供時忽略 n_jobs。
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]:
+            - 每個視窗一列：訓練 / 測試期的起訖、選出的參數、訓練期目標值與測試期績效。
+            - 樣本外資料（各測試期接合）：ret、cus（接續前一段的權益）、position、
+              window（視窗編號）與 BH，index 與 df_original 相同。
+              每段測試期由空手開始；期末未平倉的部位以收盤價計入權益後結束。
+    """
+    if step is not None and step < test_size:
+        raise ValueError("step 不可小於 test_size，否則樣本外期間會重疊")
+    windows = walk_forward_windows(len(df_original), train_size, test_size, step, anchored)
+    if not windows:
+        raise ValueError("資料長度不足以切出任何一個訓練 + 測試視窗")
+
+    param_sets = sampler(param_space, constraints, iterations, seed=seed)
+    print(f"共 {len(windows)} 個視窗，每個視窗評估 {len(param_sets)} 組參數...")
+    task_args = (batch_func, performance_func, param_sets)
+    tail_args = (objective, direction, chunk_size)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if executor is None and n_jobs == 1:
+        outputs = [
+            _run_window(df_original, *task_args, window, *tail_args)
+            for window in tqdm(windows, desc="視窗進度")
+        ]
+    else:
+        shm, spec = share_frame(df_original)
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=min(n_jobs, len(windows)))
+        try:
+            futures = [
+                executor.submit(_run_window_shared, spec, *task_args, window, *tail_args)
+                for window in windows
+            ]
+            outputs = [future.result() for future in tqdm(futures, desc="視窗進度")]
+        finally:
+            if own_executor:
+                executor.shutdown()
+            shm.close()
+            shm.unlink()
+
+    # --- 彙整每個視窗的結果 ---
+    has_dates = "年月日" in df_original.columns
+    label = (lambda i: df_original["年月日"].iloc[i]) if has_dates else (lambda i: i)
+    rows = []
+    segments = []
+    offset = 0.0
+    for k, out in enumerate(outputs):
+        train_start, train_stop, test_start, test_stop = out["window"]
+        segment = pd.DataFrame(
+            {"ret": out["ret"], "cus": out["cus"], "position": out["position"]},
+            index=df_original.index[test_start:test_stop],
+        )
+        row = {
+            "視窗": k,
+            "訓練起": label(train_start),
+            "訓練迄": label(train_stop - 1),
+            "測試起": label(test_start),
+            "測試迄": label(test_stop - 1),
+            **out["params"],
+            "訓練期目標值": out["train_score"],
+        }
+        row.update({f"測試期{key}": value for key, value in performance_func(segment).items()})
+        rows.append(row)
+
+        segment["cus"] += offset
+        segment["window"] = k
+        offset = segment["cus"].iloc[-1]
+        segments.append(segment)
+
+    oos = pd.concat(segments)
+    close = df_original["收盤價"].loc[oos.index]
+    oos["BH"] = close - close.iloc[0]
+    return pd.DataFrame(rows), oos
@@ -0,0 +1,494 @@
+# 效能基準測試
+# 以固定的資料與參數量測指標、單次 / 批次回測、績效計算與參數掃描的執行時間與記憶體峰值，
+# 結果依 git commit 存成 JSON，並與先前的紀錄比較，找出超過門檻的效能退化。
+# 任何引擎或指標的改寫，都應先在改寫前後各跑一次，確認沒有退化再合併。
+#
+# 用法（於 src/ 目錄下執行）：
+#   python -m lib.benchmark                        # 全部項目（含 10 萬根 K 棒的合成資料，約需數分鐘）
+#   python -m lib.benchmark --quick                # 只用 TPE-sample1
+#   python -m lib.benchmark -k backtest            # 只執行名稱含 "backtest" 的項目
+#   python -m lib.benchmark --baseline 5cad38c --threshold 0.2
+# 有任何項目退化時結束代碼為 1，可直接用於 CI。
+#
+# 量測方式：
+#   - 時間：與 timeit 相同，自動決定每次量測的呼叫次數（至少 0.2 秒），重複量測取最小值；
+#     單次呼叫很慢的項目（如 10 萬根 K 棒的參數掃描）依 budget 減少重複次數。
+#   - 記憶體峰值：另外執行一次，同時作為暖機，不計入時間；Linux 上以行程的 RSS 高水位計算，
+#     其他平台以 tracemalloc 計算（NumPy 的配置也會被追蹤），兩者的數值不宜互相比較。
+#   - 指標與回測項目在量測時停用指標快取，量到的是實際計算而非快取命中；參數掃描照常使用快取。
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from lib import kernels
+from lib import technical_indicators as ti
+from lib.backtest import strategy_four as s4
+from lib.backtest import strategy_one as s1
+from lib.backtest import strategy_three as s3
+from lib.backtest import strategy_two as s2
+from lib.backtest.backtest_adjusted import (
+    grid_analysis_two,
+    sensitivity_analysis_four,
+    sensitivity_analysis_one,
+    sensitivity_analysis_three,
+    sensitivity_analysis_two,
+)
+from lib.data_loader import load_price_csv
+from lib.performance_analysis import calculate_strategy_performance
+
+ROOT = Path(__file__).resolve().parents[2]
+DATA_DIR = ROOT / "data"
+RESULTS_PATH = ROOT / "src" / "output" / "benchmarks.json"
+
+SWEEP_ITERATIONS = 500
+BATCH_LANES = 64
+GRID_RANGES = {"short_ma_period": (1, 60), "long_ma_period": (1, 60)}
+
+# 每個策略的 (單次回測, 批次回測, 敏感度分析, 批次回測的參數範圍, 參數掃描範圍)
+# 單次回測使用各函數的預設參數；策略一的參數掃描使用 sensitivity_analysis_one 的預設範圍
+_STRATEGIES = {
+    "one": (
+        s1.backtest_strategy,
+        s1.backtest_strategy_batch,
+        sensitivity_analysis_one,
+        {"ma_period": (3, 15), "bb_period": (16, 40), "bb_std": (1.0, 3.0),
+         "drop_threshold": (0.1, 0.9)},
+        None,
+    ),
+    "two": (
+        s2.backtest_strategy_two,
+        s2.backtest_strategy_two_batch,
+        sensitivity_analysis_two,
+        {"short_ma_period": (3, 15), "long_ma_period": (16, 60)},
+        {"short_ma_period": (3, 15), "long_ma_period": (16, 60)},
+    ),
+    "three": (
+        s3.backtest_strategy_three,
+        s3.backtest_strategy_three_batch,
+        sensitivity_analysis_three,
+        {"ma_short": (2, 5), "ma_medium": (6, 15), "ma_long": (16, 60)},
+        {"ma_short": (2, 5), "ma_medium": (6, 15), "ma_long": (16, 60)},
+    ),
+    "four": (
+        s4.backtest_strategy_four,
+        s4.backtest_strategy_four_batch,
+        sensitivity_analysis_four,
+        {"bb_period": (3, 30), "bb_std": (0.5, 3.0), "ma_long_period": (5, 60)},
+        {"bb_period": (3, 30), "bb_std": (0.5, 3.0), "ma_long_period": (5, 60)},
+    ),
+}
+
+
+def _indicator_bank(df, windows, kind):
+    return ti.indicator_bank(df["收盤價"], windows, kind)
+
+
+# 指標、參數，以及是否會在傳入的 df 上新增欄位
+# 會新增欄位的 calc_* 每次呼叫都在新的副本上計算：calc_Bias 等函數遇到已存在的 MA 欄位會直接沿用，
+# 若重複使用同一個 df，第一次之後量到的就只剩乖離率本身（副本的複製時間一併計入）
+_INDICATORS = {
+    "calc_ma": (ti.calc_ma, {"period": 20}, True),
+    "calc_MA3": (ti.calc_MA3, {}, True),
+    "calc_MA5": (ti.calc_MA5, {}, True),
+    "calc_MA10": (ti.calc_MA10, {}, True),
+    "calc_MA20": (ti.calc_MA20, {}, True),
+    "calc_Bollinger": (ti.calc_Bollinger, {}, True),
+    "calc_prev_gain": (ti.calc_prev_gain, {}, True),
+    "calc_Bias": (ti.calc_Bias, {}, True),
+    "calc_RSI14": (ti.calc_RSI14, {}, True),
+    "calc_ma_matrix": (ti.calc_ma_matrix, {"periods": np.arange(2, 61)}, False),
+    "calc_std_matrix": (ti.calc_std_matrix, {"periods": np.arange(2, 61)}, False),
+    "indicator_bank_mean": (
+        _indicator_bank, {"windows": np.arange(2, 61), "kind": "mean"}, False
+    ),
+    "indicator_bank_std": (_indicator_bank, {"windows": np.arange(2, 61), "kind": "std"}, False),
+}
+
+
+def _on_copy(func, df, **params):
+    """在 df 的新副本上呼叫 func，避免前一次呼叫新增的欄位影響下一次。"""
+    return func(df.copy(), **params)
+
+
+def synthetic_prices(n_bars=100_000, seed=0):
+    """
+    產生 n_bars 根 K 棒的合成價格（幾何隨機漫步），欄位與 load_price_csv 相同。
+    日期以小時為間隔，避免 10 萬個交易日超出 datetime64[ns] 的範圍；策略只使用價格，不受影響。
+    """
+    rng = np.random.default_rng(seed)
+    close = 10_000 * np.exp(np.cumsum(rng.normal(0, 0.012, n_bars)))
+    open_ = np.concatenate(([10_000], close[:-1])) * (1 + rng.normal(0, 0.003, n_bars))
+    wick = np.abs(rng.normal(0, 0.004, (2, n_bars)))
+    return pd.DataFrame(
+        {
+            "年月日": pd.date_range("2000-01-01", periods=n_bars, freq="h"),
+            "開盤價": open_.round(2),
+            "最高價": (np.maximum(open_, close) * (1 + wick[0])).round(2),
+            "最低價": (np.minimum(open_, close) * (1 - wick[1])).round(2),
+            "收盤價": close.round(2),
+            "成交量": rng.lognormal(11, 0.5, n_bars).round(),
+        }
+    )
+
+
+def load_datasets(quick=False):
+    """基準測試使用的資料：TPE-sample1，以及（非 quick 時）10 萬根 K 棒的合成資料。"""
+    datasets = {"TPE-sample1": load_price_csv(DATA_DIR / "TPE-sample1.csv")}
+    if not quick:
+        datasets["synthetic-100k"] = synthetic_prices()
+    return datasets
+
+
+def _batch_params(ranges, n_lanes, seed=0):
+    """在各參數範圍內均勻抽取 n_lanes 組參數（整數範圍取整數），供批次回測使用。"""
+    rng = np.random.default_rng(seed)
+    params = {}
+    for name, (low, high) in ranges.items():
+        if isinstance(low, int) and isinstance(high, int):
+            params[name] = rng.integers(low, high + 1, n_lanes)
+        else:
+            params[name] = rng.uniform(low, high, n_lanes).round(2)
+    return params
+
+
+def _quiet(func):
+    """靜默執行（參數掃描會列印進度與進度條）。"""
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return func()
+
+    return run
+
+
+def benchmark_cases(datasets):
+    """
+    建立所有基準測試項目。
+
+    Returns:
+        dict[str, tuple[callable, bool]]: 項目名稱 → (無參數的量測函數, 是否停用指標快取)。
+            名稱格式為「類別.函數[資料]」，例如 "backtest.backtest_strategy_four[TPE-sample1]"。
+    """
+    cases = {}
+    for data_name, df in datasets.items():
+        for name, (func, params, adds_columns) in _INDICATORS.items():
+            run = partial(func, df, **params)
+            if adds_columns:
+                run = partial(_on_copy, func, df, **params)
+            cases[f"indicator.{name}[{data_name}]"] = (run, True)
+
+        for single, batch, sweep, batch_ranges, sweep_ranges in _STRATEGIES.values():
+            cases[f"backtest.{single.__name__}[{data_name}]"] = (partial(single, df), True)
+            lanes = _batch_params(batch_ranges, BATCH_LANES)
+            cases[f"backtest.{batch.__name__}[{data_name}]"] = (partial(batch, df, **lanes), True)
+
+        result = s4.backtest_strategy_four(df)
+        cases[f"performance.calculate_strategy_performance[{data_name}]"] = (
+            partial(calculate_strategy_performance, result), False
+        )
+
+        # 10 萬根 K 棒時縮小批次大小，避免 (K 棒 × 參數組) 的訊號矩陣佔用數 GB 記憶體
+        chunk_size = 1024 if len(df) <= 10_000 else 64
+        for single, batch, sweep, batch_ranges, sweep_ranges in _STRATEGIES.values():
+            run = partial(
+                sweep, df, single, calculate_strategy_performance, sweep_ranges,
+                iterations=SWEEP_ITERATIONS, batch_func=batch, chunk_size=chunk_size, seed=0,
+            )
+            cases[f"sweep.{sweep.__name__}[{data_name}]"] = (_quiet(run), False)
+
+        # 60 × 60 的完整網格（1770 組參數）；10 萬根 K 棒時單一項目就要數十秒，只量測實際資料
+        if len(df) <= 10_000:
+            run = partial(
+                grid_analysis_two, df, s2.backtest_strategy_two, calculate_strategy_performance,
+                GRID_RANGES, batch_func=s2.backtest_strategy_two_batch, chunk_size=chunk_size,
+            )
+            cases[f"sweep.grid_analysis_two[{data_name}]"] = (_quiet(run), False)
+    return cases
+
+
+@contextlib.contextmanager
+def _indicator_cache(enabled):
+    """暫時停用指標快取（enabled=False），結束後恢復原本的上限。"""
+    if enabled:
+        yield
+        return
+    limit = ti.indicator_cache_info()["max_bytes"]
+    ti.clear_indicator_cache()
+    ti.set_indicator_cache_limit(0)
+    try:
+        yield
+    finally:
+        ti.set_indicator_cache_limit(limit)
+
+
+def _proc_status(field):
+    """讀取 /proc/self/status 的記憶體欄位（位元組）。"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"/proc/self/status 沒有 {field}")
+
+
+def memory_method():
+    """
+    記憶體峰值的量測方式：
+    Linux 上重設行程的 RSS 高水位（/proc/self/clear_refs）後讀取 VmHWM，幾乎沒有額外開銷；
+    其他平台改用 tracemalloc（會追蹤每一次配置，10 萬根 K 棒的批次回測會慢上數倍）。
+    RSS 只反映超出執行前常駐記憶體的部分，小額配置會重用已釋放的分頁而量到 0；
+    compare_results 因此只比較基準峰值達 min_memory 以上的項目。
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        _proc_status("VmHWM")
+    except OSError:
+        return "tracemalloc"
+    return "rss"
+
+
+def peak_memory(func, method="tracemalloc"):
+    """
+    執行一次 func，回傳 (記憶體峰值相對於執行前的增量（位元組）, 執行秒數)。
+
+    Args:
+        func (callable): 無參數的函數。
+        method (str): "rss" 或 "tracemalloc"，見 memory_method。
+    """
+    if method == "rss":
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        baseline = _proc_status("VmRSS")
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        return max(_proc_status("VmHWM") - baseline, 0), elapsed
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - baseline, elapsed
+
+
+def measure(func, repeat=5, budget=10.0, method="tracemalloc"):
+    """
+    量測單一項目的時間與記憶體峰值。
+
+    Args:
+        func (callable): 無參數的量測函數。
+        repeat (int): 最多重複量測的次數，取最小值。
+        budget (float): 單一項目計時部分的時間預算（秒）；單次呼叫很慢時減少重複次數（至少 1 次）。
+        method (str): 記憶體峰值的量測方式，見 memory_method。
+
+    Returns:
+        dict: min / median（每次呼叫的秒數）、number（每次量測的呼叫次數）、repeat、
+            peak_memory（記憶體峰值，位元組）。
+    """
+    # 記憶體量測同時作為暖機
+    peak, elapsed = peak_memory(func, method)
+
+    timer = timeit.Timer(func)
+    if elapsed >= 0.2:
+        # 很慢的項目不另外 autorange，以暖機的時間估計重複次數
+        number = 1
+        repeat = max(1, min(repeat, int(budget / elapsed)))
+    else:
+        number, total = timer.autorange()
+        repeat = max(1, min(repeat, int(budget / total)))
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "number": number,
+        "repeat": repeat,
+        "peak_memory": int(peak),
+    }
+
+
+def run_benchmarks(quick=False, select=None, repeat=5, budget=10.0, verbose=True):
+    """
+    執行基準測試。
+
+    Args:
+        quick (bool): 只使用 TPE-sample1（略過 10 萬根 K 棒的合成資料）。
+        select (str, optional): 只執行名稱包含此字串的項目。
+        repeat, budget: 見 measure。
+        verbose (bool): 是否逐項列印結果。
+
+    Returns:
+        dict[str, dict]: 項目名稱 → measure 的結果。
+    """
+    cases = benchmark_cases(load_datasets(quick))
+    if select:
+        cases = {name: case for name, case in cases.items() if select in name}
+    method = memory_method()
+    results = {}
+    for name, (func, cold) in cases.items():
+        with _indicator_cache(not cold):
+            results[name] = measure(func, repeat, budget, method)
+        if verbose:
+            r = results[name]
+            print(f"{name:<70} {r['min'] * 1e3:12.3f} ms {r['peak_memory'] / 2**20:10.1f} MiB")
+    return results
+
+
+def git_revision():
+    """目前的 git commit 與工作目錄是否有未提交的修改；不在 git 倉庫中時回傳 ("unknown", True)。"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", True
+    return commit, bool(status.strip())
+
+
+def load_history(path=None):
+    """讀取所有紀錄：{紀錄鍵: 紀錄}，依寫入順序排列；檔案不存在時回傳空 dict。"""
+    path = Path(path or RESULTS_PATH)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_results(results, path=None):
+    """
+    以 git commit 為鍵把結果寫入 JSON（同一 commit 重跑時覆寫）。
+    工作目錄有未提交的修改時，鍵為「commit+dirty」，不會覆蓋該 commit 的正式紀錄。
+
+    Returns:
+        str: 紀錄鍵。
+    """
+    path = Path(path or RESULTS_PATH)
+    commit, dirty = git_revision()
+    key = f"{commit}+dirty" if dirty else commit
+    history = load_history(path)
+    history.pop(key, None)
+    history[key] = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "backend": kernels.get_backend(),
+        "memory": memory_method(),
+        "machine": f"{platform.system()} {platform.machine()} {platform.processor()}".strip(),
+        "results": results,
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(history, ensure_ascii=False, indent=1), encoding="utf-8")
+    return key
+
+
+def compare_results(current, baseline, threshold=0.1, min_memory=1 << 20):
+    """
+    比較兩次結果，找出時間或記憶體峰值超過門檻的退化。
+
+    Args:
+        current, baseline (dict): run_benchmarks 的結果（或紀錄中的 "results"）。
+        threshold (float): 容許的增幅，0.1 表示慢 10% 以上（或記憶體多 10% 以上）即視為退化。
+        min_memory (int): 基準記憶體峰值低於此值（位元組）時不比較記憶體，避免小額配置的雜訊。
+
+    Returns:
+        pd.DataFrame: 兩邊都有的項目，依時間比值由大到小排列：
+            基準時間、目前時間（秒）、時間比值、記憶體比值、退化。
+    """
+    names = [name for name in current if name in baseline]
+    rows = {}
+    for name in names:
+        now, before = current[name], baseline[name]
+        memory_ratio = np.nan
+        if before["peak_memory"] >= min_memory:
+            memory_ratio = now["peak_memory"] / before["peak_memory"]
+        time_ratio = now["min"] / before["min"]
+        rows[name] = {
+            "基準時間": before["min"],
+            "目前時間": now["min"],
+            "時間比值": time_ratio,
+            "記憶體比值": memory_ratio,
+            "退化": bool(time_ratio > 1 + threshold or memory_ratio > 1 + threshold),
+        }
+    columns = ["基準時間", "目前時間", "時間比值", "記憶體比值", "退化"]
+    table = pd.DataFrame.from_dict(rows, orient="index", columns=columns)
+    return table.sort_values("時間比值", ascending=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回測程式的效能基準測試")
+    parser.add_argument("--quick", action="store_true", help="只使用 TPE-sample1")
+    parser.add_argument("-k", "--select", help="只執行名稱包含此字串的項目")
+    parser.add_argument("--repeat", type=int, default=5, help="每個項目最多重複量測的次數")
+    parser.add_argument("--budget", type=float, default=10.0, help="每個項目計時的時間預算（秒）")
+    parser.add_argument("--threshold", type=float, default=0.1, help="視為退化的增幅，預設 0.1")
+    parser.add_argument("--baseline", help="比較對象的紀錄鍵（commit）；預設為最近一筆其他紀錄")
+    parser.add_argument("--output", help=f"結果 JSON 路徑，預設 {RESULTS_PATH}")
+    parser.add_argument("--no-save", action="store_true", help="不寫入結果")
+    args = parser.parse_args(argv)
+
+    history = load_history(args.output)
+    if args.baseline and args.baseline not in history:
+        parser.error(f"找不到紀錄：{args.baseline}")
+    results = run_benchmarks(args.quick, args.select, args.repeat, args.budget)
+    key = None
+    if not args.no_save:
+        key = save_results(results, args.output)
+        print(f"\n結果已寫入 {args.output or RESULTS_PATH}（{key}）")
+
+    if args.baseline:
+        baseline_key = args.baseline
+    else:
+        commit, dirty = git_revision()
+        current_key = key or (f"{commit}+dirty" if dirty else commit)
+        others = [k for k in history if k != current_key]
+        if not others:
+            print("沒有可比較的先前紀錄")
+            return 0
+        baseline_key = others[-1]
+
+    baseline = history[baseline_key]
+    min_memory = 1 << 20
+    if baseline.get("memory") != memory_method():
+        print("\n記憶體峰值的量測方式與比較對象不同，只比較時間")
+        min_memory = np.inf
+    table = compare_results(results, baseline["results"], args.threshold, min_memory)
+    print(f"\n與 {baseline_key} 比較（門檻 {args.threshold:.0%}）：")
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(table.to_string(float_format=lambda x: f"{x:.4g}"))
+    regressions = table.index[table["退化"]]
+    if len(regressions):
+        print(f"\n{len(regressions)} 個項目退化：")
+        for name in regressions:
+            print(f"  {name}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# 讀取 data/ 目錄下的價格 CSV
+# 這些檔案來自證交所匯出：開頭帶有 BOM、數值欄位常有尾端空白（例如 "13775.26 "），
+# 部分檔案的日期欄叫「日期」而非「年月日」、日期前還有空白。
+# load_price_csv 統一處理這些差異，輸出固定的欄位與型別：
+#   年月日 (datetime64) + 開盤價 / 最高價 / 最低價 / 收盤價 / 成交量（及其他數值欄）皆為指定的浮點數型別。
+# 解析結果會另存成 .npz 欄式快取（預設放在 CSV 同目錄的 .cache/ 下），
+# 來源檔的修改時間與大小不變、或內容雜湊相同時直接讀取快取，不必重新解析。
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DATE_COLUMN = "年月日"
+PRICE_COLUMNS = ["開盤價", "最高價", "最低價", "收盤價", "成交量"]
+
+# 其他檔案中與標準欄名同義的欄位
+_COLUMN_ALIASES = {"日期": DATE_COLUMN}
+
+# 快取格式有變動時遞增，讓舊快取自動失效
+_CACHE_VERSION = 1
+
+# 同一行程內最近載入的結果：{(路徑, dtype): (mtime_ns, size, DataFrame)}
+_loaded = {}
+
+
+def _file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def parse_price_csv(path, dtype=np.float64):
+    """
+    解析價格 CSV（不使用快取）。
+
+    Args:
+        path (str | Path): CSV 檔案路徑。
+        dtype: 數值欄位的型別，np.float64 或 np.float32。
+
+    Returns:
+        pd.DataFrame: 欄位為 年月日 + 數值欄位，index 為 0..N-1。
+
+    Raises:
+        ValueError: 缺少必要欄位、數值無法解析、價格有缺值或日期無法解析。
+    """
+    df = pd.read_csv(path, encoding="utf-8-sig", skipinitialspace=True)
+    df.columns = [str(c).strip() for c in df.columns]
+    df = df.rename(columns=_COLUMN_ALIASES)
+
+    missing = [c for c in [DATE_COLUMN] + PRICE_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"{path} 缺少必要欄位：{', '.join(missing)}")
+
+    dates = df[DATE_COLUMN].astype(str).str.strip()
+    try:
+        dates = pd.to_datetime(dates, format="%Y/%m/%d")
+    except ValueError:
+        dates = pd.to_datetime(dates)
+
+    columns = {DATE_COLUMN: dates}
+    for col in df.columns.drop(DATE_COLUMN):
+        values = df[col]
+        if values.dtype == object:
+            values = values.str.strip()
+        try:
+            columns[col] = values.to_numpy(dtype=dtype)
+        except ValueError as e:
+            raise ValueError(f"{path} 的欄位「{col}」含有無法解析的數值") from e
+
+    result = pd.DataFrame(columns)
+    nan_cols = [c for c in PRICE_COLUMNS[:4] if result[c].isna().any()]
+    if nan_cols:
+        raise ValueError(f"{path} 的價格欄位有缺值：{', '.join(nan_cols)}")
+    return result
+
+
+def _cache_file(path, dtype, cache_dir):
+    cache_dir = Path(cache_dir) if cache_dir is not None else path.parent / ".cache"
+    return cache_dir / f"{path.stem}.{np.dtype(dtype).name}.npz"
+
+
+def _read_cache(cache_path, path, stat):
+    """讀取快取；來源已變動或快取不存在時回傳 None。"""
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            meta = json.loads(str(data["__meta__"]))
+            if meta["version"] != _CACHE_VERSION:
+                return None
+            touched = (meta["mtime_ns"], meta["size"]) != (stat.st_mtime_ns, stat.st_size)
+            if touched:
+                # 修改時間或大小不同（例如檔案被複製過），以內容雜湊做最後確認
+                if meta["size"] != stat.st_size or meta["digest"] != _file_digest(path):
+                    return None
+            names = data["__columns__"].tolist()
+            df = pd.DataFrame({name: data[f"c{i}"] for i, name in enumerate(names)})
+    except (OSError, KeyError, ValueError):
+        return None
+    if touched:
+        # 內容相同、只有修改時間不同（例如 touch、git checkout）：更新快取記錄的修改時間，
+        # 之後的載入不必再計算整個檔案的雜湊
+        try:
+            _write_cache(cache_path, df, path, stat, meta["digest"])
+        except OSError:
+            pass
+    return df
+
+
+def _write_cache(cache_path, df, path, stat, digest=None):
+    meta = {
+        "version": _CACHE_VERSION,
+        "source": path.name,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "digest": digest or _file_digest(path),
+    }
+    arrays = {f"c{i}": df[col].to_numpy() for i, col in enumerate(df.columns)}
+    arrays["__columns__"] = np.array(list(df.columns))
+    arrays["__meta__"] = np.array(json.dumps(meta))
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # 先寫入暫存檔再換名，避免中斷時留下不完整的快取
+    tmp = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, cache_path)
+
+
+def load_price_csv(path, dtype=np.float64, cache=True, cache_dir=None):
+    """
+    讀取價格 CSV，優先使用同一行程內已載入的結果或磁碟上的 .npz 快取。
+
+    Args:
+        path (str | Path): CSV 檔案路徑，例如 "../data/TPE-5year.csv"。
+        dtype: 數值欄位的型別，np.float64（預設）或 np.float32。
+        cache (bool): 是否讀寫快取；設為 False 時每次都重新解析。
+        cache_dir (str | Path, optional): 快取目錄，預設為 CSV 同目錄下的 .cache/。
+
+    Returns:
+        pd.DataFrame: 欄位為 年月日 (datetime64) + 數值欄位的新 DataFrame，可自由修改。
+    """
+    path = Path(path)
+    if not cache:
+        return parse_price_csv(path, dtype)
+
+    stat = path.stat()
+    key = (str(path.resolve()), np.dtype(dtype).name)
+    hit = _loaded.get(key)
+    if hit is not None and hit[:2] == (stat.st_mtime_ns, stat.st_size):
+        return hit[2].copy()
+
+    cache_path = _cache_file(path, dtype, cache_dir)
+    df = _read_cache(cache_path, path, stat)
+    if df is None:
+        df = parse_price_csv(path, dtype)
+        try:
+            _write_cache(cache_path, df, path, stat)
+        except OSError:
+            pass  # 資料目錄唯讀時仍可正常使用，只是每次都需重新解析
+
+    _loaded[key] = (stat.st_mtime_ns, stat.st_size, df)
+    return df.copy()
@@ -0,0 +1,159 @@
+# 回撤分析
+# 由權益曲線 cus 計算每一段回撤（高點 → 谷底 → 回復）以及回撤期間相關的統計。
+# 所有函數都只對 cus 做常數次的向量化掃描（累計最大值、累計次數），沒有逐日的 Python 迴圈；
+# cus 可以是單一條曲線 (交易日,)，也可以是參數掃描的 (交易日 × N) 矩陣（逐欄計算）。
+#
+# 名詞：
+#   回撤          = 目前為止的最高權益 - 目前權益（以點數計，與「最大回撤 (MDD)」相同）
+#   水下          = 回撤 > 0 的交易日
+#   回撤期間      = 由高點到重新站回高點所經過的 K 棒數；尚未回復者計到最後一根 K 棒
+#   潰瘍指數      = 回撤的均方根（Ulcer Index），同時反映回撤的深度與持續時間
+#
+# cus 中的 NaN（例如資料缺口）與原本 pandas cummax / max 的行為相同：不影響之後的最高權益，
+# 當天的回撤為 NaN，不計入最大回撤、潰瘍指數與水下時間比例，也不算水下。
+
+import numpy as np
+import pandas as pd
+
+
+def drawdown_curve(cus, capital=None):
+    """
+    計算每日回撤。
+
+    Args:
+        cus (array-like): (交易日,) 或 (交易日 × N) 的權益曲線。
+        capital (float, optional): 初始資金；提供時回撤改以「佔最高權益（資金 + cus）的比例」表示。
+
+    Returns:
+        np.ndarray: 與 cus 同形狀的回撤（>= 0；cus 為 NaN 的交易日為 NaN）。
+    """
+    cus = np.asarray(cus, dtype=float)
+    # fmax 略過 NaN（與 pandas cummax 相同），NaN 不會讓之後的最高權益都變成 NaN
+    peak = np.fmax.accumulate(cus, axis=0)
+    drawdown = peak - cus
+    if capital is not None:
+        drawdown = drawdown / (capital + peak)
+    return drawdown
+
+
+def max_drawdown(cus):
+    """
+    計算權益曲線的最大回撤：當前最高點 - 當前權益 的最大值。
+    cus 可為 (交易日,) 或 (交易日 × N) 陣列；2-D 時逐欄計算。NaN 的交易日略過（全為 NaN 時為 NaN）。
+    """
+    cus = np.asarray(cus, dtype=float)
+    if len(cus) == 0:
+        return np.nan
+    return np.fmax.reduce(drawdown_curve(cus), axis=0)
+
+
+def _bars_under_water(drawdown):
+    """每根 K 棒距離上一次創高（回撤為 0）經過的 K 棒數。"""
+    bars = np.arange(len(drawdown)).reshape((-1,) + (1,) * (drawdown.ndim - 1))
+    last_peak = np.maximum.accumulate(np.where(drawdown > 0, 0, bars), axis=0)
+    return bars - last_peak
+
+
+def drawdown_stats(cus, capital=None):
+    """
+    計算回撤期間相關的統計，適用於單一權益曲線或參數掃描的矩陣。
+
+    Args:
+        cus (array-like): (交易日,) 或 (交易日 × N) 的權益曲線。
+        capital (float, optional): 初始資金；提供時最大回撤與潰瘍指數以比例表示。
+
+    Returns:
+        dict: 單一曲線時各值為純量，矩陣時為 (N,) 陣列：
+            - 最大回撤：最大的回撤深度。
+            - 最長回撤期間：最長一段由高點到回復（或到資料結束）的 K 棒數。
+            - 目前回撤期間：最後一根 K 棒距離上一次創高的 K 棒數（0 表示正在高點）。
+            - 潰瘍指數：回撤的均方根。
+            - 水下時間比例：回撤 > 0 的交易日比例。
+    """
+    cus = np.asarray(cus, dtype=float)
+    single = cus.ndim == 1
+    if single:
+        cus = cus[:, None]
+    if len(cus) == 0:
+        nan = np.full(cus.shape[1], np.nan)
+        stats = dict.fromkeys(["最大回撤", "最長回撤期間", "目前回撤期間", "潰瘍指數", "水下時間比例"], nan)
+    else:
+        drawdown = drawdown_curve(cus, capital)
+        under = drawdown > 0
+        valid = ~np.isnan(drawdown)
+        observed = valid.sum(axis=0)
+        duration = _bars_under_water(drawdown)
+        # 回復當天才結束一段回撤：每段最後一根水下 K 棒（之後即回復）再加 1 即為高點到回復的期間
+        span = duration.copy()
+        span[:-1] += under[:-1] & ~under[1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            stats = {
+                "最大回撤": np.fmax.reduce(drawdown, axis=0),
+                "最長回撤期間": span.max(axis=0),
+                "目前回撤期間": duration[-1],
+                "潰瘍指數": np.sqrt(np.where(valid, drawdown**2, 0.0).sum(axis=0) / observed),
+                "水下時間比例": under.sum(axis=0) / observed,
+            }
+    return {name: values[0] for name, values in stats.items()} if single else stats
+
+
+def drawdown_episodes(cus, index=None, capital=None):
+    """
+    列出單一權益曲線的每一段回撤。
+
+    Args:
+        cus (array-like | pd.Series): (交易日,) 的權益曲線；為 Series 時以其 index 標示日期。
+        index (array-like, optional): 與 cus 等長的日期（或任何標籤），優先於 Series 的 index。
+        capital (float, optional): 初始資金；提供時回撤深度以比例表示。
+
+    Returns:
+        pd.DataFrame: 每段回撤一列，依發生順序排列：
+            - 高點、谷底、回復：對應的標籤（未回復者的回復為 NaN / NaT）。
+            - 回撤深度：高點到谷底的回撤。
+            - 下跌期間：高點到谷底的 K 棒數。
+            - 回復期間：谷底到回復的 K 棒數（未回復者計到最後一根 K 棒）。
+            - 回撤期間：下跌期間 + 回復期間。
+            - 已回復：是否已重新站回高點。
+    """
+    if index is None:
+        index = cus.index if isinstance(cus, pd.Series) else np.arange(len(cus))
+    index = pd.Index(index)
+    cus = np.asarray(cus, dtype=float)
+    if cus.ndim != 1:
+        raise ValueError("drawdown_episodes 只接受單一條權益曲線；矩陣請使用 drawdown_stats")
+
+    drawdown = drawdown_curve(cus, capital)
+    under = drawdown > 0
+    # 每段連續的水下期間是一段回撤；第一根 K 棒的回撤必為 0，因此高點 = 起點前一根
+    begins = under & ~np.concatenate(([False], under[:-1]))
+    starts = np.flatnonzero(begins)
+    ends = np.flatnonzero(under & ~np.concatenate((under[1:], [False])))
+
+    # 每段的谷底：段內回撤最大的第一根 K 棒
+    if len(starts):
+        episode = np.cumsum(begins) - 1
+        depth = np.maximum.reduceat(drawdown, starts)
+        at_trough = np.flatnonzero(under & (drawdown == depth[episode]))
+        _, first = np.unique(episode[at_trough], return_index=True)
+        troughs = at_trough[first]
+    else:
+        depth = np.empty(0)
+        troughs = starts
+
+    peaks = starts - 1
+    last = len(cus) - 1
+    recovered = ends < last
+    recoveries = np.where(recovered, ends + 1, last)
+
+    return pd.DataFrame(
+        {
+            "高點": index[peaks],
+            "谷底": index[troughs],
+            "回復": index[recoveries].where(recovered),
+            "回撤深度": depth,
+            "下跌期間": troughs - peaks,
+            "回復期間": recoveries - troughs,
+            "回撤期間": recoveries - peaks,
+            "已回復": recovered,
+        }
+    )
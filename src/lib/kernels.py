@@ -0,0 +1,228 @@
+# 編譯核心（選用）：持倉狀態機與滾動指標的 Numba 版本
+# 狀態機的 position 取決於前一日的 position，無法以 pandas 向量化消除迴圈；
+# 安裝 numba 時，這裡的迴圈會以 JIT 編譯成機器碼，由 engine / technical_indicators 自動採用，
+# 未安裝時則沿用原本的 NumPy / pandas 實作（pip install numba 即可啟用）。
+#
+# 兩種實作的結果逐位元相同：
+#   - 狀態機核心的運算順序與 run_position_engine 完全一致。
+#   - 滾動平均 / 標準差依照 pandas rolling 的演算法（Kahan 補償的加減、滑動 Welford 變異數、
+#     連續相同值與正負號的修正）逐步計算。
+# 這裡的函數未編譯時也能以純 Python 執行（很慢），用來驗證與 NumPy / pandas 實作一致。
+# 編譯時不使用 fastmath，浮點數運算順序與 IEEE 捨入都不會改變。
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+_state = {"backend": "numba" if NUMBA_AVAILABLE else "numpy"}
+
+
+def set_backend(name):
+    """
+    選擇回測核心：「numba」或「numpy」。預設在安裝 numba 時使用 numba。
+
+    Args:
+        name (str): "numba" 或 "numpy"。
+    """
+    if name not in ("numba", "numpy"):
+        raise ValueError(f"未知的核心：{name}")
+    if name == "numba" and not NUMBA_AVAILABLE:
+        raise ImportError("numba 核心需要另外安裝 numba 套件：pip install numba")
+    _state["backend"] = name
+
+
+def get_backend():
+    """目前使用的回測核心名稱。"""
+    return _state["backend"]
+
+
+def use_kernels():
+    """是否使用編譯核心。"""
+    return _state["backend"] == "numba"
+
+
+def _jit(func):
+    """有 numba 時編譯成機器碼（結果快取在 __pycache__），否則原樣回傳。"""
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+@_jit
+def position_loop(
+    close, l_in, l_in_px, l_out, l_out_px, s_in, s_in_px, s_out, s_out_px, exit_first,
+    ret, cus, positions, exit_side, exit_entry_bar, exit_entry_price,
+):
+    """
+    持倉狀態機核心。所有輸入皆為 (交易日 × N) 陣列（可為 broadcast 的唯讀檢視），
+    結果寫入預先配置的 ret / cus / positions；出場日另外記下方向、進場 K 棒與進場價（平均成本），
+    供建立交易明細（未平倉的 K 棒 exit_side 為 0）。
+    """
+    L, N = ret.shape
+    for j in range(N):
+        position = 0
+        avg_cost = 0.0
+        cum_ret = 0.0
+        entry_bar = 0
+        for i in range(L):
+            # --- 進場邏輯（進場優先的策略）---
+            if not exit_first and position == 0:
+                if l_in[i, j]:
+                    avg_cost = l_in_px[i, j]
+                    position = 1
+                    entry_bar = i
+                elif s_in[i, j]:
+                    avg_cost = s_in_px[i, j]
+                    position = -1
+                    entry_bar = i
+
+            # --- 出場邏輯 ---
+            if position == 1 and l_out[i, j]:
+                r = l_out_px[i, j] - avg_cost
+                ret[i, j] = r
+                cum_ret += r
+                exit_side[i, j] = 1
+                exit_entry_bar[i, j] = entry_bar
+                exit_entry_price[i, j] = avg_cost
+                position = 0
+                avg_cost = 0.0
+            elif position == -1 and s_out[i, j]:
+                r = avg_cost - s_out_px[i, j]
+                ret[i, j] = r
+                cum_ret += r
+                exit_side[i, j] = -1
+                exit_entry_bar[i, j] = entry_bar
+                exit_entry_price[i, j] = avg_cost
+                position = 0
+                avg_cost = 0.0
+
+            # --- 進場邏輯（出場優先的策略）---
+            if exit_first and position == 0:
+                if l_in[i, j]:
+                    avg_cost = l_in_px[i, j]
+                    position = 1
+                    entry_bar = i
+                elif s_in[i, j]:
+                    avg_cost = s_in_px[i, j]
+                    position = -1
+                    entry_bar = i
+
+            # --- 每日結算與記錄 ---
+            if position == 1:
+                cus[i, j] = cum_ret + (close[i, j] - avg_cost)
+            elif position == -1:
+                cus[i, j] = cum_ret + (avg_cost - close[i, j])
+            else:
+                cus[i, j] = cum_ret
+            positions[i, j] = position
+
+
+@_jit
+def rolling_mean_loop(values, window, out):
+    """逐欄計算 window 日移動平均（與 pandas rolling(window).mean() 相同的演算法）。"""
+    L, M = values.shape
+    for m in range(M):
+        nobs = 0
+        neg_ct = 0
+        sum_x = 0.0
+        compensation_add = 0.0
+        compensation_remove = 0.0
+        same = 0
+        prev_value = values[0, m] if L else 0.0
+        for i in range(L):
+            # 移除離開視窗的值
+            if i >= window:
+                val = values[i - window, m]
+                if val == val:
+                    nobs -= 1
+                    y = -val - compensation_remove
+                    t = sum_x + y
+                    compensation_remove = t - sum_x - y
+                    sum_x = t
+                    if np.signbit(val):
+                        neg_ct -= 1
+            # 加入新值
+            val = values[i, m]
+            if val == val:
+                nobs += 1
+                y = val - compensation_add
+                t = sum_x + y
+                compensation_add = t - sum_x - y
+                sum_x = t
+                if np.signbit(val):
+                    neg_ct += 1
+                if val == prev_value:
+                    same += 1
+                else:
+                    same = 1
+                prev_value = val
+
+            if nobs >= window:
+                result = sum_x / nobs
+                if same >= nobs:
+                    result = prev_value
+                elif neg_ct == 0 and result < 0:
+                    result = 0.0
+                elif neg_ct == nobs and result > 0:
+                    result = 0.0
+                out[i, m] = result
+            else:
+                out[i, m] = np.nan
+
+
+@_jit
+def rolling_std_loop(values, window, ddof, out):
+    """逐欄計算 window 日滾動標準差（與 pandas rolling(window).std(ddof) 相同的演算法）。"""
+    L, M = values.shape
+    for m in range(M):
+        nobs = 0
+        mean_x = 0.0
+        ssqdm_x = 0.0
+        compensation_add = 0.0
+        compensation_remove = 0.0
+        same = 0
+        prev_value = values[0, m] if L else 0.0
+        for i in range(L):
+            # 移除離開視窗的值
+            if i >= window:
+                val = values[i - window, m]
+                if val == val:
+                    nobs -= 1
+                    if nobs:
+                        prev_mean = mean_x - compensation_remove
+                        y = val - compensation_remove
+                        t = y - mean_x
+                        compensation_remove = t + mean_x - y
+                        mean_x -= t / nobs
+                        ssqdm_x -= (val - prev_mean) * (val - mean_x)
+                    else:
+                        mean_x = 0.0
+                        ssqdm_x = 0.0
+            # 加入新值
+            val = values[i, m]
+            if val == val:
+                if val == prev_value:
+                    same += 1
+                else:
+                    same = 1
+                prev_value = val
+                nobs += 1
+                prev_mean = mean_x - compensation_add
+                y = val - compensation_add
+                t = y - mean_x
+                compensation_add = t + mean_x - y
+                mean_x += t / nobs
+                ssqdm_x += (val - prev_mean) * (val - mean_x)
+
+            if nobs >= window and nobs > ddof:
+                if nobs == 1 or same >= nobs:
+                    var = 0.0
+                else:
+                    var = ssqdm_x / (nobs - ddof)
+                out[i, m] = np.sqrt(var) if var >= 0 else 0.0
+            else:
+                out[i, m] = np.nan
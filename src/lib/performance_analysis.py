@@ -1,16 +1,14 @@
+import numpy as np
 import pandas as pd
 
+from lib.drawdown_analysis import drawdown_stats, max_drawdown
+
 
 # 計算策略績效
 def result_F(df):
     last = df["cus"].iloc[-1]
     count = df["sign"][df["sign"] != 0].count()
-
-    def maxdrawdown(s):
-        s = s.cummax() - s
-        return s.max()
-
-    mdd = maxdrawdown(df["cus"])
+    mdd = max_drawdown(df["cus"])
     w = df["ret"][df["ret"] > 0].count() / count if count > 0 else 0
     result = pd.DataFrame(
         {"最後報酬": [last], "交易次數": [count], "最大回損": [mdd], "勝率": [w]}
@@ -18,6 +16,125 @@ def result_F(df):
     return result
 
 
+def _longest_streak(hit, reset):
+    """
+    以累計次數計算最長連續 hit 的長度（run-length），reset 為中斷連續的事件，
+    其他（非交易日）不影響連續性。hit / reset 皆為 (交易日 × N) 布林陣列。
+    """
+    count = np.cumsum(hit, axis=0)
+    # 每次中斷時記下當時的累計次數，之後的連續長度 = 目前累計 - 最近一次中斷時的累計
+    base = np.maximum.accumulate(np.where(reset, count, 0), axis=0)
+    return (count - base).max(axis=0) if len(count) else np.zeros(hit.shape[1], dtype=int)
+
+
+def _performance_arrays(ret, cus, position=None, periods_per_year=252):
+    """計算績效指標，回傳 {指標名稱: (N,) 陣列}。參數見 calculate_performance_matrix。"""
+    ret = np.asarray(ret, dtype=float)
+    cus = np.asarray(cus, dtype=float)
+    if ret.ndim == 1:
+        ret, cus = ret[:, None], cus[:, None]
+        position = None if position is None else np.asarray(position)[:, None]
+    L, N = ret.shape
+
+    # === 已實現交易（ret 非零且非 NaN）===
+    win = ret > 0
+    loss = ret < 0
+    num_wins = win.sum(axis=0)
+    num_losses = loss.sum(axis=0)
+    total_trades = num_wins + num_losses
+    has_trades = total_trades > 0
+
+    total_profit = np.where(win, ret, 0.0).sum(axis=0)
+    total_loss = np.where(loss, ret, 0.0).sum(axis=0)
+    max_profit = np.where(win, ret, 0.0).max(axis=0, initial=0.0)
+    max_loss = np.where(loss, ret, 0.0).min(axis=0, initial=0.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        win_rate = np.where(has_trades, num_wins / total_trades, 0.0)
+        avg_profit = np.where(num_wins > 0, total_profit / num_wins, 0.0)
+        avg_loss = np.where(num_losses > 0, total_loss / num_losses, 0.0)
+        # 平均獲利 / |平均損失|，若無虧損則為無窮大；完全沒有交易時為 0
+        profit_loss_ratio = np.where(
+            avg_loss == 0, np.inf, np.abs(avg_profit / avg_loss)
+        )
+        profit_loss_ratio = np.where(has_trades, profit_loss_ratio, 0.0)
+
+    # === 權益曲線 ===
+    final_equity = cus[-1] if L else np.zeros(N)
+    drawdown = drawdown_stats(cus)
+    mdd = drawdown["最大回撤"]
+
+    # 每日權益變化（第一天相對於 0）
+    pnl = np.diff(cus, axis=0, prepend=0.0)
+    mean = pnl.mean(axis=0) if L else np.full(N, np.nan)
+    std = pnl.std(axis=0, ddof=1) if L > 1 else np.full(N, np.nan)
+    downside = np.sqrt((np.minimum(pnl, 0.0) ** 2).mean(axis=0)) if L else np.full(N, np.nan)
+    annual = np.sqrt(periods_per_year)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(std > 0, mean / std * annual, 0.0)
+        sortino = np.where(downside > 0, mean / downside * annual, 0.0)
+        calmar = np.where(
+            mdd > 0, mean * periods_per_year / mdd, np.where(mean > 0, np.inf, 0.0)
+        )
+
+    # === 持倉 ===
+    if position is None:
+        exposure = holding = np.full(N, np.nan)
+    else:
+        position = np.asarray(position)
+        held = position != 0
+        # 每段連續的同向持倉算一次（以收盤時的持倉判斷）
+        changed = np.diff(position, axis=0, prepend=0) != 0
+        num_holds = (held & changed).sum(axis=0)
+        exposure = held.mean(axis=0) if L else np.zeros(N)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            holding = np.where(num_holds > 0, held.sum(axis=0) / num_holds, 0.0)
+
+    return {
+        "最終權益 (Mark-to-Market)": final_equity,
+        "淨利或淨損 (已實現)": total_profit + total_loss,
+        "最大回撤 (MDD)": mdd,
+        "總獲利 (已實現)": total_profit,
+        "總損失 (已實現)": total_loss,
+        "總交易次數": total_trades,
+        "賺錢交易次數": num_wins,
+        "虧錢交易次數": num_losses,
+        "勝率": win_rate,
+        "單次交易最大獲利": max_profit,
+        "單次交易最大損失": max_loss,
+        "獲利交易中的平均獲利": avg_profit,
+        "損失交易中的平均損失": avg_loss,
+        "賺賠比": profit_loss_ratio,
+        "最長的連續性獲利的次數": _longest_streak(win, loss),
+        "最長的連續性損失的次數": _longest_streak(loss, win),
+        "夏普比率": sharpe,
+        "索提諾比率": sortino,
+        "卡瑪比率": calmar,
+        "持倉比例": exposure,
+        "平均持倉天數": holding,
+        "最長回撤期間": drawdown["最長回撤期間"],
+        "潰瘍指數": drawdown["潰瘍指數"],
+        "水下時間比例": drawdown["水下時間比例"],
+    }
+
+
+def calculate_performance_matrix(ret, cus, position=None, periods_per_year=252):
+    """
+    一次計算 N 條回測結果的績效指標（批次參數掃描使用，不對每組參數跑 Python 迴圈）。
+
+    Args:
+        ret (array-like): (交易日,) 或 (交易日 × N) 的已實現報酬（出場日非零）。
+        cus (array-like): 與 ret 同形狀的市值權益曲線。
+        position (array-like, optional): 與 ret 同形狀的持倉狀態；
+            未提供時「持倉比例」與「平均持倉天數」為 NaN。
+        periods_per_year (int): 年化時每年的交易日數。
+
+    Returns:
+        pd.DataFrame: 每條回測一列，欄位與 calculate_strategy_performance 的鍵相同，全部為數值。
+    """
+    return pd.DataFrame(_performance_arrays(ret, cus, position, periods_per_year))
+
+
 def calculate_strategy_performance(df_backtest_output: pd.DataFrame) -> dict:
     """
     從 backtest_strategy 函數的輸出 DataFrame 中計算詳細的績效指標。
@@ -28,125 +145,114 @@ def calculate_strategy_performance(df_backtest_output: pd.DataFrame) -> dict:
             必須包含以下欄位：
             - 'ret': 每筆交易的已實現報酬（進場為 0，出場時記錄盈虧）
             - 'cus': 累積市值權益曲線（Mark-to-Market 權益）
+            可選欄位：
+            - 'position': 持倉狀態，用於計算持倉比例與平均持倉天數
+            - 'cost': 逐日的交易成本（使用成本模型回測時），另回報「交易成本」總額
 
     Returns:
-        dict: 包含 16 項策略績效指標的字典，適用於交易策略評估與報告。
+        dict: 16 項策略績效指標，另加夏普、索提諾、卡瑪比率、持倉比例、平均持倉天數，
+            以及最長回撤期間、潰瘍指數與水下時間比例（見 drawdown_analysis），
+            全部為數值（勝率為 0～1 的比例）。
     """
+    position = df_backtest_output["position"] if "position" in df_backtest_output else None
+    metrics = _performance_arrays(df_backtest_output["ret"], df_backtest_output["cus"], position)
+    result = {name: values[0] for name, values in metrics.items()}
+    if "cost" in df_backtest_output:
+        result["交易成本"] = df_backtest_output["cost"].sum()
+    return result
+
+
+def _trade_streak(hit, lane, n_lanes):
+    """依 lane 分組計算交易序列中最長的連續 hit 次數；每個 lane 的第一筆交易重新起算。"""
+    count = np.cumsum(hit)
+    first = np.concatenate(([True], lane[1:] != lane[:-1]))
+    # 非 hit 的交易或新 lane 的開頭記下「不含本筆」的累計次數，之後的連續長度 = 目前累計 - 該值
+    base = np.maximum.accumulate(np.where(first | ~hit, count - hit, 0))
+    streak = np.zeros(n_lanes, dtype=np.int64)
+    np.maximum.at(streak, lane, count - base)
+    return streak
+
+
+def calculate_trade_performance(trades, n_lanes=None, costs=None):
+    """
+    由交易明細計算交易面的績效指標，計算量與交易筆數成正比（不需要逐日的 ret 欄位）。
+
+    與 calculate_strategy_performance 不同，損益為 0 的平手交易也算一筆交易
+    （計入總交易次數、勝率的分母，並中斷連續獲利 / 損失）。
+
+    Args:
+        trades (np.ndarray): engine.TRADE_DTYPE 結構陣列，
+            例如 backtest_strategy*(..., return_trades=True) 或 *_batch(..., return_trades=True) 的輸出。
+        n_lanes (int, optional): 參數組數；沒有任何交易的 lane 也會各有一列。
+            預設為交易明細中最大的 lane + 1。
+        costs (CostModel, optional): 回測時使用的成本模型；提供時另加手續費、交易稅、滑價、借券費的明細。
+
+    Returns:
+        pd.DataFrame: 每個 lane 一列（index 為 lane），全部為數值。
+            損益相關欄位為扣除成本後的淨額，「交易成本」為成本總額，「毛利 (未扣成本)」為扣除前的淨損益。
+    """
+    order = np.lexsort((trades["exit_bar"], trades["lane"]))
+    trades = trades[order]
+    lane = trades["lane"]
+    pnl = trades["pnl"]
+    if n_lanes is None:
+        n_lanes = int(lane.max()) + 1 if len(trades) else 1
+
+    def total(values=None):
+        return np.bincount(lane, weights=values, minlength=n_lanes)
+
+    win = pnl > 0
+    loss = pnl < 0
+    num_trades = total().astype(np.int64)
+    num_wins = total(win).astype(np.int64)
+    num_losses = total(loss).astype(np.int64)
+    total_profit = total(np.where(win, pnl, 0.0))
+    total_loss = total(np.where(loss, pnl, 0.0))
+    max_profit = np.zeros(n_lanes)
+    max_loss = np.zeros(n_lanes)
+    np.maximum.at(max_profit, lane, pnl)
+    np.minimum.at(max_loss, lane, pnl)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        win_rate = np.where(num_trades > 0, num_wins / num_trades, 0.0)
+        avg_profit = np.where(num_wins > 0, total_profit / num_wins, 0.0)
+        avg_loss = np.where(num_losses > 0, total_loss / num_losses, 0.0)
+        profit_loss_ratio = np.where(avg_loss == 0, np.inf, np.abs(avg_profit / avg_loss))
+        profit_loss_ratio = np.where(num_trades > 0, profit_loss_ratio, 0.0)
+        avg_bars_held = np.where(num_trades > 0, total(trades["bars_held"]) / num_trades, 0.0)
+
+    total_cost = total(trades["cost"])
+    cost_breakdown = {}
+    if costs is not None:
+        cost_breakdown = {name: total(values) for name, values in costs.trade_costs(trades).items()}
+
+    return pd.DataFrame(
+        {
+            "淨利或淨損 (已實現)": total_profit + total_loss,
+            "毛利 (未扣成本)": total_profit + total_loss + total_cost,
+            "交易成本": total_cost,
+            **cost_breakdown,
+            "總獲利 (已實現)": total_profit,
+            "總損失 (已實現)": total_loss,
+            "總交易次數": num_trades,
+            "賺錢交易次數": num_wins,
+            "虧錢交易次數": num_losses,
+            "平手交易次數": num_trades - num_wins - num_losses,
+            "做多交易次數": total(trades["side"] == 1).astype(np.int64),
+            "做空交易次數": total(trades["side"] == -1).astype(np.int64),
+            "勝率": win_rate,
+            "單次交易最大獲利": max_profit,
+            "單次交易最大損失": max_loss,
+            "獲利交易中的平均獲利": avg_profit,
+            "損失交易中的平均損失": avg_loss,
+            "賺賠比": profit_loss_ratio,
+            "最長的連續性獲利的次數": _trade_streak(win, lane, n_lanes),
+            "最長的連續性損失的次數": _trade_streak(loss, lane, n_lanes),
+            "平均持有K棒數": avg_bars_held,
+        },
+        index=pd.RangeIndex(n_lanes, name="lane"),
+    )
 
-    # === 步驟 1：提取已實現的交易盈虧（一進一出完成的交易）===
-    # 'ret' 欄位中非零值代表「完成一筆交易」的實際損益
-    # dropna() 確保移除任何可能的 NaN
-    trades = df_backtest_output["ret"][df_backtest_output["ret"] != 0].dropna()
-
-    # === 步驟 2：提取累積權益曲線，用於計算最大回撤 ===
-    cus_series = df_backtest_output["cus"]
-
-    # === 內部函數：計算最大回撤 (Maximum Drawdown, MDD) ===
-    def maxdrawdown(s: pd.Series) -> float:
-        """
-        計算權益曲線的最大回撤。
-        公式：當前最高點 - 當前權益 的最大值
-        """
-        peak = s.cummax()  # 到目前為止的最高權益
-        drawdown = peak - s  # 每期的回撤金額
-        return drawdown.max()  # 最大回撤值
-
-    mdd = maxdrawdown(cus_series)
-
-    # === 步驟 3：計算總交易次數 ===
-    total_trades = len(trades)
-
-    # === 特殊情況：若策略完全沒有交易，避免除以 0 錯誤 ===
-    if total_trades == 0:
-        return {
-            "最終權益 (Mark-to-Market)": (
-                cus_series.iloc[-1] if not cus_series.empty else 0
-            ),  # 若有持倉，顯示最終市值；否則為 0
-            "淨利或淨損 (已實現)": 0,
-            "最大回撤 (MDD)": mdd,
-            "總交易次數": 0,
-            "勝率": "0.00%",
-            "總獲利 (已實現)": 0,
-            "總損失 (已實現)": 0,
-            "賺錢交易次數": 0,
-            "虧錢交易次數": 0,
-            "單次交易最大獲利": 0,
-            "單次交易最大損失": 0,
-            "獲利交易中的平均獲利": 0,
-            "損失交易中的平均損失": 0,
-            "賺賠比": 0,
-            "最長的連續性獲利的次數": 0,
-            "最長的連續性損失的次數": 0,
-        }
-
-    # === 步驟 4：分類獲利與虧損交易 ===
-    winning_trades = trades[trades > 0]  # 賺錢的交易
-    losing_trades = trades[trades < 0]  # 虧錢的交易
-
-    # === 步驟 5：計算總獲利與總損失 ===
-    total_profit = winning_trades.sum()  # 所有正報酬加總
-    total_loss = losing_trades.sum()  # 所有負報酬加總（結果為負）
-
-    # === 步驟 6：交易次數統計 ===
-    num_winning_trades = len(winning_trades)
-    num_losing_trades = len(losing_trades)
-
-    # === 步驟 7：勝率計算（格式化為百分比）===
-    win_rate = num_winning_trades / total_trades
-
-    # === 步驟 8：單筆極值 ===
-    max_profit_trade = winning_trades.max() if not winning_trades.empty else 0
-    max_loss_trade = (
-        losing_trades.min() if not losing_trades.empty else 0
-    )  # 最小值即最大損失
-
-    # === 步驟 9：平均獲利與平均損失 ===
-    avg_profit = total_profit / num_winning_trades if num_winning_trades > 0 else 0
-    avg_loss = total_loss / num_losing_trades if num_losing_trades > 0 else 0  # 負值
-
-    # === 步驟 10：賺賠比（Profit Factor）===
-    # 平均獲利 / |平均損失|，若無虧損則為無窮大
-    if avg_loss == 0:
-        profit_loss_ratio = float("inf")
-    else:
-        profit_loss_ratio = abs(avg_profit / avg_loss)
-
-    # === 步驟 11：計算最長連勝與最長連輸（Streak Analysis）===
-    longest_win_streak = longest_loss_streak = 0
-    current_win_streak = current_loss_streak = 0
-
-    for trade_return in trades:
-        if trade_return > 0:
-            current_win_streak += 1
-            current_loss_streak = 0
-        elif trade_return < 0:
-            current_loss_streak += 1
-            current_win_streak = 0
-
-        # 更新歷史最長紀錄
-        longest_win_streak = max(longest_win_streak, current_win_streak)
-        longest_loss_streak = max(longest_loss_streak, current_loss_streak)
-
-    # === 步驟 12：組裝並回傳績效指標字典 ===
-    metrics = {
-        "最終權益 (Mark-to-Market)": cus_series.iloc[
-            -1
-        ],  # 回測結束時的總資產（含未平倉）
-        "淨利或淨損 (已實現)": trades.sum(),  # 所有已實現交易的淨損益
-        "最大回撤 (MDD)": mdd,  # 權益曲線最大跌幅
-        "總獲利 (已實現)": total_profit,  # 所有賺錢交易總和
-        "總損失 (已實現)": total_loss,  # 所有虧錢交易總和（負數）
-        "總交易次數": total_trades,  # 進出場總次數
-        "賺錢交易次數": num_winning_trades,  # 獲利交易筆數
-        "虧錢交易次數": num_losing_trades,  # 虧損交易筆數
-        "勝率": f"{win_rate:.2%}",  # 勝率（例如：66.67%）
-        "單次交易最大獲利": max_profit_trade,  # 單筆最高獲利
-        "單次交易最大損失": max_loss_trade,  # 單筆最大損失
-        "獲利交易中的平均獲利": avg_profit,  # 每次贏平均賺多少
-        "損失交易中的平均損失": avg_loss,  # 每次輸平均虧多少（負值）
-        "賺賠比": profit_loss_ratio,  # 平均獲利 / |平均損失|
-        "最長的連續性獲利的次數": longest_win_streak,  # 最大連勝次數
-        "最長的連續性損失的次數": longest_loss_streak,  # 最大連輸次數
-    }
 
-    return metrics
+# 單筆績效函數 → 批次版本（供參數掃描一次計算 N 組結果）
+BATCH_PERFORMANCE = {calculate_strategy_performance: calculate_performance_matrix}
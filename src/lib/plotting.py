@@ -4,6 +4,8 @@ import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
 import platform
 
+from lib.data_loader import load_price_csv
+
 
 # 通用中文字體設定函數
 def get_chinese_font(size=12):
@@ -128,20 +130,15 @@ def plot_strategy_results(df: pd.DataFrame, title: str, indicators: list):
 def plot_kline_from_csv(filepath: str, title: str = "價格走勢圖", show_volume: bool = False):
     """
     根據檔案路徑讀取 CSV，繪製收盤價走勢圖，可選是否顯示成交量圖。
-    CSV 欄位需包含：年月日, 開盤價, 最高價, 最低價, 收盤價, 成交量
+    CSV 欄位需包含：年月日（或日期）, 開盤價, 最高價, 最低價, 收盤價, 成交量
     """
     import pandas as pd
     import matplotlib.pyplot as plt
     import matplotlib.font_manager as fm
     import platform
 
-    # --- 讀取資料 ---
-    df = pd.read_csv(filepath)
-
-    # 若包含 "年月日"，轉為 datetime 並設為 index
-    if "年月日" in df.columns:
-        df["年月日"] = pd.to_datetime(df["年月日"])
-        df.set_index("年月日", inplace=True)
+    # --- 讀取資料（經由 load_price_csv 的快取，日期已轉為 datetime）---
+    df = load_price_csv(filepath).set_index("年月日")
 
     # --- 設定中文字體 ---
     system = platform.system()
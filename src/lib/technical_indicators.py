@@ -1,7 +1,353 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from lib import kernels
+
+
+# === 指標快取 ===
+# 參數掃描時同一段價格、同一組參數的指標（例如 bb_period=20 的布林通道）會被重複計算上百次。
+# 這裡以 (價格指紋, 指標名稱, 參數) 為鍵快取計算結果，並以 LRU 方式限制總記憶體用量。
+# 快取是模組層級的，同一個行程中的所有回測模組共用；平行掃描時每個子行程各有一份，
+# 並在該子行程處理的所有任務之間共用。快取的陣列皆為唯讀。
+
+_cache = OrderedDict()
+_cache_state = {"hits": 0, "misses": 0, "bytes": 0, "max_bytes": 256 * 1024 * 1024}
+
+
+def price_fingerprint(close):
+    """
+    計算價格序列的指紋（內容雜湊 + dtype + 長度），作為指標快取的鍵。
+    內容相同的序列（例如 df.copy() 之後）會得到相同的指紋。
+    """
+    values = np.ascontiguousarray(close)
+    digest = hashlib.blake2b(values.data, digest_size=16).hexdigest()
+    return f"{digest}:{values.dtype.str}:{len(values)}"
+
+
+def cached_indicator(fingerprint, name, params, compute):
+    """
+    取得快取中的指標陣列；若不存在則呼叫 compute() 計算後存入快取。
+
+    Args:
+        fingerprint (str): price_fingerprint 的結果。
+        name (str): 指標名稱。
+        params (tuple): 指標參數。
+        compute (function): 無參數函數，回傳指標的 np.ndarray。
+
+    Returns:
+        np.ndarray: 唯讀的指標陣列。
+    """
+    key = (fingerprint, name, params)
+    values = _cache.get(key)
+    if values is not None:
+        _cache.move_to_end(key)
+        _cache_state["hits"] += 1
+        return values
+
+    _cache_state["misses"] += 1
+    values = np.asarray(compute())
+    values.flags.writeable = False
+    if values.nbytes <= _cache_state["max_bytes"]:
+        _cache[key] = values
+        _cache_state["bytes"] += values.nbytes
+        _evict()
+    return values
+
+
+def _evict():
+    while _cache_state["bytes"] > _cache_state["max_bytes"]:
+        _, values = _cache.popitem(last=False)
+        _cache_state["bytes"] -= values.nbytes
+
+
+def indicator_cache_info():
+    """回傳指標快取的統計：命中次數、未命中次數、項目數、目前與上限的位元組數。"""
+    return {
+        "hits": _cache_state["hits"],
+        "misses": _cache_state["misses"],
+        "entries": len(_cache),
+        "bytes": _cache_state["bytes"],
+        "max_bytes": _cache_state["max_bytes"],
+    }
+
+
+def clear_indicator_cache():
+    """清空指標快取並重設統計。"""
+    _cache.clear()
+    _cache_state.update(hits=0, misses=0, bytes=0)
+
+
+def set_indicator_cache_limit(max_bytes):
+    """設定指標快取的記憶體上限（位元組）；設為 0 即停用快取。"""
+    _cache_state["max_bytes"] = int(max_bytes)
+    _evict()
+
+
+# === 指標庫（前綴和）===
+# 參數掃描要同時用到數十種週期的移動平均 / 標準差，逐一以 rolling 計算時每種週期都要完整掃過價格一次。
+# 指標庫改以累積和一次算出所有週期：視窗 [s, e] 的和 = 前綴和[e] - 前綴和[s-1]，
+# 每多一種週期只多幾個長度為交易日數的陣列運算。
+# 直接對整段價格做累積和會讓數值愈加愈大，相減時損失精度（標準差的 Σx² - (Σx)²/n 尤其嚴重），
+# 因此採用分塊、平移的累積和：
+#   - 價格切成長度 B（≥ 週期的最小 2 的冪次）的區塊，每一塊只對「前一塊 + 本塊」累積，
+#     結束於本塊的視窗都落在這 2B 日之內，累積和最多只有 2B 項。
+#   - 累積前先減去本塊第一個價格，Σ(x-基準)² 只反映視窗附近的價格變動，
+#     變異數 (Σy² - (Σy)²/n) / (n-1) 不會因為價格本身的大小而失去有效位數。
+#   - 視窗內價格全部相同時，平均直接取該價格、標準差為 0（與 pandas 相同）；負的變異數截為 0。
+# 每個週期的結果只取決於價格與該週期，與同時計算哪些週期無關；
+# 與 pandas rolling 的差異在 1e-12（相對誤差）等級，但不逐位元相同，
+# 剛好落在均線上的價格可能判定不同。預設仍使用 rolling，set_indicator_method("bank") 後
+# 單次回測、批次回測與投資組合的滾動指標都改由指標庫計算，彼此仍逐位元相同。
+
+_method_state = {"method": "rolling"}
+
+
+def set_indicator_method(name):
+    """
+    選擇滾動平均 / 標準差的計算方式：「rolling」（pandas rolling 或編譯核心）或「bank」（指標庫）。
+    切換時清空指標快取。平行掃描的子行程以 fork 啟動時沿用目前的設定。
+
+    Args:
+        name (str): "rolling" 或 "bank"。
+    """
+    if name not in ("rolling", "bank"):
+        raise ValueError(f"未知的指標計算方式：{name}")
+    if name != _method_state["method"]:
+        # 快取中的 rolling_mean / rolling_std 是以原本的方式計算的
+        clear_indicator_cache()
+    _method_state["method"] = name
+
+
+def get_indicator_method():
+    """目前使用的滾動指標計算方式。"""
+    return _method_state["method"]
+
+
+def _block_sums(values, block, squares):
+    """
+    分塊、平移的累積和。第 b 塊的累積和涵蓋前一塊與本塊（共 2 × block 日），
+    以本塊第一個有效價格為基準；整塊都是 NaN 時沿用前一塊的基準。
+
+    Returns:
+        tuple: (基準值 (塊數,), [Σ(x-基準) 的累積和, （squares 時）Σ(x-基準)² 的累積和])，
+        累積和皆為 (塊數 × (2 × block + 1)) 矩陣，第 0 欄為 0（不含任何一日）。
+    """
+    n = len(values)
+    blocks = -(-n // block)
+    padded = np.full((blocks + 1) * block, np.nan)
+    padded[block : block + n] = values
+    table = padded[block:].reshape(blocks, block)
+    valid = ~np.isnan(table)
+    ref = table[np.arange(blocks), valid.argmax(axis=1)]
+    last = np.maximum.accumulate(np.where(valid.any(axis=1), np.arange(blocks), -1))
+    ref = np.where(last >= 0, ref[np.maximum(last, 0)], 0.0)
+    frames = np.lib.stride_tricks.sliding_window_view(padded, 2 * block)[::block]
+    shifted = np.nan_to_num(frames - ref[:, None], nan=0.0)
+    powers = [shifted, shifted * shifted] if squares else [shifted]
+    sums = []
+    for term in powers:
+        total = np.zeros((blocks, 2 * block + 1))
+        np.cumsum(term, axis=1, out=total[:, 1:])
+        sums.append(total)
+    return ref, sums
+
+
+def _window_sums(sums, block, window):
+    """
+    每一日往前 window 日（含當日）以所在區塊的基準平移後的 Σ 與 Σ²，回傳 (塊數 × block) 矩陣。
+    window 不超過 block，視窗一定落在「前一塊 + 本塊」之內，
+    起點與終點在每一塊累積和中的位置都相同，只需兩個切片相減。
+    """
+    _, powers = sums
+    return [
+        total[:, block + 1 :] - total[:, block + 1 - window : 2 * block + 1 - window]
+        for total in powers
+    ]
+
+
+def _prefix_rolling(values, windows, kind, ddof=1):
+    """
+    以分塊前綴和計算一維價格序列多種週期的滾動平均 / 標準差。
+
+    Returns:
+        np.ndarray: (交易日 × 週期) 矩陣，視窗不足或含 NaN 的位置為 NaN。
+    """
+    values = np.asarray(values, dtype=float)
+    windows = np.asarray(windows, dtype=int).reshape(-1)
+    if len(windows) and windows.min() < 1:
+        raise ValueError("週期至少為 1")
+    n = len(values)
+    # 逐週期寫入 (週期 × 交易日) 的列，最後轉置成 (交易日 × 週期)
+    out = np.full((len(windows), n), np.nan)
+    missing = np.concatenate(([0], np.cumsum(np.isnan(values))))
+    # 到每一日為止連續相同價格的天數
+    index = np.arange(n)
+    changed = np.ones(n, dtype=bool)
+    changed[1:] = values[1:] != values[:-1]
+    run = index - np.maximum.accumulate(np.where(changed, index, 0)) + 1
+    longest_run = run.max(initial=0)
+    squares = kind == "std"
+    sums = {}
+    for k, window in enumerate(windows.tolist()):
+        if window > n or (squares and window <= ddof):
+            continue
+        block = 1 << (window - 1).bit_length()
+        if block not in sums:
+            sums[block] = _block_sums(values, block, squares)
+        ref, _ = sums[block]
+        window_sums = _window_sums(sums[block], block, window)
+        if squares:
+            s1, s2 = window_sums
+            result = np.sqrt(np.maximum((s2 - s1 * s1 / window) / (window - ddof), 0.0))
+        else:
+            result = ref[:, None] + window_sums[0] / window
+        row = out[k, window - 1 :]
+        row[:] = result.reshape(-1)[window - 1 : n]
+        if longest_run >= window:
+            constant = run[window - 1 :] >= window
+            row[constant] = 0.0 if squares else values[window - 1 :][constant]
+        if missing[-1]:
+            row[missing[window:] - missing[: n - window + 1] > 0] = np.nan
+    return out.T
+
+
+def indicator_bank(close, windows, kind="mean", fingerprint=None):
+    """
+    一次計算多種週期的滾動平均或標準差（經由快取），回傳 (交易日 × 週期) 矩陣，
+    第 k 欄為 windows[k] 日的指標。
+
+    Args:
+        close (pd.Series): 收盤價。
+        windows (array-like of int): 週期，例如 range(2, 61)。
+        kind (str): "mean" 或 "std"（樣本標準差，與 rolling().std() 相同）。
+        fingerprint (str, optional): price_fingerprint(close) 的結果。
+
+    Returns:
+        np.ndarray: 唯讀的 (交易日 × 週期) 矩陣。
+    """
+    if kind not in ("mean", "std"):
+        raise ValueError(f"未知的指標：{kind}")
+    windows = tuple(int(w) for w in np.asarray(windows).reshape(-1))
+    fingerprint = fingerprint or price_fingerprint(close)
+    return cached_indicator(
+        fingerprint, f"bank_{kind}", windows,
+        lambda: _prefix_rolling(close, windows, kind),
+    )
+
+
+def _bank_columns(close, periods, kind, fingerprint=None):
+    """以指標庫取得 periods 各週期的指標；涵蓋 min..max 的整段週期，掃描的每一批都能共用快取。"""
+    periods = np.asarray(periods, dtype=int)
+    if periods.size == 0:
+        return np.empty((len(close), 0))
+    low = int(periods.min())
+    table = indicator_bank(close, range(low, int(periods.max()) + 1), kind, fingerprint)
+    return table[:, periods - low]
+
+
+def _rolling(close, period, kind):
+    """
+    以 pandas rolling 計算 (交易日,) 或 (交易日 × 代號) 的滾動平均 / 標準差；
+    啟用編譯核心時改用 lib.kernels 中演算法相同的版本（結果逐位元相同），
+    選用指標庫時改以分塊前綴和計算。
+    """
+    period = int(period)
+    if _method_state["method"] == "bank":
+        values = np.asarray(close, dtype=float)
+        table = values.reshape(len(values), -1)
+        out = np.column_stack([_prefix_rolling(column, [period], kind) for column in table.T])
+        return out.reshape(values.shape)
+    if kernels.use_kernels():
+        values = np.asarray(close, dtype=float)
+        table = values.reshape(len(values), -1)
+        out = np.empty(table.shape)
+        if kind == "mean":
+            kernels.rolling_mean_loop(table, period, out)
+        else:
+            kernels.rolling_std_loop(table, period, 1, out)
+        return out.reshape(values.shape)
+    if not isinstance(close, pd.Series):
+        close = pd.DataFrame(close)
+    return getattr(close.rolling(period), kind)().to_numpy(dtype=float)
+
+
+def rolling_mean(close, period, fingerprint=None):
+    """取得收盤價的 N 日移動平均（經由快取）。close 為 pd.Series。"""
+    fingerprint = fingerprint or price_fingerprint(close)
+    return cached_indicator(
+        fingerprint, "rolling_mean", (int(period),),
+        lambda: _rolling(close, period, "mean"),
+    )
+
+
+def rolling_std(close, period, fingerprint=None):
+    """取得收盤價的 N 日滾動標準差（經由快取）。close 為 pd.Series。"""
+    fingerprint = fingerprint or price_fingerprint(close)
+    return cached_indicator(
+        fingerprint, "rolling_std", (int(period),),
+        lambda: _rolling(close, period, "std"),
+    )
+
+
+# === 不修改輸入的指標函數 ===
+# 以下函數只讀取收盤價序列 (pd.Series)，回傳獨立的 np.ndarray，不會在傳入的 DataFrame 上新增欄位。
+# 回測與參數掃描應使用這一組；下方的 calc_* 系列保留原本「寫入 df 並回傳 df」的行為。
+
+def bollinger_bands(close, n=20, k=2, fingerprint=None):
+    """
+    計算布林帶。
+
+    Returns:
+        tuple[np.ndarray, ...]: (中線, 標準差, 上軌, 下軌)
+    """
+    fingerprint = fingerprint or price_fingerprint(close)
+    mid = rolling_mean(close, n, fingerprint)
+    std = rolling_std(close, n, fingerprint)
+    return mid, std, mid + k * std, mid - k * std
+
+
+def previous_gain(close):
+    """計算每日相對前一日的漲幅（close 可為 (交易日,) 或 (交易日 × 代號) 陣列）。"""
+    values = np.asarray(close, dtype=float)
+    gain = np.full(values.shape, np.nan)
+    gain[1:] = (values[1:] - values[:-1]) / values[:-1]
+    return gain
+
+
+def bias(close, period=20, fingerprint=None):
+    """計算乖離率 (收盤價 vs. N日均線)，單位為百分比。"""
+    ma = rolling_mean(close, period, fingerprint)
+    return (np.asarray(close, dtype=float) - ma) / ma * 100
+
+
+def relative_strength_index(close, period=14, fingerprint=None):
+    """計算 N 日 RSI（100 - 100 / (1 + RS)）。"""
+    def compute():
+        x = close.diff()
+        epsilon = 1e-10
+
+        gain = x.where(x > 0, 0)
+        loss = -x.where(x < 0, 0)
+
+        avg_gain = gain.rolling(period).mean()
+        avg_loss = loss.rolling(period).mean()
+
+        rs = avg_gain / (avg_loss + epsilon)
+
+        return (100 - (100 / (1 + rs))).to_numpy(dtype=float)
+
+    fingerprint = fingerprint or price_fingerprint(close)
+    return cached_indicator(fingerprint, "RSI14", (int(period),), compute)
+
+
 # 計算 MA
 def MA(s, l, df):
-    df["ma_s"] = df["收盤價"].rolling(s).mean()
-    df["ma_l"] = df["收盤價"].rolling(l).mean()
+    fingerprint = price_fingerprint(df["收盤價"])
+    df["ma_s"] = rolling_mean(df["收盤價"], s, fingerprint)
+    df["ma_l"] = rolling_mean(df["收盤價"], l, fingerprint)
     df["ma_sign"] = 0
     df.loc[
         (df["ma_s"].shift(1) < df["ma_l"].shift(1)) & (df["ma_s"] >= df["ma_l"]),
@@ -15,13 +361,17 @@ def MA(s, l, df):
 
 # 計算 RSI
 def RSI(d, df):
-    x = df["收盤價"].diff()
-    epsilon = 1e-10
-    df["rsi"] = (
-        100
-        * x.where(x > 0, 0).rolling(d).mean()
-        / (x.where(x > 0, -x).rolling(d).mean() + epsilon)
-    )
+    def compute():
+        x = df["收盤價"].diff()
+        epsilon = 1e-10
+        rsi = (
+            100
+            * x.where(x > 0, 0).rolling(d).mean()
+            / (x.where(x > 0, -x).rolling(d).mean() + epsilon)
+        )
+        return rsi.to_numpy(dtype=float)
+
+    df["rsi"] = cached_indicator(price_fingerprint(df["收盤價"]), "RSI", (int(d),), compute)
     df["rsi_sign"] = 0
     df.loc[df["rsi"] < 20, "rsi_sign"] = 1
     df.loc[df["rsi"] > 80, "rsi_sign"] = -1
@@ -32,7 +382,7 @@ def calc_ma(df, period):
     Calculates the moving average for a given period.
     """
     col_name = f'MA{period}'
-    df[col_name] = df['收盤價'].rolling(period).mean()
+    df[col_name] = rolling_mean(df['收盤價'], period)
     return df
 
 
@@ -41,7 +391,7 @@ def calc_MA5(df, period=5):
     """
     計算五日均線
     """
-    df["MA5"] = df["收盤價"].rolling(period).mean()
+    df["MA5"] = rolling_mean(df["收盤價"], period)
     return df
 
 
@@ -50,10 +400,9 @@ def calc_Bollinger(df, n=20, k=2):
     """
     計算布林帶
     """
-    df["BB_MA"] = df["收盤價"].rolling(n).mean()
-    df["BB_STD"] = df["收盤價"].rolling(n).std()
-    df["BB_Upper"] = df["BB_MA"] + k * df["BB_STD"]
-    df["BB_Lower"] = df["BB_MA"] - k * df["BB_STD"]
+    df["BB_MA"], df["BB_STD"], df["BB_Upper"], df["BB_Lower"] = bollinger_bands(
+        df["收盤價"], n=n, k=k
+    )
     return df
 
 
@@ -62,7 +411,7 @@ def calc_prev_gain(df):
     """
     計算昨天漲幅
     """
-    df["prev_gain"] = (df["收盤價"] - df["收盤價"].shift(1)) / df["收盤價"].shift(1)
+    df["prev_gain"] = previous_gain(df["收盤價"])
     return df
 
 
@@ -71,7 +420,7 @@ def calc_MA20(df, period=20):
     """
     計算二十日均線
     """
-    df["MA20"] = df["收盤價"].rolling(period).mean()
+    df["MA20"] = rolling_mean(df["收盤價"], period)
     return df
 
 
@@ -83,7 +432,7 @@ def calc_Bias(df, period=20):
     ma_col = f'MA{period}'
     if ma_col not in df.columns:
         # 如果均線不存在，先計算它
-        df[ma_col] = df["收盤價"].rolling(period).mean()
+        df[ma_col] = rolling_mean(df["收盤價"], period)
     
     df['Bias'] = (df['收盤價'] - df[ma_col]) / df[ma_col] * 100 # 乘以100變成百分比
     return df
@@ -94,7 +443,7 @@ def calc_MA3(df, period=3):
     """
     計算三日均線
     """
-    df["MA3"] = df["收盤價"].rolling(period).mean()
+    df["MA3"] = rolling_mean(df["收盤價"], period)
     return df
 
 
@@ -103,7 +452,7 @@ def calc_MA10(df, period=10):
     """
     計算十日均線
     """
-    df["MA10"] = df["收盤價"].rolling(period).mean()
+    df["MA10"] = rolling_mean(df["收盤價"], period)
     return df
 
 
@@ -112,16 +461,53 @@ def calc_RSI14(df, period=14):
     """
     計算14日RSI
     """
-    x = df["收盤價"].diff()
-    epsilon = 1e-10
-    
-    gain = x.where(x > 0, 0)
-    loss = -x.where(x < 0, 0)
-    
-    avg_gain = gain.rolling(period).mean()
-    avg_loss = loss.rolling(period).mean()
-    
-    rs = avg_gain / (avg_loss + epsilon)
-    
-    df["RSI14"] = 100 - (100 / (1 + rs))
+    df["RSI14"] = relative_strength_index(df["收盤價"], period)
     return df
+
+
+# 🔢 多組週期的移動平均矩陣（供批次參數掃描使用）
+def calc_ma_matrix(df, periods, fingerprint=None):
+    """
+    計算多組週期的移動平均，回傳 (交易日 × 參數組) 矩陣。
+    相同的週期只計算一次，結果與 calc_ma 逐位元相同；選用指標庫時改從指標庫取出對應的欄。
+    fingerprint 為收盤價的 price_fingerprint，已經算過時傳入以免重新雜湊。
+    """
+    periods = np.asarray(periods, dtype=int)
+    close = df["收盤價"]
+    fingerprint = fingerprint or price_fingerprint(close)
+    if _method_state["method"] == "bank":
+        return _bank_columns(close, periods, "mean", fingerprint)
+    unique, inverse = np.unique(periods, return_inverse=True)
+    table = np.column_stack([rolling_mean(close, p, fingerprint) for p in unique])
+    return table[:, inverse]
+
+
+# 🔢 多組週期的滾動標準差矩陣（供批次參數掃描使用）
+def calc_std_matrix(df, periods, fingerprint=None):
+    """
+    計算多組週期的滾動標準差，回傳 (交易日 × 參數組) 矩陣。
+    相同的週期只計算一次，結果與 calc_Bollinger 的 BB_STD 逐位元相同；選用指標庫時改從指標庫取出對應的欄。
+    fingerprint 同 calc_ma_matrix。
+    """
+    periods = np.asarray(periods, dtype=int)
+    close = df["收盤價"]
+    fingerprint = fingerprint or price_fingerprint(close)
+    if _method_state["method"] == "bank":
+        return _bank_columns(close, periods, "std", fingerprint)
+    unique, inverse = np.unique(periods, return_inverse=True)
+    table = np.column_stack([rolling_std(close, p, fingerprint) for p in unique])
+    return table[:, inverse]
+
+
+# 🔢 多檔股票的滾動指標（交易日 × 代號，供投資組合回測使用）
+def rolling_mean_panel(close, period):
+    """
+    計算 (交易日 × 代號) 收盤價矩陣每一欄的 N 日移動平均。
+    每一欄的結果與該檔股票單獨呼叫 rolling_mean 逐位元相同。
+    """
+    return _rolling(close, period, "mean")
+
+
+def rolling_std_panel(close, period):
+    """計算 (交易日 × 代號) 收盤價矩陣每一欄的 N 日滾動標準差。"""
+    return _rolling(close, period, "std")
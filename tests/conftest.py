@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+# 程式碼以 src/ 為根目錄匯入（與 notebook 相同：from lib.backtest ... import ...）
+sys.path.insert(0, str(ROOT / "src"))
+
+
+@pytest.fixture
+def engine_path(request):
+    """
+    切換回測引擎的執行路徑：「event」（事件驅動）、「bar」（逐日）或「kernel」（Numba 編譯核心），
+    結束後還原成原本的設定，並清空指標快取。
+    """
+    from lib import kernels
+    from lib.backtest import engine
+    from lib.technical_indicators import clear_indicator_cache
+
+    path = request.param
+    if path == "kernel" and not kernels.NUMBA_AVAILABLE:
+        pytest.skip("未安裝 numba")
+    backend, mode = kernels.get_backend(), engine.get_engine_mode()
+    kernels.set_backend("numba" if path == "kernel" else "numpy")
+    engine.set_engine_mode("bar" if path == "bar" else "event")
+    clear_indicator_cache()
+    yield path
+    kernels.set_backend(backend)
+    engine.set_engine_mode(mode)
+    clear_indicator_cache()
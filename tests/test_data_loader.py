@@ -0,0 +1,40 @@
+import os
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+from lib import data_loader
+from lib.data_loader import load_price_csv
+
+SAMPLE = Path(__file__).resolve().parents[1] / "data" / "TPE-sample1.csv"
+
+
+def test_touched_source_is_hashed_once(tmp_path, monkeypatch):
+    path = tmp_path / SAMPLE.name
+    shutil.copyfile(SAMPLE, path)
+    first = load_price_csv(path)
+
+    digests = []
+    real_digest = data_loader._file_digest
+    monkeypatch.setattr(
+        data_loader, "_file_digest", lambda p: digests.append(p) or real_digest(p)
+    )
+    # 只改修改時間（例如 touch / git checkout），內容不變
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    for _ in range(3):
+        data_loader._loaded.clear()
+        pd.testing.assert_frame_equal(load_price_csv(path), first)
+    # 第一次以雜湊確認內容相同並更新快取，之後直接依修改時間命中
+    assert len(digests) == 1
+
+
+def test_changed_source_is_reparsed(tmp_path):
+    path = tmp_path / SAMPLE.name
+    shutil.copyfile(SAMPLE, path)
+    first = load_price_csv(path)
+    lines = path.read_text(encoding="utf-8-sig").splitlines(keepends=True)
+    path.write_text("".join(lines[:-1]), encoding="utf-8-sig")
+    data_loader._loaded.clear()
+    assert len(load_price_csv(path)) == len(first) - 1
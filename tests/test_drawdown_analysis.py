@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from lib.drawdown_analysis import drawdown_stats, max_drawdown
+
+
+def _pandas_mdd(cus):
+    # 原本 performance_analysis 的算法：cummax 與 max 都略過 NaN
+    s = pd.Series(cus)
+    return (s.cummax() - s).max()
+
+
+def test_max_drawdown_skips_nan_like_pandas():
+    rng = np.random.default_rng(0)
+    cus = np.cumsum(rng.normal(0, 1, 200))
+    gaps = cus.copy()
+    gaps[[0, 1, 50, 51, 120]] = np.nan
+    for curve in (cus, gaps, np.full(5, np.nan)):
+        expected = _pandas_mdd(curve)
+        np.testing.assert_equal(max_drawdown(curve), expected)
+    # 2-D 時逐欄計算，NaN 只影響所在的欄
+    matrix = np.column_stack([cus, gaps])
+    np.testing.assert_array_equal(max_drawdown(matrix), [_pandas_mdd(cus), _pandas_mdd(gaps)])
+
+
+def test_drawdown_stats_ignore_nan_days():
+    cus = np.array([0.0, 5.0, np.nan, 3.0, 1.0, np.nan, 6.0])
+    stats = drawdown_stats(cus)
+    # 略過 NaN 後的曲線：0, 5, 3, 1, 6
+    assert stats["最大回撤"] == 4.0
+    np.testing.assert_allclose(stats["潰瘍指數"], np.sqrt((2.0**2 + 4.0**2) / 5))
+    assert stats["水下時間比例"] == 2 / 5
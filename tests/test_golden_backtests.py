@@ -0,0 +1,135 @@
+# 四個策略的黃金回歸測試
+# golden/baseline_backtests.npz 是以重構前的原始策略（baseline commit 的 src/lib/backtest/strategy_*.py，
+# 逐日 df.iloc 迴圈的版本）在 data/TPE-sample*.csv 上產生的結果，保存每個回測新增的欄位與欄位順序。
+# 共用引擎（run_position_engine）的事件驅動、逐日、編譯核心三條路徑，以及批次模式，
+# 都必須與原始結果逐位元相同；之後所有的最佳化都以這個等價性為前提。
+#
+# 重新產生（需在 baseline 版本的 src/ 下執行，否則只是把目前的結果存成黃金值）：
+#     cd <baseline>/src && python <repo>/tests/test_golden_backtests.py <repo>/tests/golden/baseline_backtests.npz
+
+import inspect
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+GOLDEN = Path(__file__).resolve().parent / "golden" / "baseline_backtests.npz"
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+SAMPLES = ("TPE-sample1", "TPE-sample2", "TPE-sample3")
+ENGINE_PATHS = ("event", "bar", "kernel")
+
+# 策略名稱 → 測試的參數組（第 0 組為預設參數）
+CASES = {
+    "backtest_strategy": [{}, dict(bb_period=26, bb_std=1.75, drop_threshold=0.65)],
+    "backtest_strategy_two": [{}, dict(short_ma_period=7, long_ma_period=12)],
+    "backtest_strategy_three": [{}, dict(ma_short=2, ma_medium=8, ma_long=14)],
+    "backtest_strategy_four": [{}, dict(bb_period=8, bb_std=1.59, ma_long_period=12)],
+}
+
+
+def _strategies():
+    from lib.backtest.strategy_four import backtest_strategy_four, backtest_strategy_four_batch
+    from lib.backtest.strategy_one import backtest_strategy, backtest_strategy_batch
+    from lib.backtest.strategy_three import backtest_strategy_three, backtest_strategy_three_batch
+    from lib.backtest.strategy_two import backtest_strategy_two, backtest_strategy_two_batch
+
+    return {
+        "backtest_strategy": (backtest_strategy, backtest_strategy_batch),
+        "backtest_strategy_two": (backtest_strategy_two, backtest_strategy_two_batch),
+        "backtest_strategy_three": (backtest_strategy_three, backtest_strategy_three_batch),
+        "backtest_strategy_four": (backtest_strategy_four, backtest_strategy_four_batch),
+    }
+
+
+@pytest.fixture(scope="module")
+def golden():
+    with np.load(GOLDEN) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _load(sample):
+    return pd.read_csv(DATA_DIR / f"{sample}.csv")
+
+
+def _full_params(func, params):
+    """補上預設值，得到完整的參數組（批次模式需要每個參數的值）。"""
+    defaults = {
+        name: p.default
+        for name, p in inspect.signature(func).parameters.items()
+        if name not in ("df", "return_trades", "costs", "sizing")
+    }
+    return {**defaults, **params}
+
+
+@pytest.mark.parametrize("engine_path", ENGINE_PATHS, indirect=True)
+@pytest.mark.parametrize("sample", SAMPLES)
+@pytest.mark.parametrize("strategy", list(CASES))
+def test_single_backtest_matches_baseline(golden, engine_path, sample, strategy):
+    df = _load(sample)
+    original = df.copy()
+    func = _strategies()[strategy][0]
+    for k, params in enumerate(CASES[strategy]):
+        key = f"{sample}/{strategy}/{k}"
+        result = func(df, **params)
+        assert list(result.columns) == golden[key + "/columns"].tolist()
+        for column in result.columns:
+            if column in df.columns:
+                pd.testing.assert_series_equal(result[column], original[column])
+                continue
+            expected = golden[f"{key}/{column}"]
+            actual = result[column].to_numpy()
+            assert actual.dtype == expected.dtype, f"{key}/{column}"
+            np.testing.assert_array_equal(actual, expected, err_msg=f"{key}/{column}")
+    # 回測不可修改傳入的 df
+    pd.testing.assert_frame_equal(df, original)
+
+
+@pytest.mark.parametrize("engine_path", ENGINE_PATHS, indirect=True)
+@pytest.mark.parametrize("sample", SAMPLES)
+@pytest.mark.parametrize("strategy", list(CASES))
+def test_batch_backtest_matches_baseline(golden, engine_path, sample, strategy):
+    df = _load(sample)
+    single, batch = _strategies()[strategy]
+    lanes = [_full_params(single, params) for params in CASES[strategy]]
+    columns = {name: [p[name] for p in lanes] for name in lanes[0]}
+    ret, cus, position = batch(df, **columns)
+    for k in range(len(lanes)):
+        key = f"{sample}/{strategy}/{k}"
+        np.testing.assert_array_equal(ret[:, k], golden[key + "/ret"], err_msg=key)
+        np.testing.assert_array_equal(cus[:, k], golden[key + "/cus"], err_msg=key)
+        np.testing.assert_array_equal(position[:, k], golden[key + "/position"], err_msg=key)
+
+
+def _write_golden(path):
+    """以目前 import 到的策略產生黃金值（只應在 baseline 版本上執行）。"""
+    from lib.backtest.strategy_four import backtest_strategy_four
+    from lib.backtest.strategy_one import backtest_strategy
+    from lib.backtest.strategy_three import backtest_strategy_three
+    from lib.backtest.strategy_two import backtest_strategy_two
+
+    funcs = {
+        "backtest_strategy": backtest_strategy,
+        "backtest_strategy_two": backtest_strategy_two,
+        "backtest_strategy_three": backtest_strategy_three,
+        "backtest_strategy_four": backtest_strategy_four,
+    }
+    arrays = {}
+    for sample in SAMPLES:
+        df = _load(sample)
+        for strategy, cases in CASES.items():
+            for k, params in enumerate(cases):
+                # 原始版本會在傳入的 df 上新增欄位，每次都傳入副本
+                result = funcs[strategy](df.copy(), **params)
+                key = f"{sample}/{strategy}/{k}"
+                arrays[key + "/columns"] = np.array(list(result.columns))
+                for column in result.columns:
+                    if column not in df.columns:
+                        arrays[f"{key}/{column}"] = result[column].to_numpy()
+    np.savez_compressed(path, **arrays)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+    _write_golden(sys.argv[1])
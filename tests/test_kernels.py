@@ -0,0 +1,111 @@
+# 編譯核心（lib.kernels）與 NumPy 引擎、pandas rolling 的逐位元比對
+# 「python」以未編譯的原始函數執行（未安裝 numba 時的行為），「jit」為 numba 編譯後的版本。
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import kernels
+from lib.backtest.engine import run_position_engine_batch
+
+
+@pytest.fixture(params=["python", "jit"])
+def loop(request):
+    """回傳取得核心函數的方法：python 為未編譯的函數，jit 為 numba 編譯的函數。"""
+    if request.param == "jit" and not kernels.NUMBA_AVAILABLE:
+        pytest.skip("未安裝 numba")
+
+    def get(name):
+        func = getattr(kernels, name)
+        return getattr(func, "py_func", func) if request.param == "python" else func
+
+    return get
+
+
+def _signals(seed, L=300, N=6):
+    """隨機的多空進出場訊號（含平盤的收盤價，讓未實現損益出現 0）。"""
+    rng = np.random.default_rng(seed)
+    close = np.round(100 + np.cumsum(rng.normal(0, 1, L)), 1)
+
+    def price():
+        return close[:, None] + np.round(rng.normal(0, 0.5, (L, N)), 1)
+
+    def flag(p):
+        return rng.random((L, N)) < p
+
+    return close, dict(
+        long_entry=flag(0.08), long_entry_price=price(),
+        long_exit=flag(0.1), long_exit_price=price(),
+        short_entry=flag(0.05), short_entry_price=price(),
+        short_exit=flag(0.1), short_exit_price=price(),
+    )
+
+
+@pytest.mark.parametrize("engine_path", ["event", "bar"], indirect=True)
+@pytest.mark.parametrize("exit_first", [False, True])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_position_loop_matches_numpy_engine(loop, engine_path, exit_first, seed):
+    close, signals = _signals(seed)
+    expected_ret, expected_cus, expected_position, trades = run_position_engine_batch(
+        close, **signals, exit_first=exit_first, record_trades=True
+    )
+    assert (trades["side"] == -1).any() and (trades["side"] == 1).any()
+
+    shape = expected_ret.shape
+    ret, cus, exit_entry_price = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    positions = np.zeros(shape, dtype=np.int64)
+    exit_side = np.zeros(shape, dtype=np.int8)
+    exit_entry_bar = np.zeros(shape, dtype=np.int64)
+    loop("position_loop")(
+        np.broadcast_to(close[:, None], shape), *signals.values(), exit_first,
+        ret, cus, positions, exit_side, exit_entry_bar, exit_entry_price,
+    )
+
+    np.testing.assert_array_equal(ret, expected_ret)
+    np.testing.assert_array_equal(cus, expected_cus)
+    np.testing.assert_array_equal(positions, expected_position)
+    # 出場記錄與交易明細一致（兩者皆依出場 K 棒、再依 lane 排序）
+    bars, lanes = np.nonzero(exit_side)
+    np.testing.assert_array_equal(bars, trades["exit_bar"])
+    np.testing.assert_array_equal(lanes, trades["lane"])
+    np.testing.assert_array_equal(exit_side[bars, lanes], trades["side"])
+    np.testing.assert_array_equal(exit_entry_bar[bars, lanes], trades["entry_bar"])
+    np.testing.assert_array_equal(exit_entry_price[bars, lanes], trades["entry_price"])
+
+
+def _rolling_inputs():
+    """各欄：隨機價格、含 NaN 的價格、連續相同值、正負交錯、全為 NaN。"""
+    rng = np.random.default_rng(0)
+    L = 120
+    prices = 100 + np.cumsum(rng.normal(0, 1, L))
+    holes = prices.copy()
+    holes[[0, 5, 6, 40, 41, 42, 90]] = np.nan
+    flat = np.repeat([10.0, 10.5, 10.5, 7.25], L // 4)
+    flat[60:100] = 3.3
+    signed = rng.normal(0, 1e-3, L)
+    signed[20:50] = -2.0
+    return np.column_stack([prices, holes, flat, signed, np.full(L, np.nan)])
+
+
+@pytest.mark.parametrize("window", [1, 2, 5, 20])
+def test_rolling_mean_loop_matches_pandas(loop, window):
+    values = _rolling_inputs()
+    out = np.empty(values.shape)
+    loop("rolling_mean_loop")(values, window, out)
+    expected = pd.DataFrame(values).rolling(window).mean().to_numpy()
+    np.testing.assert_array_equal(out, expected)
+
+
+@pytest.mark.parametrize("ddof", [0, 1])
+@pytest.mark.parametrize("window", [1, 2, 5, 20])
+def test_rolling_std_loop_matches_pandas(loop, window, ddof):
+    values = _rolling_inputs()
+    out = np.empty(values.shape)
+    loop("rolling_std_loop")(values, window, ddof, out)
+    expected = pd.DataFrame(values).rolling(window).std(ddof=ddof).to_numpy()
+    np.testing.assert_array_equal(out, expected)
+    # 視窗內全為相同值時標準差恰為 0
+    flat = values[:, 2]
+    constant = pd.Series(flat).rolling(window).apply(lambda w: np.ptp(w) == 0, raw=True) == 1
+    if window > ddof:
+        assert (out[constant.to_numpy(), 2] == 0).all()
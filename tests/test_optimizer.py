@@ -0,0 +1,50 @@
+import optuna
+import pandas as pd
+from optuna.search_space import intersection_search_space
+
+from lib.backtest.optimizer import EQUITY, optimize_strategy, study_results
+
+SPACE = {"ma_short": (2, 10), "ma_medium": (3, 12), "ma_long": (5, 12), "k": (0.5, 2.0)}
+CONSTRAINTS = ["ma_short < ma_medium < ma_long"]
+
+
+def _backtest(df, **params):
+    return params
+
+
+def _performance(params):
+    # 與參數相關的任意成績，讓取樣器有東西可以比較
+    return {EQUITY: params["ma_long"] - params["ma_short"] + params["k"]}
+
+
+def _frame():
+    return pd.DataFrame({"收盤價": [1.0, 2.0, 3.0]})
+
+
+def _optimize(**kwargs):
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    return optimize_strategy(
+        _frame(), _backtest, SPACE, CONSTRAINTS, performance_func=_performance,
+        prefixes=(1.0,), sampler="random", **kwargs,
+    )
+
+
+def test_constrained_params_use_fixed_ranges():
+    study = _optimize(n_trials=40, seed=0)
+    trials = study.get_trials(states=(optuna.trial.TrialState.COMPLETE,))
+    # 每個 trial 都可行，不需要剪枝
+    assert len(trials) == 40
+    # 每個參數的分佈在所有 trial 中都相同，因此全部留在 relative search space 中
+    assert len(intersection_search_space(trials)) == len(SPACE)
+    results = study_results(study)
+    assert (results["ma_short"] < results["ma_medium"]).all()
+    assert (results["ma_medium"] < results["ma_long"]).all()
+    assert results["ma_short"].between(2, 10).all() and results["ma_long"].between(5, 12).all()
+
+
+def test_storage_resumes_without_study_name(tmp_path):
+    path = tmp_path / "study.db"
+    first = _optimize(n_trials=5, seed=0, storage_path=str(path))
+    second = _optimize(n_trials=5, seed=1, storage_path=str(path))
+    assert first.study_name == second.study_name
+    assert len(second.trials) == 10
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from lib.backtest.portfolio import run_portfolio
+from lib.backtest.strategy_two import backtest_strategy_two
+from lib.price_store import build_price_store
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    # sample2: 2006–2011、sample1: 2012–2017，日期互不重疊
+    sources = [DATA_DIR / "TPE-sample1.csv", DATA_DIR / "TPE-sample2.csv"]
+    return build_price_store(tmp_path_factory.mktemp("prices") / "store", sources)
+
+
+@pytest.mark.parametrize("allocation", ["equal", "points", {"TPE-sample1": 1, "TPE-sample2": 3}])
+def test_symbol_without_data_is_dropped(store, allocation):
+    # 2013 年只有 sample1 有價格
+    portfolio, symbols, _ = run_portfolio(
+        store, backtest_strategy_two, start="2013-01-01", end="2013-12-31", allocation=allocation
+    )
+    assert np.isfinite(portfolio[["ret", "cus", "equity", "BH"]].to_numpy()).all()
+    assert list(symbols.index) == ["TPE-sample1"]
+
+    # 與只選 sample1 的投資組合相同（權重重新正規化）
+    alone, _, _ = run_portfolio(
+        store, backtest_strategy_two, symbols=["TPE-sample1"],
+        start="2013-01-01", end="2013-12-31",
+        allocation="points" if allocation == "points" else "equal",
+    )
+    np.testing.assert_allclose(portfolio["cus"], alone["cus"], rtol=1e-12)
+
+
+def test_no_symbol_with_data(store):
+    with pytest.raises(ValueError, match="沒有任何代號"):
+        run_portfolio(store, backtest_strategy_two, start="2030-01-01", end="2030-12-31")
@@ -0,0 +1,47 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from lib.price_store import build_price_store
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+SOURCES = [DATA_DIR / "TPE-sample1.csv", DATA_DIR / "TPE-sample2.csv"]
+
+
+def test_rebuilds_existing_store(tmp_path):
+    first = build_price_store(tmp_path / "store", SOURCES)
+    second = build_price_store(tmp_path / "store", SOURCES[:1])
+    assert first.symbols == ["TPE-sample1", "TPE-sample2"]
+    assert second.symbols == ["TPE-sample1"]
+
+
+def test_refuses_to_replace_other_directories(tmp_path):
+    target = tmp_path / "data"
+    target.mkdir()
+    (target / "prices.csv").write_text("keep me", encoding="utf-8")
+    with pytest.raises(FileExistsError):
+        build_price_store(target, SOURCES)
+    assert (target / "prices.csv").read_text(encoding="utf-8") == "keep me"
+
+    with pytest.raises(FileExistsError):
+        build_price_store(target / "prices.csv", SOURCES)
+
+
+def test_rejects_duplicate_dates(tmp_path):
+    source = tmp_path / "dup.csv"
+    shutil.copyfile(SOURCES[0], source)
+    lines = source.read_text(encoding="utf-8-sig").splitlines(keepends=True)
+    source.write_text("".join(lines + lines[-1:]), encoding="utf-8-sig")
+    with pytest.raises(ValueError, match="重複的日期"):
+        build_price_store(tmp_path / "store", [source])
+    assert not (tmp_path / "store").exists()
+
+
+def test_store_matches_sources(tmp_path):
+    store = build_price_store(tmp_path / "store", SOURCES)
+    frame = store.frame("TPE-sample2")
+    _, values = store.array(["TPE-sample2"], fields=["收盤價"])
+    listed = ~np.isnan(values[:, 0, 0])
+    np.testing.assert_array_equal(values[listed, 0, 0], frame["收盤價"].to_numpy())
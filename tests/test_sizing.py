@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.backtest.costs import CostModel
+from lib.backtest.sizing import FixedFraction, FixedShares
+from lib.backtest.strategy_two import backtest_strategy_two, backtest_strategy_two_batch
+
+SAMPLE = Path(__file__).resolve().parents[1] / "data" / "TPE-sample1.csv"
+
+
+def _low_priced():
+    # 價格縮小到約 7 元，1000 股的手續費（約 10 元）低於最低手續費 20 元
+    df = pd.read_csv(SAMPLE)
+    for column in ("開盤價", "最高價", "最低價", "收盤價"):
+        df[column] = df[column] / 1000
+    return df
+
+
+@pytest.mark.parametrize("quantity", [1, 1000])
+def test_min_fee_is_charged_once_per_order(quantity):
+    costs = CostModel(fee_rate=0.001425, min_fee=20, tax_rate=0.003, quantity=quantity)
+    result, trades = backtest_strategy_two(
+        _low_priced(), return_trades=True, costs=costs, sizing=FixedShares(1000)
+    )
+    assert len(trades) > 0
+    assert (trades["units"] == 1000).all()
+    # 委託的單位數與 quantity 無關：每筆交易買、賣各收一次最低手續費
+    expected = 2 * 20 + 1000 * trades["exit_price"] * 0.003
+    np.testing.assert_allclose(trades["cost"], expected)
+    gross = 1000 * (trades["exit_price"] - trades["entry_price"])
+    np.testing.assert_allclose(trades["pnl"], gross - expected)
+    np.testing.assert_allclose(result["cost"].sum(), expected.sum())
+    np.testing.assert_allclose(result["ret"].sum(), trades["pnl"].sum())
+
+
+def test_sized_costs_follow_units():
+    costs = CostModel.taiwan_stock()
+    sizer = FixedFraction(0.5, capital=100_000, lot_size=1)
+    result, trades = backtest_strategy_two(
+        _low_priced(), return_trades=True, costs=costs, sizing=sizer
+    )
+    units = trades["units"]
+    prices = trades["entry_price"], trades["exit_price"]
+    expected = sum(np.maximum(units * price * 0.001425, 20) for price in prices)
+    expected += units * trades["exit_price"] * 0.003
+    np.testing.assert_allclose(trades["cost"], expected)
+    # 複利的權益已扣除成本金額
+    np.testing.assert_allclose(result["equity"].iloc[-1], 100_000 + result["cus"].iloc[-1])
+
+    ret, cus, _ = backtest_strategy_two_batch(
+        _low_priced(), [5], [20], costs=costs, sizing=sizer
+    )
+    np.testing.assert_allclose(ret[:, 0], result["ret"])
+    np.testing.assert_allclose(cus[:, 0], result["cus"])
+
+
+def test_points_mode_costs_are_per_unit():
+    costs = CostModel.taiwan_stock()
+    _, trades = backtest_strategy_two(_low_priced(), return_trades=True, costs=costs)
+    assert np.isnan(trades["units"]).all()
+    # 點數模式：最低手續費依 quantity（一張 1000 股）攤到每股
+    prices = trades["entry_price"], trades["exit_price"]
+    expected = sum(np.maximum(price * 0.001425, 20 / 1000) for price in prices)
+    expected += trades["exit_price"] * 0.003
+    np.testing.assert_allclose(trades["cost"], expected)
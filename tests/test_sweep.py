@@ -0,0 +1,95 @@
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from lib.backtest.backtest_adjusted import sensitivity_analysis_four, sensitivity_analysis_one
+from lib.backtest.costs import CostModel
+from lib.backtest.sizing import FixedShares
+from lib.backtest.strategy_two import backtest_strategy_two, backtest_strategy_two_batch
+from lib.backtest.sweep import evaluate_param_sets, grid_sampler, random_sampler, run_sweep
+from lib.performance_analysis import calculate_strategy_performance
+
+SAMPLE = Path(__file__).resolve().parents[1] / "data" / "TPE-sample1.csv"
+
+
+def _recording_backtest(calls):
+    """記下每次回測收到的參數，回傳空的結果。"""
+    def backtest(df, **params):
+        calls.append(params)
+        return df
+    return backtest
+
+
+def _performance(df):
+    return {"score": 0.0}
+
+
+def _frame():
+    return pd.DataFrame({"開盤價": [1.0, 2.0], "收盤價": [1.0, 2.0]})
+
+
+def test_strategy_one_backtests_unrounded_and_reports_rounded():
+    # 原本的策略一以抽樣的原值回測，只在結果表中四捨五入到小數第二位
+    calls = []
+    results = sensitivity_analysis_one(
+        _frame(), _recording_backtest(calls), _performance, iterations=20, seed=0
+    )
+    tested = pd.DataFrame(calls)
+    for name in ("bb_std", "drop_threshold"):
+        assert (tested[name] != tested[name].round(2)).any()
+        assert results[name].tolist() == [round(v, 2) for v in tested[name]]
+    assert results["ma_period"].tolist() == tested["ma_period"].tolist()
+
+
+def test_strategy_four_backtests_rounded_values():
+    # 策略四原本就先四捨五入再回測
+    calls = []
+    ranges = {"bb_period": (5, 20), "bb_std": (0.5, 2.5), "ma_long_period": (5, 30)}
+    results = sensitivity_analysis_four(
+        _frame(), _recording_backtest(calls), _performance, ranges, iterations=20, seed=0
+    )
+    tested = pd.DataFrame(calls)
+    assert tested["bb_std"].tolist() == [round(v, 2) for v in tested["bb_std"]]
+    assert results["bb_std"].tolist() == tested["bb_std"].tolist()
+
+
+def _first_ten(param_space, constraints, iterations, seed=None):
+    return grid_sampler(param_space, constraints)[:10]
+
+
+@pytest.mark.parametrize(
+    "sampler, message",
+    [
+        (random_sampler, "準備進行 20 次隨機參數測試..."),
+        (grid_sampler, "準備進行 36 組網格參數測試..."),
+        (_first_ten, "準備進行 10 組參數測試..."),
+    ],
+)
+def test_sweep_message_follows_sampler(capsys, sampler, message):
+    calls = []
+    space = {"short": (1, 6), "long": (1, 6)}
+    run_sweep(
+        _frame(), _recording_backtest(calls), _performance, space,
+        iterations=20, sampler=sampler, seed=0,
+    )
+    assert capsys.readouterr().out.splitlines()[0] == message
+
+
+@pytest.mark.parametrize("sizing", [None, FixedShares(1000)])
+def test_batch_sweep_reports_costs_like_single(sizing):
+    df = pd.read_csv(SAMPLE)
+    costs = CostModel.taiwan_stock()
+    param_sets = [{"short_ma_period": s, "long_ma_period": l} for s in (3, 5) for l in (20, 41)]
+    args = (
+        df, partial(backtest_strategy_two, costs=costs, sizing=sizing),
+        calculate_strategy_performance, param_sets,
+    )
+    single = evaluate_param_sets(*args)
+    batch = evaluate_param_sets(
+        *args, batch_func=partial(backtest_strategy_two_batch, costs=costs, sizing=sizing)
+    )
+    assert "交易成本" in batch.columns and (batch["交易成本"] > 0).all()
+    pd.testing.assert_frame_equal(batch[single.columns], single, check_dtype=False)
+    assert set(batch.columns) == set(single.columns)
@@ -0,0 +1,115 @@
+import multiprocessing
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.backtest.costs import CostModel
+from lib.backtest.sizing import FixedFraction, FixedShares, VolatilityTarget
+from lib.backtest.strategy_two import backtest_strategy_two, backtest_strategy_two_batch
+from lib.backtest.sweep import evaluate_param_sets
+from lib.backtest.sweep_store import SweepStore, strategy_key
+from lib.performance_analysis import calculate_strategy_performance
+from lib.technical_indicators import get_indicator_method, set_indicator_method
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+SAMPLE = Path(__file__).resolve().parents[1] / "data" / "TPE-sample1.csv"
+
+
+@pytest.fixture
+def bank_method():
+    method = get_indicator_method()
+    set_indicator_method("bank")
+    yield
+    set_indicator_method(method)
+
+
+_KEY_SCRIPT = """
+from functools import partial
+from lib.backtest.costs import CostModel
+from lib.backtest.sizing import VolatilityTarget
+from lib.backtest.strategy_two import backtest_strategy_two, backtest_strategy_two_batch
+from lib.backtest.sweep_store import SweepStore, strategy_key
+from lib.performance_analysis import calculate_strategy_performance
+func = partial(backtest_strategy_two, costs=CostModel.taiwan_stock(), sizing=VolatilityTarget(0.2))
+print(strategy_key(func, calculate_strategy_performance))
+"""
+
+
+def _key(**bound):
+    return strategy_key(partial(backtest_strategy_two, **bound), calculate_strategy_performance)
+
+
+def test_bound_sizer_key_is_stable_across_processes():
+    func = partial(
+        backtest_strategy_two, costs=CostModel.taiwan_stock(), sizing=VolatilityTarget(0.2)
+    )
+    key = strategy_key(func, calculate_strategy_performance)
+    assert " at 0x" not in key
+    other = subprocess.run(
+        [sys.executable, "-c", _KEY_SCRIPT], cwd=SRC, capture_output=True, text=True, check=True
+    )
+    assert other.stdout.strip() == key
+
+
+def test_bound_args_that_change_results_change_the_key():
+    assert _key(sizing=FixedShares(1000)) == _key(sizing=FixedShares(1000))
+    assert _key(sizing=FixedShares(1000)) != _key(sizing=FixedShares(2000))
+    assert _key(sizing=FixedFraction(0.5)) != _key(sizing=FixedFraction(0.5, lot_size=1000))
+    # 沒有自訂 repr 的物件與大型陣列也以內容描述，而不是記憶體位址或省略的 repr
+    class Config:
+        def __init__(self, weights):
+            self.weights = weights
+
+    a, b = np.zeros(5000), np.zeros(5000)
+    b[2500] = 1
+    assert _key(config=Config(a)) == _key(config=Config(a.copy()))
+    assert _key(config=Config(a)) != _key(config=Config(b))
+
+
+def test_indicator_method_is_part_of_the_key(bank_method):
+    bank = _key()
+    set_indicator_method("rolling")
+    assert _key() != bank
+
+
+def _method_performance(df):
+    # 回報執行回測的行程所使用的指標計算方式
+    return {"bank": float(get_indicator_method() == "bank")}
+
+
+def test_spawned_workers_use_the_indicator_method(bank_method):
+    df = pd.read_csv(SAMPLE)
+    param_sets = [{"short_ma_period": s, "long_ma_period": 20} for s in (3, 5, 8, 13)]
+    # spawn 啟動的子行程不會繼承主行程的設定
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+        results = evaluate_param_sets(
+            df, backtest_strategy_two, _method_performance, param_sets, executor=executor
+        )
+    assert (results["bank"] == 1.0).all()
+
+
+def test_batch_func_is_part_of_the_key(tmp_path):
+    # 批次函數以 partial 綁定成本模型時，結果與未綁定的批次函數不同，不可互相沿用
+    df = pd.read_csv(SAMPLE)
+    param_sets = [{"short_ma_period": s, "long_ma_period": 20} for s in (3, 5, 8)]
+    args = (df, backtest_strategy_two, calculate_strategy_performance, param_sets)
+    costed = partial(backtest_strategy_two_batch, costs=CostModel.taiwan_stock())
+    store = SweepStore(tmp_path / "sweeps.sqlite")
+    try:
+        with_costs = evaluate_param_sets(*args, batch_func=costed, store=store)
+        without_costs = evaluate_param_sets(
+            *args, batch_func=backtest_strategy_two_batch, store=store
+        )
+    finally:
+        store.close()
+    expected = evaluate_param_sets(*args, batch_func=backtest_strategy_two_batch)
+    pd.testing.assert_frame_equal(without_costs, expected)
+    equity = "最終權益 (Mark-to-Market)"
+    assert (with_costs[equity] < without_costs[equity]).all()
@@ -0,0 +1,36 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from lib.backtest.strategy_two import backtest_strategy_two_batch
+from lib.backtest.walk_forward import walk_forward
+from lib.technical_indicators import get_indicator_method, set_indicator_method
+
+SAMPLE = Path(__file__).resolve().parents[1] / "data" / "TPE-sample1.csv"
+
+
+def _method_performance(df):
+    # 回報執行回測的行程所使用的指標計算方式
+    return {"bank": float(get_indicator_method() == "bank")}
+
+
+def test_spawned_workers_use_the_indicator_method():
+    df = pd.read_csv(SAMPLE)
+    space = {"short_ma_period": (3, 10), "long_ma_period": (20, 40)}
+    method = get_indicator_method()
+    set_indicator_method("bank")
+    try:
+        # spawn 啟動的子行程不會繼承主行程的設定
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+            windows, _ = walk_forward(
+                df, backtest_strategy_two_batch, space, train_size=300, test_size=200,
+                iterations=5, seed=0, objective="bank", performance_func=_method_performance,
+                executor=executor,
+            )
+    finally:
+        set_indicator_method(method)
+    assert len(windows) > 1
+    assert (windows["訓練期目標值"] == 1.0).all()